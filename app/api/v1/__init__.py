@@ -12,3 +12,4 @@ from app.api.v1 import coupon
 from app.api.v1 import cart
 from app.api.v1 import review
 from app.api.v1 import dashboard
+from app.api.v1 import home
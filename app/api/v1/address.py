@@ -1,4 +1,3 @@
-import uuid
 from datetime import datetime
 
 from flask import Blueprint, request
@@ -6,6 +5,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from jsonschema import validate
 
 from app.extensions import logger, db
+from app.ids import new_id
 from app.models import Address, User
 from app.schema.schema_validator import address_validator
 from app.utils import send_result, send_error
@@ -46,7 +46,7 @@ def post():
     if addresses:
         default = False
 
-    _id = str(uuid.uuid1())
+    _id = new_id()
     data = {
         'id': _id,
         'user_id': get_jwt_identity(),
@@ -4,12 +4,12 @@ from flask import Blueprint
 from flask_jwt_extended import (
     jwt_required, create_access_token,
     jwt_refresh_token_required, get_jwt_identity,
-    create_refresh_token, get_raw_jwt
+    create_refresh_token, get_raw_jwt, get_jwt_claims
 )
 from werkzeug.security import check_password_hash
 
 from app.extensions import jwt, logger
-from app.models import TokenBlacklist, User
+from app.models import RevokedToken, User
 from app.utils import parse_req, FieldString, send_result, send_error, get_datetime_now
 
 ACCESS_EXPIRES = timedelta(days=30)
@@ -17,6 +17,19 @@ REFRESH_EXPIRES = timedelta(days=30)
 api = Blueprint('auth', __name__)
 
 
+def create_tokens(user):
+    """
+    Access and refresh tokens of a user, nothing is written: they carry the token epoch of the user
+    :param user: User
+    :return: dict(access_token, refresh_token)
+    """
+    claims = user.token_claims()
+    return {
+        'access_token': create_access_token(identity=user.id, expires_delta=ACCESS_EXPIRES, user_claims=claims),
+        'refresh_token': create_refresh_token(identity=user.id, expires_delta=REFRESH_EXPIRES, user_claims=claims)
+    }
+
+
 @api.route('/login', methods=['POST'])
 def login():
     """
@@ -48,18 +61,11 @@ def login():
     if not user.status:
         return send_error(message='Tài khoản đã bị vô hiệu hóa.\nVui lòng liên hệ quản trị trang web.')
 
-    access_token = create_access_token(
-        identity=user.id, expires_delta=ACCESS_EXPIRES)
-    refresh_token = create_refresh_token(
-        identity=user.id, expires_delta=REFRESH_EXPIRES)
-
-    # Store the tokens in our store with a status of not currently revoked.
-    TokenBlacklist.add_token_to_database(access_token, user.id)
-    TokenBlacklist.add_token_to_database(refresh_token, user.id)
+    tokens = create_tokens(user)
 
     return send_result(data={
-        'access_token': access_token,
-        'refresh_token': refresh_token,
+        'access_token': tokens['access_token'],
+        'refresh_token': tokens['refresh_token'],
         'username': user.user_name,
         'email': user.email,
         'phone': user.phone,
@@ -85,9 +91,14 @@ def refresh():
     :return:
     """
     current_user_id = get_jwt_identity()
-    access_token = create_access_token(identity=current_user_id)
-
-    TokenBlacklist.add_token_to_database(access_token, current_user_id)
+    claims = get_jwt_claims()
+    if 'epoch' not in claims:
+        # refresh token issued before the epoch claim
+        user = User.find_by_id(current_user_id)
+        if user is None:
+            return send_error(message='Not found user!')
+        claims = user.token_claims()
+    access_token = create_access_token(identity=current_user_id, user_claims=claims)
 
     ret = {
         'access_token': access_token
@@ -103,10 +114,7 @@ def logout():
     Add token to blacklist
     :return:
     """
-    jti = get_raw_jwt()['jti']
-
-    # remove token from database
-    TokenBlacklist.revoke_token(jti)
+    RevokedToken.revoke(get_raw_jwt())
 
     return send_result(message='logout_successfully')
 
@@ -118,8 +126,7 @@ def logout2():
     Endpoint for revoking the current users refresh token
     :return:
     """
-    jti = get_raw_jwt()['jti']
-    TokenBlacklist.revoke_token(jti)
+    RevokedToken.revoke(get_raw_jwt())
     return send_result(message='logout_successfully')
 
 
@@ -155,4 +162,4 @@ def check_if_token_is_revoked(decrypted_token):
     :param decrypted_token:
     :return:
     """
-    return TokenBlacklist.is_token_revoked(decrypted_token)
+    return RevokedToken.is_token_revoked(decrypted_token)
@@ -1,12 +1,12 @@
-import uuid
 from datetime import datetime
 
 from flask import Blueprint, request
 from flask_jwt_extended import jwt_required
 from jsonschema import validate
 
-from app.decorators import admin_required
-from app.extensions import logger
+from app.decorators import admin_required, read_replica
+from app.extensions import logger, catalog, home, reference
+from app.ids import new_id
 from app.models import Author
 from app.schema.schema_validator import author_validator
 from app.utils import send_result, send_error
@@ -38,7 +38,7 @@ def post():
         logger.error('{} Parameters error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="Parameters invalid")
 
-    _id = str(uuid.uuid1())
+    _id = new_id()
 
     data = {
         'id': _id,
@@ -52,6 +52,8 @@ def post():
 
     try:
         author.save_to_db()
+        reference.invalidate('authors')
+        home.invalidate()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while create author")
@@ -94,6 +96,8 @@ def update(author_id):
 
     try:
         author.save_to_db()
+        reference.invalidate('authors')
+        home.invalidate()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while update author")
@@ -119,6 +123,10 @@ def delete(author_id):
     # Also delete all children foreign key
     try:
         author.delete_from_db()
+        # products of the author are deleted with it
+        catalog.invalidate()
+        reference.invalidate('authors')
+        home.invalidate()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while delete author")
@@ -127,6 +135,7 @@ def delete(author_id):
 
 
 @api.route('', methods=['GET'])
+@read_replica
 def get_all():
     """ This api gets all authors.
 
@@ -135,12 +144,25 @@ def get_all():
         Examples:
 
     """
-
-    results = Author.find_all()
-    return send_result(data=list(result.json() for result in results))
+    name = request.args.get('q', None, type=str)
+    page = request.args.get('page', None, type=int)
+    limit = request.args.get('limit', None, type=int)
+
+    if name or page or limit:
+        # name is a prefix, ex: q=Nguy
+        results = Author.search(name, page or 1, limit or 20)
+        res = dict(has_next=results.has_next,
+                   has_prev=results.has_prev,
+                   items=list(result.json() for result in results.items),
+                   page=results.page,
+                   pages=results.pages,
+                   total=results.total)
+        return send_result(data=res)
+    return send_result(data=reference.get('authors', lambda: list(result.json() for result in Author.find_all())))
 
 
 @api.route('/<author_id>', methods=['GET'])
+@read_replica
 def get_by_id(author_id):
     """ This api get information of a author.
 
@@ -1,16 +1,17 @@
-import uuid
 from datetime import datetime
 
 from flask import Blueprint, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from jsonschema import validate
 
+from app import inventory
 from app.decorators import cart_required
 from app.enums import PRODUCT_NOT_FOUND_MSG, PRODUCT_NOT_ENOUGH_MSG, ADD_TO_CART_SUCCESSFULLY_MSG, EMTPY_CART_MSG
 from app.extensions import logger, db
+from app.ids import new_id
 from app.models import Cart, CartItem, Product
 from app.schema.schema_validator import cart_validator
-from app.utils import send_result, send_error, get_datetime_now_s
+from app.utils import send_result, send_error, get_datetime_now_s, parse_fields
 
 api = Blueprint('cart', __name__)
 
@@ -49,7 +50,7 @@ def post():
 
     if not item:
         data = {
-            'id': str(uuid.uuid1()),
+            'id': new_id(),
             'updated_at': get_datetime_now_s(),
             'price': product.price,
             'discount': product.discount,
@@ -66,15 +67,20 @@ def post():
         item.__setattr__('discount', product.discount)
         item.__setattr__('price', product.price)
         item.__setattr__('updated_at', get_datetime_now_s())
-    if item.quantity > product.quantity:
-        return send_error(message=PRODUCT_NOT_ENOUGH_MSG.format(product.title, product.quantity))
     try:
+        # hold the stock for the cart, the other carts only see what is left
+        inventory.reserve(cart.id, product_id, item.quantity)
         db.session.add(item)
         # Tính lại các giá trị của Cart
         cart.calculator_cart()
         db.session.add(cart)
         db.session.commit()
+    except inventory.OutOfStockError:
+        db.session.rollback()
+        return send_error(message=PRODUCT_NOT_ENOUGH_MSG.format(product.title,
+                                                                max(inventory.available(product_id, cart.id) or 0, 0)))
     except Exception as ex:
+        db.session.rollback()
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while add to cart")
 
@@ -120,15 +126,20 @@ def update(cart_item_id):
         item.__setattr__('discount', product.discount)
         item.__setattr__('price', product.price)
         item.__setattr__('updated_at', get_datetime_now_s())
-    if item.quantity > product.quantity:
-        return send_error(message=PRODUCT_NOT_ENOUGH_MSG.format(product.title, product.quantity))
     try:
+        # hold the stock for the cart, the other carts only see what is left
+        inventory.reserve(cart.id, product_id, item.quantity)
         db.session.add(item)
         # Tính lại các giá trị của Cart
         cart.calculator_cart()
         db.session.add(cart)
         db.session.commit()
+    except inventory.OutOfStockError:
+        db.session.rollback()
+        return send_error(message=PRODUCT_NOT_ENOUGH_MSG.format(product.title,
+                                                                max(inventory.available(product_id, cart.id) or 0, 0)))
     except Exception as ex:
+        db.session.rollback()
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while update cart item")
 
@@ -154,6 +165,7 @@ def delete(cart_item_id):
         return send_error(message=EMTPY_CART_MSG)
     # Also delete all children foreign key
     try:
+        inventory.release(cart.id, item.product_id)
         item.delete_from_db()
         # Tính lại các giá trị của Cart
         cart.calculator_cart()
@@ -177,8 +189,9 @@ def get_all():
         Examples:
 
     """
+    fields = parse_fields(request.args.get('fields', None, type=str))
 
-    cart = Cart.find_by_user_id(get_jwt_identity())
-    if len(cart.cart_items) == 0:
+    cart = Cart.find_by_user_id(get_jwt_identity(), Cart.items_options(fields))
+    if not cart.has_items():
         return send_error(message=EMTPY_CART_MSG)
-    return send_result(data=cart.json())
+    return send_result(data=cart.json(fields))
@@ -1,12 +1,12 @@
-import uuid
 from datetime import datetime
 
 from flask import Blueprint, request
 from flask_jwt_extended import jwt_required
 from jsonschema import validate
 
-from app.decorators import admin_required
-from app.extensions import logger
+from app.decorators import admin_required, read_replica
+from app.extensions import logger, catalog, home, reference
+from app.ids import new_id
 from app.models import Category
 from app.schema.schema_validator import category_validator
 from app.utils import send_result, send_error
@@ -36,7 +36,7 @@ def post():
         logger.error('{} Parameters error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="Parameters invalid")
 
-    _id = str(uuid.uuid1())
+    _id = new_id()
 
     data = {
         'id': _id,
@@ -48,6 +48,8 @@ def post():
 
     try:
         category.save_to_db()
+        reference.invalidate('categories')
+        home.invalidate()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while create category")
@@ -90,6 +92,8 @@ def update(category_id):
 
     try:
         category.save_to_db()
+        reference.invalidate('categories')
+        home.invalidate()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while update category")
@@ -115,6 +119,10 @@ def delete(category_id):
     # Also delete all children foreign key
     try:
         category.delete_from_db()
+        # products of the category are deleted with it
+        catalog.invalidate()
+        reference.invalidate('categories')
+        home.invalidate()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while delete category")
@@ -123,6 +131,7 @@ def delete(category_id):
 
 
 @api.route('', methods=['GET'])
+@read_replica
 def get_all():
     """ This api gets all categories.
 
@@ -131,12 +140,25 @@ def get_all():
         Examples:
 
     """
-
-    results = Category.find_all()
-    return send_result(data=list(result.json() for result in results))
+    name = request.args.get('q', None, type=str)
+    page = request.args.get('page', None, type=int)
+    limit = request.args.get('limit', None, type=int)
+
+    if name or page or limit:
+        # name is a prefix, ex: q=Nguy
+        results = Category.search(name, page or 1, limit or 20)
+        res = dict(has_next=results.has_next,
+                   has_prev=results.has_prev,
+                   items=list(result.json() for result in results.items),
+                   page=results.page,
+                   pages=results.pages,
+                   total=results.total)
+        return send_result(data=res)
+    return send_result(data=reference.get('categories', lambda: list(result.json() for result in Category.find_all())))
 
 
 @api.route('/<category_id>', methods=['GET'])
+@read_replica
 def get_by_id(category_id):
     """ This api get information of a category.
 
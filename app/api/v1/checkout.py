@@ -1,13 +1,14 @@
-import uuid
 from datetime import datetime
 
 from flask import Blueprint, request
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from jsonschema import validate
 
-from app.enums import ADDRESS_NOT_FOUND_MSG, EMTPY_CART_MSG, PRODUCT_NOT_FOUND_MSG
+from app import inventory
+from app.enums import ADDRESS_NOT_FOUND_MSG, EMTPY_CART_MSG, PRODUCT_NOT_FOUND_MSG, PRODUCT_NOT_ENOUGH_MSG
 from app.extensions import logger, db
-from app.models import Order, OrderDetail, Product, Address, Cart, Coupon
+from app.ids import new_id
+from app.models import Order, OrderDetail, Product, Address, Cart, Coupon, PurchasedProduct
 from app.schema.schema_validator import checkout_validator
 from app.utils import get_datetime_now_s, send_result, send_error
 
@@ -52,7 +53,7 @@ def post():
 
     # rollback db when an error occurs
     try:
-        _id = str(uuid.uuid1())
+        _id = new_id()
 
         data = {
             'id': _id,
@@ -80,7 +81,7 @@ def post():
             order_detail = OrderDetail()
             product_id = item.product_id
             product = Product.find_by_id(product_id)
-            _id_detail = str(uuid.uuid1())
+            _id_detail = new_id()
             if product is None:
                 return send_error(message=PRODUCT_NOT_FOUND_MSG + " có mã {}".format(product_id))
             detail = {
@@ -94,14 +95,31 @@ def post():
             }
             for key in detail.keys():
                 order_detail.__setattr__(key, detail[key])
+            order_detail.snapshot(product)
             db.session.add(order_detail)
 
+        # conditional decrements, the order fails instead of selling stock that is gone
+        quantities = {}
+        for item in cart.cart_items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        # the stock reserved by this cart is taken, not the one reserved by the others
+        inventory.remove_many(quantities, inventory.REASON_CHECKOUT, order.id, cart.id)
+        inventory.release(cart.id)
+
+        # buyers may review these products, see PurchasedProduct.review_eligibility
+        PurchasedProduct.add(user_id, [item.product_id for item in cart.cart_items], order.id)
+
         # delete item in cart
         cart.cart_items = []
         cart.calculator_cart()
         db.session.add(cart)
 
         db.session.commit()
+    except inventory.OutOfStockError as ex:
+        db.session.rollback()
+        product = Product.find_by_id(ex.product_id)
+        return send_error(message=PRODUCT_NOT_ENOUGH_MSG.format(product.title, product.quantity) if product
+                          else PRODUCT_NOT_FOUND_MSG)
     except Exception as ex:
         db.session.rollback()
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
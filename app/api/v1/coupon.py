@@ -1,12 +1,12 @@
-import uuid
 from datetime import datetime
 
 from flask import Blueprint, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from jsonschema import validate
 
-from app.decorators import admin_required
+from app.decorators import admin_required, read_replica
 from app.extensions import logger, db
+from app.ids import new_id
 from app.models import Coupon, Cart
 from app.schema.schema_validator import coupon_validator
 from app.utils import send_result, send_error, get_datetime_now_s
@@ -47,7 +47,7 @@ def post():
     if coupon:
         return send_error(message="Coupon with code '{}' has exists!".format(code))
 
-    _id = str(uuid.uuid1())
+    _id = new_id()
 
     data = {
         'id': _id,
@@ -179,6 +179,7 @@ def delete(coupon_id):
 @api.route('', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_all():
     """ This api gets all coupons.
 
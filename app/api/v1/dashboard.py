@@ -4,7 +4,7 @@ from io import BytesIO
 from flask import Blueprint, request, send_file
 from flask_jwt_extended import jwt_required
 
-from app.decorators import admin_required
+from app.decorators import admin_required, read_replica
 from app.extensions import logger, db
 from app.models import Product
 from app.utils import send_result, send_error
@@ -16,6 +16,7 @@ api = Blueprint('dashboard', __name__)
 @api.route('', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_chart_data():
     """ This api gets all products.
 
@@ -48,6 +49,7 @@ def get_chart_data():
 @api.route('/revenue', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_revenue():
     """ This api gets revenue data.
 
@@ -80,6 +82,7 @@ def get_revenue():
 @api.route('/profit', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_profit():
     """ This api gets profit data.
 
@@ -112,10 +115,12 @@ def get_profit():
 @api.route('/best-seller', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_best_seller_products():
     try:
         # calculate best seller product from order table
-        results = db.session.execute('SELECT product_id, SUM(quantity) AS TotalQuantity FROM order_details GROUP BY '
+        results = db.session.execute('SELECT product_id, SUM(quantity) AS TotalQuantity FROM order_details '
+                                     'WHERE product_id IS NOT NULL GROUP BY '
                                      'product_id ORDER BY SUM(quantity) DESC LIMIT :val', {'val': 10})
 
         items = []
@@ -136,12 +141,14 @@ def get_best_seller_products():
 @api.route('/best-revenue', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_best_revenue_products():
     try:
         # calculate best seller product from order table
         results = db.session.execute(
-            'SELECT product_id, SUM(quantity)*SUM(price-discount) AS TotalRevenue FROM order_details GROUP BY '
-            'product_id ORDER BY SUM(quantity)*SUM(price-discount) DESC LIMIT :val', {'val': 10})
+            'SELECT product_id, SUM(quantity)*SUM(price-discount) AS TotalRevenue FROM order_details '
+            'WHERE product_id IS NOT NULL GROUP BY product_id '
+            'ORDER BY SUM(quantity)*SUM(price-discount) DESC LIMIT :val', {'val': 10})
 
         items = []
         for row in results:
@@ -159,12 +166,14 @@ def get_best_revenue_products():
 
 
 @api.route('/best-revenue/excel', methods=['GET'])
+@read_replica
 def get_best_revenue_products_excel():
     try:
         # calculate best seller product from order table
         results = db.session.execute(
-            'SELECT product_id, SUM(quantity)*SUM(price-discount) AS TotalRevenue FROM order_details GROUP BY '
-            'product_id ORDER BY SUM(quantity)*SUM(price-discount) DESC LIMIT :val', {'val': 10})
+            'SELECT product_id, SUM(quantity)*SUM(price-discount) AS TotalRevenue FROM order_details '
+            'WHERE product_id IS NOT NULL GROUP BY product_id '
+            'ORDER BY SUM(quantity)*SUM(price-discount) DESC LIMIT :val', {'val': 10})
 
         items = []
         for row in results:
@@ -214,6 +223,7 @@ def get_best_revenue_products_excel():
 @api.route('/import-statistics', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_import_statistics():
     from_date = request.args.get('from-date', 0, type=int)
     to_date = request.args.get('to-date', 9999999999, type=int)
@@ -246,6 +256,7 @@ def get_import_statistics():
 
 
 @api.route('/import-statistics/excel', methods=['GET'])
+@read_replica
 def get_import_statistics_excel():
     from_date = request.args.get('from-date', 0, type=int)
     to_date = request.args.get('to-date', 9999999999, type=int)
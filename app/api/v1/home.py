@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from flask import Blueprint, current_app
+
+from app.extensions import logger, home
+from app.models import Product, Category, Author
+from app.utils import send_result, send_error, get_datetime_now_s
+
+api = Blueprint('home', __name__)
+
+
+def build_home():
+    """
+    Sections of the storefront home page, same content as GET /category, /products/best-seller,
+    /products?sort=newest and /authors
+    """
+    newest = Product.filter('', None, 'newest', 0, 9999999999, current_app.config.get('HOME_NEWEST_LIMIT', 20), 1, 0,
+                            9999999999)
+    return dict(categories=list(category.json() for category in Category.find_all()),
+                best_sellers=list(product.json() for product in
+                                  Product.best_sellers(current_app.config.get('HOME_BEST_SELLER_LIMIT', 10))),
+                newest=list(product.json() for product in newest.items),
+                authors=list(author.json() for author in Author.find_all()),
+                updated_at=get_datetime_now_s())
+
+
+@api.route('', methods=['GET'])
+def get_home():
+    """ This api gets the sections of the storefront home page in one response, from a cache of the worker
+        refreshed in the background (app.home).
+
+        Returns: categories, best_sellers, newest, authors, updated_at
+
+        Examples::
+
+    """
+    try:
+        res = home.get(build_home)
+    except Exception as ex:
+        logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
+        return send_error(message="An error occurred while fetch data")
+    return send_result(data=res)
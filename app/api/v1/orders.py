@@ -4,11 +4,13 @@ from flask import Blueprint, request
 from flask_jwt_extended import jwt_required
 from jsonschema import validate
 
-from app.decorators import admin_required
-from app.extensions import logger
-from app.models import Order
+from app import inventory
+from app.decorators import admin_required, read_replica
+from app.enums import PRODUCT_NOT_ENOUGH_MSG, PRODUCT_NOT_FOUND_MSG
+from app.extensions import logger, db
+from app.models import Order, Product
 from app.schema.schema_validator import order_validator
-from app.utils import send_result, send_error, get_datetime_now
+from app.utils import send_result, send_error, get_datetime_now, parse_fields
 
 api = Blueprint('orders', __name__)
 
@@ -39,11 +41,23 @@ def update_order(order_id):
         logger.error('{} Parameters error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="Parameters invalid")
 
+    old_status = order.status
     order.__setattr__('status', json_data.get('status'))
 
     try:
+        # status 0 is a cancelled order, its stock is back in the warehouse
+        if old_status != 0 and order.status == 0:
+            inventory.release_order(order)
+        elif old_status == 0 and order.status != 0:
+            inventory.remove_many(inventory.order_quantities(order), inventory.REASON_CHECKOUT, order.id)
         order.save_to_db()
+    except inventory.OutOfStockError as ex:
+        db.session.rollback()
+        product = Product.find_by_id(ex.product_id)
+        return send_error(message=PRODUCT_NOT_ENOUGH_MSG.format(product.title, product.quantity) if product
+                          else PRODUCT_NOT_FOUND_MSG)
     except Exception as ex:
+        db.session.rollback()
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while update order")
 
@@ -78,6 +92,7 @@ def delete_order(order_id):
 @api.route('', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_all_orders():
     """ This api gets all orders.
 
@@ -90,11 +105,12 @@ def get_all_orders():
     to_date = request.args.get('to-date', get_datetime_now(), type=int)
     limit = request.args.get('limit', 20, type=int)
     page = request.args.get('page', None, type=int)
+    fields = parse_fields(request.args.get('fields', None, type=str))
 
-    results = Order.search(from_date, to_date, limit, page)
+    results = Order.search(from_date, to_date, limit, page, fields)
     res = dict(has_next=results.has_next,
                has_prev=results.has_prev,
-               items=list(result.json_many() for result in results.items),
+               items=list(result.json_many(fields) for result in results.items),
                page=results.page,
                pages=results.pages,
                total=results.total)
@@ -104,6 +120,7 @@ def get_all_orders():
 @api.route('/<order_id>', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_order_by_id(order_id):
     """ This api get information of a order.
 
@@ -112,8 +129,9 @@ def get_order_by_id(order_id):
         Examples::
 
     """
+    fields = parse_fields(request.args.get('fields', None, type=str))
 
-    order = Order.find_by_id(order_id)
+    order = Order.find_detail_by_id(order_id, fields)
     if not order:
         return send_error(message="Order not found!")
-    return send_result(data=order.json())
+    return send_result(data=order.json(fields))
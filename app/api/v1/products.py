@@ -1,18 +1,24 @@
-import uuid
+import os
 from datetime import datetime
 
 from cloudinary import api as cloudinary_api
-from flask import Blueprint, request
+from flask import Blueprint, request, current_app
 from flask_jwt_extended import jwt_required
 from jsonschema import validate
 
-from app.decorators import admin_required
-from app.extensions import logger, db
-from app.models import Product, Category, ProductImage, Publisher, Author, ProductCost
-from app.schema.schema_validator import product_validator
-from app.utils import send_result, send_error, get_datetime_now_s
+from app import inventory
+from app.decorators import admin_required, read_replica
+from app.enums import PRICE_BUCKETS, IMPORT_EXTENSIONS
+from app.extensions import logger, db, catalog, home, reference
+from app.ids import new_id
+from app.models import Product, Category, ProductImage, Publisher, Author, ProductCost, ProductReview, ProductRating
+from app.product_import import ProductImporter, iter_rows
+from app.schema.schema_validator import product_validator, restock_validator
+from app.utils import send_result, send_error, get_datetime_now_s, parse_fields
 
 api = Blueprint('products', __name__)
+# what a product card shows, the related products of GET /<product_id>/detail
+CARD_FIELDS = {'id', 'title', 'price', 'discount', 'images'}
 
 
 @api.route('/', methods=['POST'])
@@ -63,7 +69,7 @@ def post():
     if author is None:
         return send_error(message="Author not found!")
 
-    _id = str(uuid.uuid1())
+    _id = new_id()
 
     data = {
         'id': _id,
@@ -86,7 +92,7 @@ def post():
         product.__setattr__(key, data[key])
 
     data_cost = {
-        'id': str(uuid.uuid1()),
+        'id': new_id(),
         'create_at': get_datetime_now_s(),
         'quantity': quantity,
         'cost': buy_price,
@@ -107,7 +113,10 @@ def post():
                 if product_image is not None:
                     product_image.product_id = product.id
                     db.session.add(product_image)
+        inventory.record([inventory.movement(_id, quantity, inventory.REASON_CREATE, product_cost.id)])
         db.session.commit()
+        catalog.invalidate()
+        home.invalidate()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while create product")
@@ -115,6 +124,46 @@ def post():
     return send_result(message="Create product successfully", data=product.json())
 
 
+@api.route('/import', methods=['POST'])
+@jwt_required
+@admin_required()
+def import_products():
+    """
+    Function: Create many products from a file, see app.product_import for the columns
+
+    Input: file (csv, xlsx, jsonl), chunk_size: rows per transaction, default 500
+
+    Output: number of created and failed rows, errors: [{row, message}]
+    """
+
+    try:
+        uploaded_file = request.files['file']
+        file_ext = os.path.splitext(uploaded_file.filename or '')[1].lower()
+        chunk_size = request.args.get('chunk_size', 500, type=int)
+        if file_ext not in IMPORT_EXTENSIONS:
+            return send_error(message="File must be one of {}".format(', '.join(IMPORT_EXTENSIONS)))
+    except Exception as ex:
+        logger.error('{} Parameters error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
+        return send_error(message="Parameters invalid")
+
+    try:
+        result = ProductImporter(chunk_size=chunk_size).run(iter_rows(uploaded_file.stream, file_ext))
+    except Exception as ex:
+        db.session.rollback()
+        logger.error('{} An error occurred while import products: '.format(
+            datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
+        return send_error(message="An error occurred while import products")
+    finally:
+        catalog.invalidate()
+        home.invalidate()
+        # the importer creates the categories, authors and publishers it does not find
+        for name in ('categories', 'authors', 'publishers'):
+            reference.invalidate(name)
+
+    return send_result(message="Imported {} products, {} rows failed".format(result['created'], result['failed']),
+                       data=result)
+
+
 @api.route('/<product_id>', methods=['PUT'])
 @jwt_required
 @admin_required()
@@ -160,6 +209,8 @@ def update_product(product_id: str):
                     db.session.add(product_image)
 
         db.session.commit()
+        catalog.invalidate()
+        home.invalidate()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while update product")
@@ -197,7 +248,7 @@ def additional_product(product_id: str):
         return send_error(message="Parameters invalid")
 
     data_cost = {
-        'id': str(uuid.uuid1()),
+        'id': new_id(),
         'create_at': get_datetime_now_s(),
         'quantity': quantity,
         'cost': buy_price,
@@ -209,20 +260,60 @@ def additional_product(product_id: str):
     for key in data_cost.keys():
         product_cost.__setattr__(key, data_cost[key])
 
-    product.__setattr__("quantity", product.quantity + quantity)
-
     try:
-        db.session.add(product)
         db.session.add(product_cost)
-
+        # atomic increment, a concurrent purchase or restock is not overwritten
+        inventory.add(product_id, quantity, inventory.REASON_RESTOCK, product_cost.id)
         db.session.commit()
     except Exception as ex:
+        db.session.rollback()
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while update product")
 
     return send_result(data=product.json(), message="Import additional product successfully!")
 
 
+@api.route('/restock', methods=['POST'])
+@jwt_required
+@admin_required()
+def restock():
+    """ This is api for the vendor imports stock of many products at once.
+
+        Request Body: items: [{product_id, quantity, buy_price}], content
+
+        Returns: Success / Error message, unknown product ids
+
+        Examples::
+
+    """
+
+    try:
+        json_data = request.get_json()
+        # Check valid params
+        validate(instance=json_data, schema=restock_validator)
+        items = json_data.get('items')
+        content = json_data.get('content', None)
+    except Exception as ex:
+        logger.error('{} Parameters error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
+        return send_error(message="Parameters invalid")
+
+    # all or nothing, nothing is stocked when a product is unknown
+    missing = Product.find_missing_ids(item['product_id'] for item in items)
+    if missing:
+        return send_error(message="Product not found!", data=dict(product_ids=missing))
+
+    try:
+        updated = inventory.restock(items, content)
+        db.session.commit()
+    except Exception as ex:
+        db.session.rollback()
+        logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
+        return send_error(message="An error occurred while update product")
+
+    return send_result(data=dict(products=updated, entries=len(items)),
+                       message="Import additional product successfully!")
+
+
 @api.route('/<product_id>', methods=['DELETE'])
 @jwt_required
 @admin_required()
@@ -249,6 +340,8 @@ def delete_product(product_id: str):
         #     os.remove(os.path.join(PATH_IMAGE, image.filename))
         # Also delete all children foreign key
         product.delete_from_db()
+        catalog.invalidate()
+        home.invalidate()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while deleting product")
@@ -257,6 +350,7 @@ def delete_product(product_id: str):
 
 
 @api.route('', methods=['GET'])
+@read_replica
 def get_all():
     """ This api gets all products.
 
@@ -275,18 +369,55 @@ def get_all():
     max_price = request.args.get('max_price', 9999999999, type=int)
     from_date = request.args.get('from_date', 0, type=int)
     to_date = request.args.get('to_date', 9999999999, type=int)
+    # ex: fields=id,title,price, also skips loading the relationships not listed
+    fields = parse_fields(request.args.get('fields', None, type=str))
 
-    results = Product.filter(name, category_id, sort, min_price, max_price, limit, page, from_date, to_date)
+    results = Product.filter(name, category_id, sort, min_price, max_price, limit, page, from_date, to_date, fields)
     res = dict(has_next=results.has_next,
                has_prev=results.has_prev,
-               items=list(result.json() for result in results.items),
+               items=list(result.json(fields) for result in results.items),
                page=results.page,
                pages=results.pages,
                total=results.total)
     return send_result(data=res)
 
 
+@api.route('/facets', methods=['GET'])
+@read_replica
+def get_facets():
+    """ This api gets the number of products per category, author, publisher and price bucket of a search.
+
+        Query: same filters as GET /products (q, category, min_price, max_price, from_date, to_date),
+        price_buckets: comma separated lower bounds of the price buckets, ex: 0,50000,100000
+
+        Returns: categories, authors, publishers: [{id, name, count}], prices: [{min_price, max_price, count}]
+
+        Examples::
+
+    """
+    name = request.args.get('q', '', type=str)
+    category_id = request.args.get('category', None, type=str)
+    min_price = request.args.get('min_price', 0, type=int)
+    max_price = request.args.get('max_price', 9999999999, type=int)
+    from_date = request.args.get('from_date', 0, type=int)
+    to_date = request.args.get('to_date', 9999999999, type=int)
+    try:
+        price_buckets = sorted({int(edge) for edge in request.args.get('price_buckets').split(',')}) \
+            if request.args.get('price_buckets') else PRICE_BUCKETS
+    except ValueError as ex:
+        logger.error('{} Parameters error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
+        return send_error(message="Parameters invalid")
+
+    try:
+        res = Product.facets(name, category_id, min_price, max_price, from_date, to_date, price_buckets)
+    except Exception as ex:
+        logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
+        return send_error(message="An error occurred while fetch data")
+    return send_result(data=res)
+
+
 @api.route('/all', methods=['GET'])
+@read_replica
 def get_all_admin():
     """ This api gets all products.
 
@@ -305,11 +436,12 @@ def get_all_admin():
     max_price = request.args.get('max_price', 9999999999, type=int)
     from_date = request.args.get('from_date', 0, type=int)
     to_date = request.args.get('to_date', 9999999999, type=int)
+    fields = parse_fields(request.args.get('fields', None, type=str))
 
-    results = Product.filter(name, category_id, sort, min_price, max_price, limit, page, from_date, to_date)
+    results = Product.filter(name, category_id, sort, min_price, max_price, limit, page, from_date, to_date, fields)
     res = dict(has_next=results.has_next,
                has_prev=results.has_prev,
-               items=list(result.json_admin() for result in results.items),
+               items=list(result.json_admin(fields) for result in results.items),
                page=results.page,
                pages=results.pages,
                total=results.total)
@@ -317,6 +449,7 @@ def get_all_admin():
 
 
 @api.route('/<product_id>', methods=['GET'])
+@read_replica
 def get_by_id(product_id: str):
     """ This api get information of a product.
 
@@ -325,33 +458,63 @@ def get_by_id(product_id: str):
         Examples::
 
     """
+    fields = parse_fields(request.args.get('fields', None, type=str))
 
-    product = Product.find_by_id(product_id)
+    product = Product.find_detail_by_id(product_id, fields)
     if not product:
         return send_error(message="Product not found!")
-    return send_result(data=product.json())
+    return send_result(data=product.json(fields))
+
+
+@api.route('/<product_id>/detail', methods=['GET'])
+@read_replica
+def get_detail(product_id: str):
+    """ This api gets everything the product page shows in one response, in 6 queries whatever the product:
+        product (2), rating summary (1), latest published reviews (1), related products (2).
+
+        Query: reviews: number of reviews, default 5, related: number of related products, default 8
+
+        Returns: product, rating: {review_count, average_rating, list_rate, stars}, reviews, related
+
+        Examples::
+
+    """
+    reviews = min(request.args.get('reviews', 5, type=int), 50)
+    related = min(request.args.get('related', 8, type=int), 50)
+
+    try:
+        product = Product.find_detail_by_id(product_id)
+        if not product:
+            return send_error(message="Product not found!")
+        res = dict(product=product.json(),
+                   rating=ProductRating.summary(ProductRating.find_by_product_id(product_id)),
+                   reviews=list(review.json() for review in ProductReview.find_published(product_id, reviews)),
+                   related=list(item.json(CARD_FIELDS) for item in
+                                Product.find_related(product, related, CARD_FIELDS)))
+    except Exception as ex:
+        logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
+        return send_error(message="An error occurred while fetch data")
+
+    # the same for every client, browsers and proxies may cache it per product and revalidate with the ETag
+    response, _ = send_result(data=res)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('PRODUCT_DETAIL_MAX_AGE', 60)
+    response.add_etag(weak=True)
+    return response.make_conditional(request)
 
 
 @api.route('/best-seller', methods=['GET'])
+@read_replica
 def get_best_seller_products():
     try:
-        # calculate best seller product from order table
-        results = db.session.execute('SELECT product_id, SUM(quantity) AS TotalQuantity FROM order_details GROUP BY '
-                                     'product_id ORDER BY SUM(quantity) DESC LIMIT :val', {'val': 10})
-
-        items = []
-        for row in results:
-            product_id = row['product_id']
-            items.append(Product.find_by_id(product_id))
-        while items.__len__() < 10:
-            items.append(Product.find_random())
+        items = Product.best_sellers(10)
 
         res = dict(has_next=False,
                    has_prev=False,
                    items=list(item.json() for item in items),
                    page=1,
                    pages=1,
-                   total=10)
+                   total=len(items))
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while fetch data")
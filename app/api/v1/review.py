@@ -1,14 +1,14 @@
-import uuid
 from datetime import datetime
 
 from flask import Blueprint, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from jsonschema import validate
 
-from app.decorators import admin_required
+from app.decorators import admin_required, read_replica
 from app.enums import PRODUCT_NOT_FOUND_MSG, CURD_ERR_MSG, CURD_SUCCESS_MSG, NOT_FOUND_MSG, SUPER_ADMIN_ID
 from app.extensions import logger, db
-from app.models import Product, ProductReview, User
+from app.ids import new_id
+from app.models import Product, ProductReview, User, ProductRating, PurchasedProduct
 from app.schema.schema_validator import review_validator
 from app.utils import send_result, send_error, get_datetime_now_s
 
@@ -32,7 +32,7 @@ def post():
         validate(instance=json_data, schema=review_validator)
 
         title = json_data.get('title', None)
-        rating = json_data.get('rating', 5)
+        rating = int(json_data.get('rating', 5))
         content = json_data.get('content', None)
         product_id = json_data.get('product_id', None)
     except Exception as ex:
@@ -45,25 +45,13 @@ def post():
 
     user = User.find_by_id(get_jwt_identity())
 
-    result = db.session.execute("SELECT '{}' in (SELECT product_id FROM order_details WHERE order_id IN (SELECT "
-                                "order_id FROM orders WHERE user_id = '{}'))".format(product_id, user.id))
-
-    is_bought = False
-    is_review = False
-    for row in result:
-        is_bought = row[0]
+    is_bought, is_review = PurchasedProduct.review_eligibility(user.id, product_id)
     if not is_bought:
         return send_error(message="Chỉ khách hàng đã mua sản phẩm mới có thể viết đánh giá!")
-
-    result = db.session.execute("SELECT COUNT(*) FROM reviews WHERE product_id = '{}' AND user_id = "
-                                "'{}' GROUP BY product_id".format(product_id, user.id))
-
-    for row in result:
-        is_review = row[0] > 0
     if is_review:
         return send_error(message="Bạn đã đánh giá sản phẩm này rồi!")
 
-    _id = str(uuid.uuid1())
+    _id = new_id()
 
     data = {
         'id': _id,
@@ -82,8 +70,11 @@ def post():
         review.__setattr__(key, data[key])
 
     try:
-        review.save_to_db()
+        db.session.add(review)
+        ProductRating.apply(product_id, rating, 1)
+        db.session.commit()
     except Exception as ex:
+        db.session.rollback()
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message=CURD_ERR_MSG.format('viết', 'đánh giá'))
 
@@ -116,6 +107,10 @@ def update(review_id):
         logger.error('{} Parameters error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="Parameters invalid")
 
+    if 'rating' in json_data:
+        json_data['rating'] = int(json_data['rating'])
+    old_published, old_product_id, old_rating = review.published, review.product_id, review.rating
+
     keys = ["title", "rating", "content", "product_id", "published"]
     data = {}
     for key in keys:
@@ -124,8 +119,15 @@ def update(review_id):
             review.__setattr__(key, json_data.get(key))
 
     try:
+        # move the review in the rating aggregates only when its contribution changes
+        if (old_published, old_product_id, old_rating) != (review.published, review.product_id, review.rating):
+            if old_published:
+                ProductRating.apply(old_product_id, old_rating, -1)
+            if review.published:
+                ProductRating.apply(review.product_id, review.rating, 1)
         review.save_to_db()
     except Exception as ex:
+        db.session.rollback()
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message=CURD_ERR_MSG.format('cập nhật', 'đánh giá'))
 
@@ -149,6 +151,8 @@ def delete(review_id):
     try:
         # Also delete all children foreign key
         if review.user_id == get_jwt_identity() or get_jwt_identity() == SUPER_ADMIN_ID:
+            if review.published:
+                ProductRating.apply(review.product_id, review.rating, -1)
             review.delete_from_db()
         else:
             return send_error(message="Bạn không có quyền xóa đánh giá này!")
@@ -162,6 +166,7 @@ def delete(review_id):
 @api.route('', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_all():
     """ This api gets all coupons.
 
@@ -187,6 +192,7 @@ def get_all():
 
 
 @api.route('/<product_id>', methods=['GET'])
+@read_replica
 def get_all_by_user(product_id):
     """ This api gets all coupons.
 
@@ -200,21 +206,16 @@ def get_all_by_user(product_id):
     limit = request.args.get('limit', 20, type=int)
     page = request.args.get('page', None, type=int)
 
-    list_rate = {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0}
-
     results = ProductReview.search(product_id, from_date, to_date, limit, page)
-    average_rating = sum(review.rating for review in results.items) / len(results.items) if len(results.items) > 0 else 0
-    for key in list_rate.keys():
-        for review in results.items:
-            list_rate.update({key: (list_rate.get(key)+1 if review.rating == int(key) else list_rate.get(key))})
-        if len(results.items) > 0:
-            list_rate.update({key: list_rate.get(key) / len(results.items)})
+    # aggregates of all published reviews of the product, not only of this page
+    rating = ProductRating.summary(ProductRating.find_by_product_id(product_id))
     res = dict(has_next=results.has_next,
                has_prev=results.has_prev,
                items=list(result.json() for result in results.items if result.published),
                page=results.page,
                pages=results.pages,
                total=results.total,
-               average_rating=average_rating,
-               list_rate=list_rate)
+               average_rating=rating['average_rating'],
+               list_rate=rating['list_rate'],
+               review_count=rating['review_count'])
     return send_result(data=res)
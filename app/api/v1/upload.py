@@ -1,5 +1,4 @@
 import os
-import uuid
 from datetime import datetime
 
 from cloudinary import uploader, api as cloudinary_api
@@ -10,6 +9,7 @@ from werkzeug.utils import secure_filename
 from app.decorators import admin_required
 from app.enums import UPLOAD_EXTENSIONS
 from app.extensions import logger
+from app.ids import new_id
 from app.models import ProductImage
 from app.utils import send_result, send_error, validate_image
 
@@ -45,7 +45,7 @@ def post():
                                      invalidate=True
                                      )
 
-            _id = str(uuid.uuid1())
+            _id = new_id()
             data = {
                 'id': _id,
                 'imageURL': result.get('secure_url', None),
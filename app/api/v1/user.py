@@ -3,15 +3,18 @@ from werkzeug.security import check_password_hash
 
 from flask import Blueprint, request
 from jsonschema import validate
-import uuid
 from datetime import datetime
 from flask_jwt_extended import jwt_required
 
-from app.models import TokenBlacklist, User, Order
-from app.utils import send_result, send_error, hash_password, is_password_contain_space, get_datetime_now_s
-from app.extensions import logger
+from app.api.v1.auth import create_tokens
+from app.ids import new_id
+from app.models import User, Order
+from app.utils import send_result, send_error, hash_password, is_password_contain_space, get_datetime_now_s, \
+    parse_fields
+from app.extensions import logger, db
 from app.schema.schema_validator import user_validator, password_validator, user_update_validator
-from app.decorators import admin_required
+from app import inventory
+from app.decorators import admin_required, read_replica
 
 api = Blueprint('user', __name__)
 
@@ -43,7 +46,7 @@ def post():
 
     user = User.find_by_username(username=user_name)
     if user is None:
-        _id = str(uuid.uuid1())
+        _id = new_id()
 
         data = {
             'id': _id,
@@ -189,9 +192,10 @@ def update_info():
 def change_password():
     """ This api for all user change their password.
 
-        Request Body:
+        Request Body: current_password, new_password
 
-        Returns:
+        Returns: access_token, refresh_token of a new session. Every token issued before is revoked, the tokens
+            of the request included: the client replaces them with these ones.
 
         Examples::
 
@@ -219,16 +223,15 @@ def change_password():
 
     current_user.__setattr__('password', hash_password(new_password))
     current_user.__setattr__('updated_at', get_datetime_now_s())
+    # revoke all token of current user, new tokens are returned for the current session
+    current_user.revoke_all_tokens()
     try:
         current_user.save_to_db()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while change password")
 
-    # revoke all token of current user  from database except current token
-    TokenBlacklist.revoke_all_token2(user_id)
-
-    return send_result(message="Change password successfully!")
+    return send_result(data=create_tokens(current_user), message="Change password successfully!")
 
 
 @api.route('/<user_id>/reset_password', methods=['PUT'])
@@ -263,15 +266,14 @@ def reset_password(user_id):
 
     user.__setattr__('password', hash_password(new_password))
     user.__setattr__('updated_at', get_datetime_now_s())
+    # revoke all token of reset user
+    user.revoke_all_tokens()
     try:
         user.save_to_db()
     except Exception as ex:
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while change password")
 
-    # revoke all token of reset user  from database
-    TokenBlacklist.revoke_all_token(user_id)
-
     return send_result(data=None, message="Reset password successfully!")
 
 
@@ -291,17 +293,16 @@ def delete_user(user_id):
         return send_error(message="Not found user!")
 
     # Also delete all children foreign key
+    # the tokens of a deleted user are revoked, see RevokedToken.is_token_revoked
     user.delete_from_db()
 
-    # revoke all token of reset user  from database
-    TokenBlacklist.revoke_all_token(user_id)
-
     return send_result(data=user, message="Delete user successfully!")
 
 
 @api.route('', methods=['GET'])
 @jwt_required
 @admin_required()
+@read_replica
 def get_all_users():
     """ This api gets all users.
 
@@ -310,6 +311,20 @@ def get_all_users():
         Examples::
 
     """
+    name = request.args.get('q', None, type=str)
+    page = request.args.get('page', None, type=int)
+    limit = request.args.get('limit', None, type=int)
+
+    if name or page or limit:
+        # name is a prefix of the user_name, ex: q=admin
+        results = User.search(name, page or 1, limit or 20)
+        res = dict(has_next=results.has_next,
+                   has_prev=results.has_prev,
+                   items=list(user.json() for user in results.items),
+                   page=results.page,
+                   pages=results.pages,
+                   total=results.total)
+        return send_result(data=res)
 
     results = User.find_all()
     return send_result(data=list(user.json() for user in results))
@@ -362,11 +377,12 @@ def get_all_orders():
     user_id = get_jwt_identity()
     limit = request.args.get('limit', 20, type=int)
     page = request.args.get('page', None, type=int)
+    fields = parse_fields(request.args.get('fields', None, type=str))
 
-    results = Order.find_by_user_id(user_id, page, limit)
+    results = Order.find_by_user_id(user_id, page, limit, fields)
     res = dict(has_next=results.has_next,
                has_prev=results.has_prev,
-               items=list(result.json_many() for result in results.items),
+               items=list(result.json_many(fields) for result in results.items),
                page=results.page,
                pages=results.pages,
                total=results.total)
@@ -383,11 +399,12 @@ def get_order_by_id(order_id):
         Examples::
 
     """
+    fields = parse_fields(request.args.get('fields', None, type=str))
 
-    order = Order.find_by_id(order_id)
+    order = Order.find_detail_by_id(order_id, fields)
     if not order:
         return send_error(message="Order not found!")
-    return send_result(data=order.json())
+    return send_result(data=order.json(fields))
 
 
 @api.route('/purchase/order/<order_id>', methods=['DELETE'])
@@ -406,10 +423,14 @@ def cancel_order_by_id(order_id):
         return send_error(message="Order not found!")
     if order.status > 1:
         return send_error(message="Không thể hủy đơn hàng đã xác nhận")
+    was_cancelled = order.status == 0
     order.__setattr__('status', 0)
     try:
+        if not was_cancelled:
+            inventory.release_order(order)
         order.save_to_db()
     except Exception as ex:
+        db.session.rollback()
         logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
         return send_error(message="An error occurred while cancel order")
 
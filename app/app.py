@@ -7,10 +7,12 @@ from flask_cors import CORS
 from apscheduler.triggers import interval
 
 from app.api import v1 as api_v1
-from app.extensions import jwt, db, logger, scheduler
+from app.database import init_pools, pool_samples
+from app.extensions import jwt, db, logger, scheduler, metrics, catalog, limiter, compression, home, reference
 from app.utils import send_error
 from app.settings import ProdConfig
-from app.scheduler_task import remove_token_expiry
+from app.scheduler_task import remove_token_expiry, rebuild_product_ratings, rebuild_purchased_products, \
+    expire_stock_reservations, compact_carts
 
 
 def create_app(config_object=ProdConfig, content='app'):
@@ -38,17 +40,34 @@ def register_extensions(app, content, config_object):
     :return:
     """
     app.config.from_object(config_object)
+    init_pools(app)
     db.app = app
     db.init_app(app)
     # don't start extensions if content != app
     if content == 'app':
         jwt.init_app(app)
+        metrics.init_app(app)
+        metrics.add_collector(lambda: pool_samples(app))
+        catalog.init_app(app)
+        home.init_app(app)
+        reference.init_app(app)
+        limiter.init_app(app)
+        compression.init_app(app)
 
     if config_object.ENV == 'prod':
         # Task Scheduler run in interval every 5 seconds
         trigger = interval.IntervalTrigger(minutes=5)
         scheduler.add_job(remove_token_expiry, trigger=trigger, id='remove_token_expiry', replace_existing=True)
         scheduler.add_job(update_coupon_status, trigger=trigger, id='update_coupon_status', replace_existing=True)
+        scheduler.add_job(expire_stock_reservations, trigger=interval.IntervalTrigger(minutes=1),
+                          id='expire_stock_reservations', replace_existing=True)
+        # reviews keep product_ratings up to date, the nightly rebuild only repairs drift
+        scheduler.add_job(rebuild_product_ratings, trigger='cron', hour='03', minute='00', second='00',
+                          id='rebuild_product_ratings', replace_existing=True)
+        scheduler.add_job(rebuild_purchased_products, trigger='cron', hour='03', minute='30', second='00',
+                          id='rebuild_purchased_products', replace_existing=True)
+        scheduler.add_job(compact_carts, trigger='cron', hour='04', minute='00', second='00', id='compact_carts',
+                          replace_existing=True)
         # scheduler.add_job(add_partitions, trigger='cron', hour='07', minute='00', second='00', replace_existing=True)
         scheduler.start()
 
@@ -124,3 +143,4 @@ def register_blueprints(app):
     app.register_blueprint(api_v1.cart.api, url_prefix='/api/v1/cart')
     app.register_blueprint(api_v1.review.api, url_prefix='/api/v1/reviews')
     app.register_blueprint(api_v1.dashboard.api, url_prefix='/api/v1/dashboard')
+    app.register_blueprint(api_v1.home.api, url_prefix='/api/v1/home')
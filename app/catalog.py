@@ -0,0 +1,144 @@
+# coding: utf-8
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+from flask_sqlalchemy import get_state
+from sqlalchemy import select
+
+from app.database import primary
+
+# sort parameter of Product.filter -> (column, descending)
+SORT_KEYS = {
+    'price,desc': ('price', True),
+    'price,asc': ('price', False),
+    'newest': ('created_at', True),
+    'oldest': ('created_at', False),
+}
+
+
+class ColumnarCatalog(object):
+    """
+    The columns of `products` searched by Product.filter, one NumPy array per column, rows ordered by id
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: iterable of (id, title, price, created_at, updated_at, category_id)
+        """
+        rows = list(rows)
+        self.ids = np.array([row[0] for row in rows], dtype=object)
+        # SQL LIKE of MySQL is case insensitive, match on lower case titles
+        self.titles = np.array([(row[1] or '').lower() for row in rows], dtype=str)
+        self.price = np.array([row[2] or 0 for row in rows], dtype=np.float64)
+        self.created_at = np.array([row[3] or 0 for row in rows], dtype=np.int64)
+        self.updated_at = np.array([row[4] or 0 for row in rows], dtype=np.int64)
+        self.category_codes = {}
+        self.category = np.array([self.category_codes.setdefault(row[5], len(self.category_codes)) for row in rows],
+                                 dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, name: str, category_id: str, sort: str, min_price: float, max_price: float, from_date: int,
+               to_date: int):
+        """
+        Positions of the matching products in the order of `sort`, same filters as Product.filter
+        :return: numpy array of positions in self.ids
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        if name:
+            mask &= np.char.find(self.titles, name.lower()) >= 0
+        if category_id:
+            code = self.category_codes.get(category_id)
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= self.category == code
+        if from_date:
+            mask &= (self.updated_at >= from_date) & (self.updated_at <= to_date)
+        if min_price:
+            mask &= (self.price >= min_price) & (self.price <= max_price)
+        positions = np.flatnonzero(mask)
+
+        if sort in SORT_KEYS:
+            column, descending = SORT_KEYS[sort]
+            values = getattr(self, column)[positions]
+            # stable sort keeps the id order between equal values, so pages do not overlap
+            positions = positions[np.argsort(-values if descending else values, kind='stable')]
+        return positions
+
+
+class CatalogSnapshot(object):
+    """
+    Flask extension keeping an in-process ColumnarCatalog, so Product.filter runs vectorized masks and
+    argsorts in memory instead of a SQL query per request. Meant for a catalog that fits in RAM.
+
+    The snapshot is loaded on first use and reloaded on the next search after invalidate(), which the
+    admin product endpoints call after a write. Other workers do not see that call: they reload once
+    their snapshot is older than CATALOG_SNAPSHOT_MAX_AGE.
+
+    Config:
+        CATALOG_SNAPSHOT_ENABLED: default False
+        CATALOG_SNAPSHOT_MAX_AGE: seconds, default 60
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_age = 60
+        self._catalog = None
+        self._loaded_at = 0
+        self._stale = True
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = bool(app.config.get('CATALOG_SNAPSHOT_ENABLED', False))
+        self.max_age = app.config.get('CATALOG_SNAPSHOT_MAX_AGE', 60)
+
+    def invalidate(self):
+        """
+        The catalog changed, reload before the next search
+        """
+        self._stale = True
+
+    def _is_fresh(self):
+        return self._catalog is not None and not self._stale and time.time() - self._loaded_at < self.max_age
+
+    def get(self):
+        """
+        Current snapshot, (re)loaded from the database when stale. Needs an app context.
+        :return: ColumnarCatalog
+        """
+        if self._is_fresh():
+            return self._catalog
+        with self._lock:
+            if not self._is_fresh():
+                # reset first, an invalidate() while loading triggers another reload
+                self._stale = False
+                loaded_at = time.time()
+                # product searches are read-only handlers, a replica may not have the write yet
+                with primary():
+                    self._catalog = self.load()
+                self._loaded_at = loaded_at
+            return self._catalog
+
+    @staticmethod
+    def load():
+        db = get_state(current_app).db
+        products = db.metadata.tables['products']
+        query = select([products.c.id, products.c.title, products.c.price, products.c.created_at,
+                        products.c.updated_at, products.c.category_id]).order_by(products.c.id)
+        return ColumnarCatalog(db.session.execute(query))
+
+    def page(self, name: str, category_id: str, sort: str, min_price: float, max_price: float, limit: int, page: int,
+             from_date: int, to_date: int):
+        """
+        One page of Product.filter
+        :return: (product ids of the page, total)
+        """
+        catalog = self.get()
+        positions = catalog.search(name, category_id, sort, min_price, max_price, from_date, to_date)
+        start = (page - 1) * limit
+        return list(catalog.ids[positions[start:start + limit]]), len(positions)
@@ -0,0 +1,87 @@
+# coding: utf-8
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only
+    brotli = None
+
+from flask import request
+
+# Content-Encoding -> compress(data, level)
+CODECS = {
+    'gzip': lambda data, level: gzip.compress(data, compresslevel=level),
+}
+if brotli is not None:
+    CODECS['br'] = lambda data, level: brotli.compress(data, quality=level, mode=brotli.MODE_TEXT)
+
+# preferred first when the client accepts several with the same quality
+PREFERENCE = ('br', 'gzip')
+
+
+def negotiate(accept_encodings, codecs=CODECS):
+    """
+    Pick the encoding of a response from the Accept-Encoding of the request
+    :param accept_encodings: werkzeug Accept, ex: request.accept_encodings
+    :return: 'br', 'gzip' or None
+    """
+    best, best_quality = None, 0
+    for encoding in PREFERENCE:
+        if encoding in codecs:
+            quality = accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+    return best
+
+
+class ResponseCompression(object):
+    """
+    Flask extension compressing the JSON responses (send_result / send_error) with brotli or gzip, as
+    negotiated by Accept-Encoding. Brotli needs the `brotli` package, gzip is used without it.
+
+    Small bodies are sent as is: below COMPRESS_MIN_SIZE the headers and the CPU cost more than the bytes saved.
+    The default levels (gzip 6, brotli 4) keep most of the size reduction of the highest levels for a fraction
+    of their CPU, see benchmarks/compression.py.
+
+    Config:
+        COMPRESS_ENABLED: default True
+        COMPRESS_MIMETYPES: default application/json
+        COMPRESS_MIN_SIZE: bytes, default 1024
+        COMPRESS_GZIP_LEVEL: 1-9, default 6
+        COMPRESS_BR_LEVEL: 0-11, default 4
+    """
+
+    def __init__(self, app=None):
+        self.mimetypes = ('application/json',)
+        self.min_size = 1024
+        self.levels = {'gzip': 6, 'br': 4}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('COMPRESS_ENABLED', True):
+            return
+        self.mimetypes = tuple(app.config.get('COMPRESS_MIMETYPES', self.mimetypes))
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', self.min_size)
+        self.levels = {'gzip': app.config.get('COMPRESS_GZIP_LEVEL', self.levels['gzip']),
+                       'br': app.config.get('COMPRESS_BR_LEVEL', self.levels['br'])}
+
+        @app.after_request
+        def compress_response(response):
+            return self.compress(response)
+
+    def compress(self, response):
+        if response.mimetype not in self.mimetypes or response.direct_passthrough or response.is_streamed \
+                or 'Content-Encoding' in response.headers or response.status_code < 200 \
+                or response.status_code in (204, 304):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.set_data(CODECS[encoding](data, self.levels[encoding]))
+        response.headers['Content-Encoding'] = encoding
+        return response
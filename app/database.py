@@ -0,0 +1,205 @@
+# coding: utf-8
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import create_engine, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+# Options that only make sense for a QueuePool (MySQL, PostgreSQL), SQLite uses its own pools
+POOL_OPTIONS = ('poolclass', 'pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle')
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that also measures how long callers wait for a connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except Exception:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+
+    def recreate(self):
+        # pre-ping and invalidation recreate the pool, keep the counters
+        pool = super(TimedQueuePool, self).recreate()
+        pool.checkouts, pool.timeouts = self.checkouts, self.timeouts
+        pool.wait_total, pool.wait_max = self.wait_total, self.wait_max
+        return pool
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending the reads of read-only handlers (see decorators.read_replica) to a replica.
+
+    Replicas are the SQLALCHEMY_BINDS whose key starts with `replica`. Everything else stays on the
+    primary: writes, reads outside a read-only handler, and every statement of the request once the
+    session has written something, so a handler always reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase) or _is_text_write(clause):
+            self.info['wrote'] = True
+        elif not self.info.get('wrote') and has_request_context() and g.get('read_replica'):
+            replicas = replica_binds(self.app)
+            if replicas:
+                return get_state(self.app).db.get_engine(self.app, bind=random.choice(replicas))
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+def _is_text_write(clause):
+    text = getattr(clause, 'text', None)
+    return isinstance(text, str) and not text.lstrip().upper().startswith(('SELECT', 'SHOW', 'WITH'))
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    SQLAlchemy extension using RoutingSession
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_binds(app):
+    """
+    Bind keys of the read replicas configured in SQLALCHEMY_BINDS
+    """
+    return [key for key in (app.config.get('SQLALCHEMY_BINDS') or {}) if key.startswith('replica')]
+
+
+def engine_options(uri, options):
+    """
+    Engine options of `uri`: pool options are dropped for SQLite, QueuePool is swapped for TimedQueuePool
+    :param uri: database uri
+    :param options: dict, ex: SQLALCHEMY_ENGINE_OPTIONS
+    :return: new dict
+    """
+    options = dict(options or {})
+    if uri and make_url(uri).drivername.startswith('sqlite'):
+        return {key: value for key, value in options.items() if key not in POOL_OPTIONS}
+    options.setdefault('poolclass', TimedQueuePool)
+    return options
+
+
+def init_pools(app):
+    """
+    Apply the pool settings of the config before the first engine is created
+    """
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config.get('SQLALCHEMY_DATABASE_URI'),
+                                                             app.config.get('SQLALCHEMY_ENGINE_OPTIONS'))
+
+
+def get_job_engine(app):
+    """
+    Engine of the background jobs, a small pool apart from the request workers
+    so a long job never starves the requests (and the other way around)
+    """
+    engine = app.extensions.get('job_engine')
+    if engine is None:
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        engine = create_engine(uri, **engine_options(uri, app.config.get('SCHEDULER_ENGINE_OPTIONS')))
+        app.extensions['job_engine'] = engine
+    return engine
+
+
+@contextmanager
+def primary():
+    """
+    Send the queries of the block to the primary, even inside a read-only handler.
+    For the in-memory caches: a copy loaded from a lagging replica right after a write would be served
+    until it expires.
+    Usage:
+        with primary():
+            data = load()
+    """
+    if not has_request_context():
+        yield
+        return
+    read_replica = g.get('read_replica')
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = read_replica
+
+
+@contextmanager
+def job_session(app):
+    """
+    Bind db.session to the job engine for the current thread.
+    Models keep using db.session / Model.query unchanged.
+    Usage:
+        with app.app_context(), job_session(app):
+            TokenBlacklist.prune_database()
+    """
+    db = get_state(app).db
+    session = db.create_session({'bind': get_job_engine(app), 'binds': {}})()
+    db.session.registry.set(session)
+    try:
+        yield session
+    finally:
+        db.session.remove()
+
+
+def pool_samples(app):
+    """
+    Pool utilization of the request and job engines, as samples for RequestMetrics
+    """
+    db = get_state(app).db
+    engines = [('web', db.get_engine(app))]
+    engines += [(key, db.get_engine(app, bind=key)) for key in replica_binds(app)]
+    if 'job_engine' in app.extensions:
+        engines.append(('jobs', app.extensions['job_engine']))
+
+    samples = []
+    for name, engine in engines:
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        labels = dict(pool=name)
+        samples += [
+            dict(name='db_pool_size', help='Connections kept open by the pool.', type='gauge', labels=labels,
+                 value=pool.size()),
+            dict(name='db_pool_checked_out', help='Connections currently in use.', type='gauge', labels=labels,
+                 value=pool.checkedout()),
+            dict(name='db_pool_checked_in', help='Idle connections in the pool.', type='gauge', labels=labels,
+                 value=pool.checkedin()),
+            dict(name='db_pool_overflow', help='Connections opened above pool_size.', type='gauge', labels=labels,
+                 value=max(pool.overflow(), 0)),
+        ]
+        if isinstance(pool, TimedQueuePool):
+            samples += [
+                dict(name='db_pool_checkouts_total', help='Connections handed out by the pool.', type='counter',
+                     labels=labels, value=pool.checkouts),
+                dict(name='db_pool_timeouts_total', help='Checkouts failed after pool_timeout.', type='counter',
+                     labels=labels, value=pool.timeouts),
+                dict(name='db_pool_wait_seconds_total', help='Time spent waiting for a connection.', type='counter',
+                     labels=labels, value=pool.wait_total),
+                dict(name='db_pool_wait_seconds_max', help='Longest wait for a connection.', type='gauge',
+                     labels=labels, value=pool.wait_max),
+            ]
+    return samples
@@ -1,11 +1,12 @@
-import uuid
 from functools import wraps
 from datetime import datetime
 
+from flask import g
 from flask_jwt_extended.utils import get_jwt_identity
 
 from app.extensions import db, logger
 from app.utils import send_error, get_datetime_now_s
+from app.ids import new_id
 from app.models import User, Cart
 
 
@@ -37,10 +38,12 @@ def cart_required(fn):
     def wrapper(*args, **kwargs):
         current_cart = Cart.find_by_user_id(get_jwt_identity())
         if not current_cart:
-            _id = str(uuid.uuid1())
+            _id = new_id()
 
             data = {
                 'id': _id,
+                'created_at': get_datetime_now_s(),
+                'updated_at': get_datetime_now_s(),
                 'status': None,
                 'content': None,
                 'user_id': get_jwt_identity()
@@ -54,3 +57,17 @@ def cart_required(fn):
         db.session.commit()
         return fn(*args, **kwargs)
     return wrapper
+
+
+def read_replica(fn):
+    """
+    Mark a read-only handler: its queries may be served by a read replica (SQLALCHEMY_BINDS 'replica*').
+    The request goes back to the primary as soon as it writes anything.
+    :return:
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        return fn(*args, **kwargs)
+    return wrapper
@@ -1,10 +1,13 @@
 # coding=utf-8
 UPLOAD_EXTENSIONS = ['.jpg', '.png', '.jpeg']
+IMPORT_EXTENSIONS = ['.csv', '.xlsx', '.jsonl']
 PATH_IMAGE = 'app/static/images/'
 SUPER_ADMIN_ID = '5fc5f970100333097e15017b'
 URL_SERVER = "http://localhost:5000"
 PATH_IMAGE_SERVER = URL_SERVER + '/images/'
 DEFAULT_BOOK_COVER = PATH_IMAGE_SERVER + 'default_book_cover.jpg'
+# lower bounds (VND) of the price facet buckets of /products/facets
+PRICE_BUCKETS = [0, 50000, 100000, 200000, 500000]
 PRODUCT_NOT_FOUND_MSG = 'Không tìm thấy sản phẩm!'
 PRODUCT_NOT_ENOUGH_MSG = 'Sản phẩm {} chỉ còn {} sản phẩm!'
 ADD_TO_CART_SUCCESSFULLY_MSG = 'Thêm sản phẩm vào giỏ thành công!'
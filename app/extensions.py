@@ -2,13 +2,26 @@ import logging
 from logging.handlers import RotatingFileHandler
 
 from flask_jwt_extended import JWTManager
-from flask_sqlalchemy import SQLAlchemy
 from webargs.flaskparser import FlaskParser
 from apscheduler.schedulers.background import BackgroundScheduler
 
+from app.catalog import CatalogSnapshot
+from app.compression import ResponseCompression
+from app.database import RoutingSQLAlchemy
+from app.home import HomeCache
+from app.metrics import RequestMetrics
+from app.ratelimit import RateLimiter
+from app.reference import ReferenceCache
+
 parser = FlaskParser()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 jwt = JWTManager()
+metrics = RequestMetrics()
+catalog = CatalogSnapshot()
+limiter = RateLimiter()
+compression = ResponseCompression()
+home = HomeCache()
+reference = ReferenceCache()
 
 # scheduler
 scheduler = BackgroundScheduler()
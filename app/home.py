@@ -0,0 +1,88 @@
+# coding: utf-8
+import logging
+import threading
+import time
+
+from flask import current_app
+from flask_sqlalchemy import get_state
+
+from app.database import primary
+
+
+class HomeCache(object):
+    """
+    Flask extension keeping the storefront home bundle (GET /api/v1/home) in the memory of the worker.
+
+    The first request builds it, afterwards requests never wait for the database: once the bundle is older
+    than HOME_CACHE_MAX_AGE or after invalidate() (catalog writes of the admin endpoints), the next request
+    starts a rebuild in a background thread and keeps answering with the previous bundle until it is done.
+
+    Config:
+        HOME_CACHE_MAX_AGE: seconds, default 60
+    """
+
+    def __init__(self, app=None):
+        self.max_age = 60
+        self._bundle = None
+        self._built_at = 0
+        self._stale = True
+        self._refreshing = False
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_age = app.config.get('HOME_CACHE_MAX_AGE', 60)
+
+    def invalidate(self):
+        """
+        The catalog changed, rebuild on the next request
+        """
+        self._stale = True
+
+    def _is_fresh(self):
+        return not self._stale and time.time() - self._built_at < self.max_age
+
+    def get(self, build):
+        """
+        Current bundle. Needs an app context.
+        :param build: function returning the bundle, called with an app context
+        :return: what build returned
+        """
+        if self._bundle is None:
+            with self._lock:
+                if self._bundle is None:
+                    self._refresh(build)
+            return self._bundle
+        if not self._is_fresh():
+            with self._lock:
+                if self._refreshing or self._is_fresh():
+                    return self._bundle
+                self._refreshing = True
+            thread = threading.Thread(target=self._refresh_in_background,
+                                      args=(current_app._get_current_object(), build), daemon=True)
+            thread.start()
+        return self._bundle
+
+    def _refresh(self, build):
+        # reset first, an invalidate() while building triggers another rebuild
+        self._stale = False
+        built_at = time.time()
+        # the first build runs in the request, never from a replica even if the handler becomes read-only
+        with primary():
+            self._bundle = build()
+        self._built_at = built_at
+
+    def _refresh_in_background(self, app, build):
+        try:
+            with app.app_context():
+                try:
+                    self._refresh(build)
+                finally:
+                    get_state(app).db.session.remove()
+        except Exception as ex:
+            # the previous bundle is served until the next try
+            self._stale = True
+            logging.getLogger('api').error('Home bundle refresh error: ' + str(ex))
+        finally:
+            self._refreshing = False
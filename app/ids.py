@@ -0,0 +1,95 @@
+# coding: utf-8
+"""
+Primary keys of the rows created by the API.
+
+An id is a ULID: 48 bits of milliseconds since the epoch then 80 random bits, written as 26 characters of
+Crockford base32. Ids sort in creation order, so new rows are appended at the end of the primary key and
+foreign key indexes instead of landing at a random page like the former uuid1 strings, and they are 26
+characters instead of 36. Within a millisecond a process increments the random part, ids of one process
+never go backwards.
+
+The columns stay db.String(40): ids created before (uuid1) remain valid, migrate/compact_ids.py rewrites them.
+"""
+import os
+import threading
+import time
+
+ENCODING = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+DECODING = dict((char, value) for value, char in enumerate(ENCODING))
+LENGTH = 26
+RANDOM_BITS = 80
+MAX_RANDOM = (1 << RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last = [0, 0]  # timestamp ms, random part of the last id of this process
+
+
+def encode(value: int):
+    """
+    :param value: 128 bits integer
+    :return: 26 characters, same order as the integers
+    """
+    chars = []
+    for _ in range(LENGTH):
+        chars.append(ENCODING[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def decode(_id: str):
+    """
+    :return: 128 bits integer of an id, ValueError if it is not one
+    """
+    if len(_id) != LENGTH:
+        raise ValueError('Invalid id: {}'.format(_id))
+    value = 0
+    for char in _id.upper():
+        if char not in DECODING:
+            raise ValueError('Invalid id: {}'.format(_id))
+        value = (value << 5) | DECODING[char]
+    return value
+
+
+def id_from_time(timestamp_ms: int, randomness: int):
+    """
+    Id of a given time, ex: migration of a row from its created_at
+    :param timestamp_ms: milliseconds since the epoch
+    :param randomness: 80 bits integer
+    """
+    return encode((timestamp_ms << RANDOM_BITS) | (randomness & MAX_RANDOM))
+
+
+def new_id():
+    """
+    New id, use it for the id of every new row
+    :return: ex: 01F2ZQ3C4E6XKQ7W9V8S1NPB2M
+    """
+    now = int(time.time() * 1000)
+    with _lock:
+        if now <= _last[0]:
+            # same millisecond (or the clock went back), keep the order of this process
+            now, randomness = _last[0], _last[1] + 1
+            if randomness > MAX_RANDOM:
+                now, randomness = now + 1, int.from_bytes(os.urandom(10), 'big')
+        else:
+            randomness = int.from_bytes(os.urandom(10), 'big')
+        _last[0], _last[1] = now, randomness
+    return id_from_time(now, randomness)
+
+
+def id_time(_id: str):
+    """
+    :return: creation time of an id in seconds, ValueError for a former uuid1 id
+    """
+    return (decode(_id) >> RANDOM_BITS) / 1000.0
+
+
+def to_bytes(_id: str):
+    """
+    16 bytes of an id, for a BINARY(16) column
+    """
+    return decode(_id).to_bytes(16, 'big')
+
+
+def from_bytes(data: bytes):
+    return encode(int.from_bytes(data, 'big'))
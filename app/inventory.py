@@ -0,0 +1,249 @@
+# coding: utf-8
+"""
+Every change of products.quantity goes through this module, as well as the stock reservations of the carts.
+
+Changes are single atomic statements (`quantity = quantity + :n`, and `quantity = quantity - :n ... WHERE
+quantity >= :n` for a decrement), so concurrent restocks and purchases never overwrite each other and the
+stock never goes negative. Each change adds a row to the stock_movements ledger in the same transaction.
+The caller commits, or rolls back on OutOfStockError.
+
+Putting a product in a cart reserves it for CART_RESERVATION_TTL seconds: the available stock of a product
+is products.quantity minus the live reservations of the other carts, one indexed aggregate on
+stock_reservations (product_id, expires_at). Expired reservations are deleted by a scheduler job.
+
+The storefront home bundle (app.home) shows products.quantity: once a transaction that changed the stock
+commits, the bundle is rebuilt. Reservations leave products.quantity as is and do not rebuild it.
+"""
+
+from flask import current_app
+from sqlalchemy import bindparam, select, func, and_, event
+
+from app.database import RoutingSession
+from app.extensions import db, home
+from app.ids import new_id
+from app.models import Product, ProductCost, StockMovement, StockReservation
+from app.utils import get_datetime_now_s
+
+# StockMovement.reason
+REASON_CREATE = 'create'
+REASON_IMPORT = 'import'
+REASON_RESTOCK = 'restock'
+REASON_CHECKOUT = 'checkout'
+REASON_CANCEL = 'cancel'
+# seconds a product stays reserved for a cart, overridden by the CART_RESERVATION_TTL config
+RESERVATION_TTL = 15 * 60
+
+
+class OutOfStockError(Exception):
+    def __init__(self, product_id, quantity):
+        super(OutOfStockError, self).__init__('Product {} has less than {} in stock'.format(product_id, quantity))
+        self.product_id = product_id
+        self.quantity = quantity
+
+
+def movement(product_id, change, reason, ref_id=None, now=None):
+    """
+    Ledger row of a change, as a dict for a bulk insert
+    """
+    return dict(id=new_id(), created_at=now or get_datetime_now_s(), product_id=product_id, change=change,
+                reason=reason, ref_id=ref_id)
+
+
+def record(movements):
+    """
+    Insert ledger rows, see movement()
+    """
+    if movements:
+        # products added to the session are not written yet, the ledger references them
+        db.session.flush()
+        db.session.execute(StockMovement.__table__.insert(), movements)
+        db.session.info['stock_changed'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def stock_committed(session):
+    """
+    Rebuild the home bundle after the commit, a rebuild started before it would read the former stock
+    """
+    if session.info.pop('stock_changed', False):
+        home.invalidate()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def stock_rolled_back(session):
+    session.info.pop('stock_changed', None)
+
+
+def add(product_id: str, quantity: int, reason: str, ref_id: str = None):
+    """
+    Add quantity to the stock of a product
+    :return: False if the product does not exist
+    """
+    table = Product.__table__
+    now = get_datetime_now_s()
+    updated = db.session.execute(table.update().where(table.c.id == product_id)
+                                 .values(quantity=table.c.quantity + quantity, updated_at=now)).rowcount
+    if updated:
+        record([movement(product_id, quantity, reason, ref_id, now)])
+    return updated > 0
+
+
+def remove(product_id: str, quantity: int, reason: str, ref_id: str = None, cart_id: str = None):
+    """
+    Take quantity from the stock of a product, only if that much is left
+    :param cart_id: buying cart, the stock reserved by the other carts is not taken
+    :raise OutOfStockError: not enough stock (or no such product), nothing changed
+    """
+    table = Product.__table__
+    now = get_datetime_now_s()
+    stock = table.c.quantity
+    if cart_id is not None:
+        stock = stock - reserved_query(product_id, cart_id, now).as_scalar()
+    updated = db.session.execute(table.update().where((table.c.id == product_id) & (stock >= quantity))
+                                 .values(quantity=table.c.quantity - quantity, updated_at=now)).rowcount
+    if not updated:
+        raise OutOfStockError(product_id, quantity)
+    record([movement(product_id, -quantity, reason, ref_id, now)])
+
+
+def remove_many(quantities: dict, reason: str, ref_id: str = None, cart_id: str = None):
+    """
+    Take the stock of several products (ex: the lines of an order), all or nothing once the caller rolls back.
+    Products are locked in id order so two orders sharing products cannot deadlock.
+    :param quantities: product_id -> quantity
+    :param cart_id: see remove()
+    :raise OutOfStockError: for the first product without enough stock
+    """
+    for product_id in sorted(quantities):
+        remove(product_id, quantities[product_id], reason, ref_id, cart_id)
+
+
+def add_many(quantities: dict, reason: str, ref_id: str = None):
+    """
+    Add stock to several products with one executemany
+    :param quantities: product_id -> quantity, the products must exist
+    """
+    if not quantities:
+        return
+    table = Product.__table__
+    now = get_datetime_now_s()
+    db.session.execute(table.update().where(table.c.id == bindparam('product_id'))
+                       .values(quantity=table.c.quantity + bindparam('added'), updated_at=now),
+                       [dict(product_id=_id, added=quantity) for _id, quantity in sorted(quantities.items())])
+    record([movement(_id, quantity, reason, ref_id, now) for _id, quantity in quantities.items()])
+
+
+def restock(items: list, content: str = None):
+    """
+    Warehouse intake: add stock to many products and write one product_cost row per entry
+    :param items: list of dict(product_id, quantity, buy_price), a product may appear several times
+    :param content: note of the cost rows
+    :return: number of restocked products
+    """
+    now = get_datetime_now_s()
+    quantities = {}
+    for item in items:
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+    add_many(quantities, REASON_RESTOCK)
+    db.session.execute(ProductCost.__table__.insert(), [
+        dict(id=new_id(), created_at=now, cost=item['buy_price'], quantity=item['quantity'],
+             total=float(item['buy_price'] * item['quantity']),
+             content=content or 'Nhap hang luc: {}'.format(now), product_id=item['product_id'])
+        for item in items])
+    return len(quantities)
+
+
+def order_quantities(order):
+    """
+    product_id -> ordered quantity of an Order, lines of deleted products are skipped
+    """
+    quantities = {}
+    for detail in order.items:
+        if detail.product_id is not None:
+            quantities[detail.product_id] = quantities.get(detail.product_id, 0) + detail.quantity
+    return quantities
+
+
+def release_order(order):
+    """
+    Give back the stock of a cancelled order
+    """
+    for product_id, quantity in sorted(order_quantities(order).items()):
+        add(product_id, quantity, REASON_CANCEL, order.id)
+
+
+def reservation_ttl():
+    return current_app.config.get('CART_RESERVATION_TTL', RESERVATION_TTL)
+
+
+def reserved_query(product_id: str, cart_id: str = None, now: int = None):
+    """
+    Quantity of a product held by the live reservations of the carts other than cart_id
+    """
+    table = StockReservation.__table__
+    query = select([func.coalesce(func.sum(table.c.quantity), 0)]) \
+        .where(and_(table.c.product_id == product_id, table.c.expires_at > (now or get_datetime_now_s())))
+    if cart_id is not None:
+        query = query.where(table.c.cart_id != cart_id)
+    return query
+
+
+def available(product_id: str, cart_id: str = None):
+    """
+    Stock a cart can still take: products.quantity minus what the other carts reserved
+    :return: None if the product does not exist
+    """
+    table = Product.__table__
+    return db.session.execute(select([table.c.quantity - reserved_query(product_id, cart_id).as_scalar()])
+                              .where(table.c.id == product_id)).scalar()
+
+
+def reserve(cart_id: str, product_id: str, quantity: int):
+    """
+    Hold quantity of a product for a cart until now + reservation_ttl(), replaces the previous reservation of
+    the cart for that product. The caller commits.
+    :raise OutOfStockError: less than quantity available, nothing changed
+    """
+    now = get_datetime_now_s()
+    products = Product.__table__
+    # the product row lock makes the reservations of a product go one at a time,
+    # locking reads see the reservations committed while waiting for it
+    stock = db.session.execute(select([products.c.quantity]).where(products.c.id == product_id)
+                               .with_for_update()).scalar()
+    if stock is None or \
+            stock - db.session.execute(reserved_query(product_id, cart_id, now).with_for_update(read=True)).scalar() \
+            < quantity:
+        raise OutOfStockError(product_id, quantity)
+
+    table = StockReservation.__table__
+    expires_at = now + reservation_ttl()
+    updated = db.session.execute(table.update().where(and_(table.c.cart_id == cart_id,
+                                                           table.c.product_id == product_id))
+                                 .values(quantity=quantity, expires_at=expires_at)).rowcount
+    if not updated:
+        # the cart may not be written yet
+        db.session.flush()
+        db.session.execute(table.insert().values(id=new_id(), created_at=now, expires_at=expires_at,
+                                                 quantity=quantity, cart_id=cart_id, product_id=product_id))
+
+
+def release(cart_id: str, product_id: str = None):
+    """
+    Drop the reservations of a cart, or of one product of the cart. The caller commits.
+    """
+    table = StockReservation.__table__
+    query = table.delete().where(table.c.cart_id == cart_id)
+    if product_id is not None:
+        query = query.where(table.c.product_id == product_id)
+    db.session.execute(query)
+
+
+def expire_reservations():
+    """
+    Delete every reservation past its TTL in one statement
+    :return: number of deleted reservations
+    """
+    table = StockReservation.__table__
+    deleted = db.session.execute(table.delete().where(table.c.expires_at <= get_datetime_now_s())).rowcount
+    db.session.commit()
+    return deleted
@@ -0,0 +1,253 @@
+# coding: utf-8
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from flask import request, g, Response
+
+# Latency buckets (seconds), same defaults as the Prometheus client libraries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class MetricsRegistry(object):
+    """
+    Request counters and latency histograms of the current process.
+
+    Every uwsgi worker keeps its own samples in memory and dumps them to
+    `<directory>/metrics_<pid>.json` at most once per `flush_interval` seconds.
+    Collecting reads every worker file, so the metrics endpoint reports the
+    totals of all workers whichever worker serves the scrape.
+
+    Collectors are callables returning extra samples of the worker (ex: pool usage),
+    list of dict(name, help, type, labels, value). They are evaluated on every dump
+    and reported with a `pid` label.
+    """
+
+    def __init__(self, directory=None, buckets=DEFAULT_BUCKETS, flush_interval=5):
+        self.directory = directory
+        self.buckets = tuple(buckets)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_flush = 0
+        self.collectors = []
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self.requests = {}
+        self.errors = {}
+        self.histograms = {}
+
+    def _check_fork(self):
+        # uwsgi forks workers after the app is loaded, drop the samples copied from the master
+        if self._pid != os.getpid():
+            self._reset()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, 'metrics_{}.json'.format(os.getpid()))
+
+    def observe(self, method, endpoint, status, duration):
+        """
+        Record a finished request
+        :param method: HTTP method
+        :param endpoint: flask endpoint name, ex: products.get_all
+        :param status: HTTP status code
+        :param duration: latency in seconds
+        """
+        key = (method, endpoint, str(status))
+        with self._lock:
+            self._check_fork()
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if status >= 500:
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = dict(buckets=[0] * len(self.buckets), sum=0.0, count=0)
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += duration
+            histogram['count'] += 1
+
+            if self.directory and time.time() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def _collect_samples(self):
+        samples = []
+        for collector in self.collectors:
+            try:
+                for sample in collector():
+                    samples.append(dict(sample, labels=dict(sample.get('labels', {}), pid=str(self._pid))))
+            except Exception:
+                continue
+        return samples
+
+    def _snapshot(self):
+        return dict(
+            buckets=list(self.buckets),
+            requests=[list(key) + [value] for key, value in self.requests.items()],
+            errors=[list(key) + [value] for key, value in self.errors.items()],
+            histograms=[list(key) + [value] for key, value in self.histograms.items()],
+            samples=self._collect_samples(),
+        )
+
+    def _flush(self):
+        """
+        Write samples of this worker, file is replaced atomically so readers never see a partial dump
+        """
+        self._last_flush = time.time()
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.metrics_')
+            with os.fdopen(fd, 'w') as file:
+                json.dump(self._snapshot(), file)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def collect(self):
+        """
+        Merge samples of all workers
+        :return: (requests, errors, histograms) keyed by (method, endpoint, status), samples of the collectors
+        """
+        with self._lock:
+            self._check_fork()
+            if self.directory:
+                self._flush()
+            else:
+                snapshots = [self._snapshot()]
+
+        if self.directory:
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+                try:
+                    with open(path) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+
+        requests, errors, histograms, samples = {}, {}, {}, []
+        for snapshot in snapshots:
+            if tuple(snapshot['buckets']) != self.buckets:
+                continue
+            samples += snapshot.get('samples', [])
+            for row in snapshot['requests']:
+                key = tuple(row[:3])
+                requests[key] = requests.get(key, 0) + row[3]
+            for row in snapshot['errors']:
+                key = tuple(row[:3])
+                errors[key] = errors.get(key, 0) + row[3]
+            for row in snapshot['histograms']:
+                key, value = tuple(row[:3]), row[3]
+                histogram = histograms.get(key)
+                if histogram is None:
+                    histogram = histograms[key] = dict(buckets=[0] * len(self.buckets), sum=0.0, count=0)
+                for i, count in enumerate(value['buckets']):
+                    histogram['buckets'][i] += count
+                histogram['sum'] += value['sum']
+                histogram['count'] += value['count']
+        return requests, errors, histograms, samples
+
+    def render(self):
+        """
+        Render merged samples in the Prometheus text exposition format
+        """
+        requests, errors, histograms, samples = self.collect()
+        lines = ['# HELP http_requests_total Total HTTP requests by endpoint and status.',
+                 '# TYPE http_requests_total counter']
+        for key in sorted(requests):
+            lines.append('http_requests_total{{{}}} {}'.format(_labels(key), requests[key]))
+
+        lines += ['# HELP http_request_errors_total Total HTTP requests answered with a 5xx status.',
+                  '# TYPE http_request_errors_total counter']
+        for key in sorted(errors):
+            lines.append('http_request_errors_total{{{}}} {}'.format(_labels(key), errors[key]))
+
+        lines += ['# HELP http_request_duration_seconds HTTP request latency by endpoint and status.',
+                  '# TYPE http_request_duration_seconds histogram']
+        for key in sorted(histograms):
+            histogram = histograms[key]
+            labels = _labels(key)
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                lines.append('http_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, count))
+            lines.append('http_request_duration_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, histogram['count']))
+            lines.append('http_request_duration_seconds_sum{{{}}} {}'.format(labels, histogram['sum']))
+            lines.append('http_request_duration_seconds_count{{{}}} {}'.format(labels, histogram['count']))
+
+        described = set()
+        for sample in sorted(samples, key=lambda item: item['name']):
+            if sample['name'] not in described:
+                described.add(sample['name'])
+                lines += ['# HELP {} {}'.format(sample['name'], sample.get('help', '')),
+                          '# TYPE {} {}'.format(sample['name'], sample.get('type', 'gauge'))]
+            labels = ','.join('{}="{}"'.format(key, value) for key, value in sorted(sample['labels'].items()))
+            lines.append('{}{{{}}} {}'.format(sample['name'], labels, sample['value']))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(key):
+    method, endpoint, status = key
+    blueprint = endpoint.split('.', 1)[0] if '.' in endpoint else ''
+    return 'method="{}",blueprint="{}",endpoint="{}",status="{}"'.format(method, blueprint, endpoint, status)
+
+
+class RequestMetrics(object):
+    """
+    Flask extension recording count, 5xx errors and latency of every request.
+
+    Config:
+        METRICS_ENABLED: default True
+        METRICS_ENDPOINT: url of the scrape endpoint, default /metrics
+        METRICS_DIR: directory shared by the workers, default <tmp>/vlhb_metrics
+        METRICS_FLUSH_INTERVAL: seconds between two dumps of a worker, default 5
+    """
+
+    def __init__(self, app=None):
+        self.registry = None
+        if app is not None:
+            self.init_app(app)
+
+    def add_collector(self, collector):
+        """
+        Report extra samples of the worker, see MetricsRegistry
+        """
+        if self.registry is not None:
+            self.registry.add_collector(collector)
+
+    def init_app(self, app):
+        if not app.config.get('METRICS_ENABLED', True):
+            return
+
+        directory = app.config.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'vlhb_metrics')
+        os.makedirs(directory, exist_ok=True)
+        # the app is loaded once in the uwsgi master, drop dumps left by the previous run
+        for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+            os.remove(path)
+        self.registry = MetricsRegistry(directory=directory,
+                                        flush_interval=app.config.get('METRICS_FLUSH_INTERVAL', 5))
+        metrics_url = app.config.get('METRICS_ENDPOINT', '/metrics')
+
+        @app.before_request
+        def start_timer():
+            g.request_start_time = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            start = g.pop('request_start_time', None)
+            if start is not None and request.path != metrics_url:
+                endpoint = request.endpoint or 'unmatched'
+                self.registry.observe(request.method, endpoint, response.status_code, time.perf_counter() - start)
+            return response
+
+        def metrics():
+            return Response(self.registry.render(), mimetype='text/plain; version=0.0.4')
+
+        app.add_url_rule(metrics_url, 'metrics', metrics, methods=['GET'])
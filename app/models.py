@@ -1,11 +1,14 @@
 # coding: utf-8
 
 from flask_jwt_extended.utils import decode_token, get_raw_jwt
-from sqlalchemy import desc, asc, func
+from flask_sqlalchemy import Pagination
+from sqlalchemy import desc, asc, func, case, exists, and_, or_, select, literal, null, cast, union_all, String
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload, defaultload, load_only
 
 from app.enums import DEFAULT_BOOK_COVER
-from app.extensions import db
-from app.utils import send_error, get_datetime_now_s
+from app.extensions import db, catalog
+from app.utils import send_error, get_datetime_now_s, sparse_json
 
 
 class User(db.Model):
@@ -22,6 +25,8 @@ class User(db.Model):
     phone = db.Column(db.String(20), default=None)
     status = db.Column(db.Boolean, default=True)
     is_admin = db.Column(db.Boolean, default=False)
+    # copied in the claims of the tokens, bumping it revokes every token issued before, see RevokedToken
+    token_epoch = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def json(self):
         return dict(
@@ -53,6 +58,28 @@ class User(db.Model):
     def find_by_username(cls, username: str):
         return cls.query.filter_by(user_name=username).first()
 
+    @classmethod
+    def search(cls, name: str, page: int, limit: int):
+        """
+        Page of the users ordered by user_name, name is a prefix matched on the index of the column
+        """
+        query = cls.query
+        if name:
+            query = query.filter(cls.user_name.startswith(name))
+        return query.order_by(cls.user_name).paginate(page=page, per_page=limit, error_out=False)
+
+    def token_claims(self):
+        """
+        user_claims of the tokens of this user
+        """
+        return {'epoch': self.token_epoch or 0}
+
+    def revoke_all_tokens(self):
+        """
+        Revoke every token of the user issued so far, written with the next commit
+        """
+        self.token_epoch = User.token_epoch + 1
+
     def save_to_db(self):
         db.session.add(self)
         db.session.commit()
@@ -193,11 +220,62 @@ class TokenBlacklist(db.Model):
         db.session.commit()
 
 
+class RevokedToken(db.Model):
+    """
+    Denylist of the tokens revoked one by one (logout), a row lives until its token expires.
+    Login and refresh write nothing: tokens carry User.token_epoch in their claims and revoking all the tokens
+    of a user bumps it. Tokens issued before the epoch claim existed are also checked against TokenBlacklist.
+    """
+    __tablename__ = 'revoked_tokens'
+
+    jti = db.Column(db.String(36), primary_key=True)
+    user_identity = db.Column(db.String(50), nullable=False)
+    expires = db.Column(db.Integer, nullable=False, index=True)
+
+    @staticmethod
+    def revoke(decoded_token):
+        """
+        Revoke one token
+        """
+        try:
+            with db.session.begin_nested():
+                db.session.execute(RevokedToken.__table__.insert().values(
+                    jti=decoded_token['jti'], user_identity=decoded_token['identity'],
+                    expires=decoded_token['exp']))
+        except IntegrityError:
+            # already revoked
+            pass
+        db.session.commit()
+
+    @staticmethod
+    def is_token_revoked(decoded_token):
+        """
+        One indexed query: the token is revoked if its user is gone, its epoch is not the current one of the user
+        or its jti is in the denylist
+        """
+        claims = decoded_token.get('user_claims') or {}
+        # tokens issued before the epoch claim are epoch 0 and must also be valid in the former table
+        if 'epoch' not in claims and TokenBlacklist.is_token_revoked(decoded_token):
+            return True
+        row = db.session.execute(select([User.token_epoch,
+                                          exists().where(RevokedToken.jti == decoded_token['jti'])])
+                                 .where(User.id == decoded_token['identity'])).first()
+        return row is None or row[0] != claims.get('epoch', 0) or bool(row[1])
+
+    @staticmethod
+    def prune_database():
+        """
+        Delete the rows of the expired tokens
+        """
+        db.session.execute(RevokedToken.__table__.delete().where(RevokedToken.expires < get_datetime_now_s()))
+        db.session.commit()
+
+
 class Category(db.Model):
     __tablename__ = 'categories'
 
     id = db.Column(db.String(40), primary_key=True)
-    name = db.Column(db.String(80), nullable=False)
+    name = db.Column(db.String(80), nullable=False, index=True)
     created_at = db.Column(db.Integer, nullable=False, default=get_datetime_now_s())
 
     products = db.relationship('Product', backref='Category', lazy=True, cascade='all, delete-orphan',
@@ -218,6 +296,16 @@ class Category(db.Model):
     def find_by_id(cls, _id: str):
         return cls.query.filter_by(id=_id).first()
 
+    @classmethod
+    def search(cls, name: str, page: int, limit: int):
+        """
+        Page of the categories ordered by name, name is a prefix matched on the index of the column
+        """
+        query = cls.query
+        if name:
+            query = query.filter(cls.name.startswith(name))
+        return query.order_by(cls.name).paginate(page=page, per_page=limit, error_out=False)
+
     def save_to_db(self):
         db.session.add(self)
         db.session.commit()
@@ -252,46 +340,56 @@ class Product(db.Model):
     images = db.relationship('ProductImage', backref='Product', lazy=True, cascade='all, delete-orphan',
                              passive_deletes=True)
 
-    def json(self):
-        return dict(
-            id=self.id,
-            title=self.title,
-            price=self.price,
-            publish_year=self.publish_year,
-            page_number=self.page_number,
-            quantity=self.quantity,
-            quotes_about=self.quotes_about,
-            discount=self.discount,
-            author=dict(
-                name=self.author.name,
-                id=self.author.id),
-            publisher=self.publisher.json(),
-            category=self.category.json(),
-            images=list(image.imageURL for image in self.images),
-            created_at=self.created_at,
-            updated_at=self.updated_at
-        )
+    # ?fields= of the product endpoints -> relationship loaded for it, the other fields are columns
+    RELATION_FIELDS = ('author', 'publisher', 'category', 'images')
 
-    def json_admin(self):
-        return dict(
-            id=self.id,
-            title=self.title,
-            price=self.price,
-            publish_year=self.publish_year,
-            page_number=self.page_number,
-            quantity=self.quantity,
-            quotes_about=self.quotes_about,
-            discount=self.discount,
-            author=dict(
+    def json(self, fields: set = None):
+        """
+        :param fields: sparse fieldset, None for all fields
+        """
+        return sparse_json(
+            fields,
+            id=lambda: self.id,
+            title=lambda: self.title,
+            price=lambda: self.price,
+            publish_year=lambda: self.publish_year,
+            page_number=lambda: self.page_number,
+            quantity=lambda: self.quantity,
+            quotes_about=lambda: self.quotes_about,
+            discount=lambda: self.discount,
+            author=lambda: dict(
                 name=self.author.name,
                 id=self.author.id),
-            publisher=self.publisher.json(),
-            category=self.category.json(),
-            images=list(dict(id=image.id, url=image.imageURL) for image in self.images),
-            created_at=self.created_at,
-            updated_at=self.updated_at
+            publisher=lambda: self.publisher.json(),
+            category=lambda: self.category.json(),
+            images=lambda: list(image.imageURL for image in self.images),
+            created_at=lambda: self.created_at,
+            updated_at=lambda: self.updated_at
         )
 
+    def json_admin(self, fields: set = None):
+        """
+        :param fields: sparse fieldset, None for all fields
+        """
+        data = self.json(fields)
+        if 'images' in data:
+            data['images'] = list(dict(id=image.id, url=image.imageURL) for image in self.images)
+        return data
+
+    @classmethod
+    def load_options(cls, fields: set = None):
+        """
+        Loader options of the products of a list serialized with json(fields): only the requested columns, and
+        the requested relationships loaded with the page instead of one lazy load per product
+        """
+        relations = cls.RELATION_FIELDS if fields is None else [name for name in cls.RELATION_FIELDS
+                                                                    if name in fields]
+        options = [selectinload(cls.images) if name == 'images' else joinedload(getattr(cls, name))
+                   for name in relations]
+        if fields is not None:
+            options.append(load_only(*[name for name in fields if name in cls.__table__.c] or ['id']))
+        return options
+
     def mini_json(self):
         return dict(
             id=self.id,
@@ -308,22 +406,78 @@ class Product(db.Model):
     def find_by_id(cls, _id: str):
         return cls.query.filter_by(id=_id).first()
 
+    @classmethod
+    def find_detail_by_id(cls, _id: str, fields: set = None):
+        """
+        Same as find_by_id, with what json(fields) reads loaded in the same round-trips
+        """
+        return cls.query.options(*cls.load_options(fields)).filter_by(id=_id).first()
+
+    @classmethod
+    def find_by_ids(cls, ids: list, options: list = ()):
+        """
+        Products of ids, in the same order
+        :param options: loader options, ex: load_options(fields)
+        """
+        products = {product.id: product for product in cls.query.options(*options).filter(cls.id.in_(ids))} \
+            if ids else {}
+        return [products[_id] for _id in ids if _id in products]
+
+    @classmethod
+    def find_missing_ids(cls, ids):
+        """
+        Ids that are not products
+        """
+        ids = list(set(ids))
+        known = set()
+        for start in range(0, len(ids), 1000):
+            known.update(row[0] for row in db.session.query(cls.id).filter(cls.id.in_(ids[start:start + 1000])))
+        return sorted(set(ids) - known)
+
     @classmethod
     def find_random(cls):
         return cls.query.order_by(func.rand()).first()
 
+    @classmethod
+    def find_related(cls, product, limit: int, fields: set = None):
+        """
+        Other products of the same author or category, the ones of the same author first
+        :param fields: sparse fieldset they are serialized with, see load_options
+        """
+        same_author = cls.author_id == product.author_id
+        return cls.query.options(*cls.load_options(fields)) \
+            .filter(cls.id != product.id, or_(same_author, cls.category_id == product.category_id)) \
+            .order_by(desc(case([(same_author, 1)], else_=0)), desc(cls.created_at)).limit(limit).all()
+
+    @classmethod
+    def best_sellers(cls, limit: int = 10):
+        """
+        Most sold products, completed with random products while less than limit were sold
+        """
+        # calculate best seller product from order table
+        results = db.session.execute('SELECT product_id, SUM(quantity) AS TotalQuantity FROM order_details '
+                                     'WHERE product_id IS NOT NULL GROUP BY '
+                                     'product_id ORDER BY SUM(quantity) DESC LIMIT :val', {'val': limit})
+        items = cls.find_by_ids([row['product_id'] for row in results], cls.load_options())
+        while len(items) < limit:
+            product = cls.find_random()
+            if product is None:
+                break
+            items.append(product)
+        return items
+
     @classmethod
     def filter(cls, name: str, category_id: str, sort: str, min_price: float, max_price: float, limit: int, page: int,
-               from_date: int, to_date: int):
-        query = cls.query
-        if name:
-            query = query.filter(Product.title.contains(name))
-        if category_id:
-            query = query.filter(Product.category_id == category_id)
-        if from_date:
-            query = query.filter(Product.updated_at >= from_date, Product.updated_at <= to_date)
-        if min_price:
-            query = query.filter(Product.price >= min_price, Product.price <= max_price)
+               from_date: int, to_date: int, fields: set = None):
+        """
+        :param fields: sparse fieldset the products are serialized with, see load_options
+        """
+        if catalog.enabled:
+            page, limit = page or 1, limit or 20
+            ids, total = catalog.page(name, category_id, sort, min_price, max_price, limit, page, from_date, to_date)
+            return Pagination(None, page, limit, total, cls.find_by_ids(ids, cls.load_options(fields)))
+        query = cls.query.options(*cls.load_options(fields)) \
+            .filter(*cls.filter_conditions(name, category_id, min_price, max_price, from_date, to_date))
         if sort:
             if sort == 'price,desc':
                 query = query.order_by(desc(Product.price))
@@ -335,6 +489,63 @@ class Product(db.Model):
                 query = query.order_by(asc(Product.created_at))
         return query.paginate(page=page, per_page=limit, error_out=False)
 
+    @staticmethod
+    def filter_conditions(name: str, category_id: str, min_price: float, max_price: float, from_date: int,
+                          to_date: int):
+        """
+        Where clauses of the catalog search, shared by filter() and facets()
+        """
+        conditions = []
+        if name:
+            conditions.append(Product.title.contains(name))
+        if category_id:
+            conditions.append(Product.category_id == category_id)
+        if from_date:
+            conditions += [Product.updated_at >= from_date, Product.updated_at <= to_date]
+        if min_price:
+            conditions += [Product.price >= min_price, Product.price <= max_price]
+        return conditions
+
+    @classmethod
+    def facets(cls, name: str, category_id: str, min_price: float, max_price: float, from_date: int, to_date: int,
+               price_buckets: list):
+        """
+        Number of products per category, author, publisher and price bucket matching the search, in one round-trip.
+        The category and price facets ignore their own filter so the other values stay selectable.
+        :param price_buckets: sorted lower bounds of the price buckets, ex: [0, 50000, 100000]
+        :return: dict(categories, authors, publishers, prices)
+        """
+        everything = cls.filter_conditions(name, category_id, min_price, max_price, from_date, to_date)
+        any_category = cls.filter_conditions(name, None, min_price, max_price, from_date, to_date)
+        any_price = cls.filter_conditions(name, category_id, None, None, from_date, to_date)
+        count = func.count(Product.id).label('count')
+
+        def group_by(facet, model, conditions):
+            return select([literal(facet).label('facet'), model.id.label('value'), model.name.label('name'), count]) \
+                .select_from(Product.__table__.join(model.__table__, getattr(Product, facet + '_id') == model.id)) \
+                .where(and_(True, *conditions)).group_by(model.id, model.name)
+
+        bucket = case([(Product.price >= edge, index) for index, edge in reversed(list(enumerate(price_buckets)))],
+                      else_=-1)
+        prices = select([literal('price'), cast(bucket, String(40)), null(), count]).where(and_(True, *any_price)) \
+            .group_by(bucket)
+        query = union_all(group_by('category', Category, any_category), group_by('author', Author, everything),
+                          group_by('publisher', Publisher, everything), prices)
+
+        res = dict(categories=[], authors=[], publishers=[], prices=[])
+        counts = {}
+        for row in db.session.execute(query):
+            if row['facet'] == 'price':
+                counts[int(row['value'])] = row['count']
+            else:
+                res[row['facet'] + 's'].append(dict(id=row['value'], name=row['name'], count=row['count']))
+        for key in ('categories', 'authors', 'publishers'):
+            res[key].sort(key=lambda item: (-item['count'], item['name']))
+        for index, edge in enumerate(price_buckets):
+            upper = price_buckets[index + 1] if index + 1 < len(price_buckets) else None
+            res['prices'].append(dict(min_price=edge, max_price=upper, count=counts.get(index, 0)))
+        return res
+
     def save_to_db(self):
         db.session.add(self)
         db.session.commit()
@@ -405,42 +616,84 @@ class Order(db.Model):
     items = db.relationship('OrderDetail', backref='Order', lazy=True, cascade='all, delete-orphan',
                             passive_deletes=True)
 
-    def json(self):
-        return dict(
-            id=self.id,
-            created_at=self.created_at,
-            status=self.status,
-            subtotal=self.subtotal,
-            item_discount=self.item_discount,
-            tax=self.tax,
-            shipping=self.shipping,
-            total=self.total,
-            promo=self.promo,
-            discount=self.discount,
-            grand_total=self.grand_total,
-            content=self.content,
-            user_id=self.user_id,
-            address=self.address.json(),
-            items=list(detail.json() for detail in self.items),
+    def json(self, fields: set = None):
+        """
+        :param fields: sparse fieldset, None for all fields
+        """
+        return sparse_json(
+            fields,
+            id=lambda: self.id,
+            created_at=lambda: self.created_at,
+            status=lambda: self.status,
+            subtotal=lambda: self.subtotal,
+            item_discount=lambda: self.item_discount,
+            tax=lambda: self.tax,
+            shipping=lambda: self.shipping,
+            total=lambda: self.total,
+            promo=lambda: self.promo,
+            discount=lambda: self.discount,
+            grand_total=lambda: self.grand_total,
+            content=lambda: self.content,
+            user_id=lambda: self.user_id,
+            address=lambda: self.address.json(),
+            items=lambda: list(detail.json() for detail in self.items),
         )
 
-    def json_many(self):
-        return dict(
-            id=self.id,
-            created_at=self.created_at,
-            status=self.status,
-            grand_total=self.grand_total,
-            user_id=self.user_id,
-            address=self.address.json(),
-            items=list(
-                dict(
-                    price=detail.price,
-                    quantity=detail.quantity,
-                    discount=detail.discount,
-                    product_name=detail.product.title
-                ) for detail in self.items)
+    def json_many(self, fields: set = None):
+        """
+        :param fields: sparse fieldset, None for all fields
+        """
+        return sparse_json(
+            fields,
+            id=lambda: self.id,
+            created_at=lambda: self.created_at,
+            status=lambda: self.status,
+            grand_total=lambda: self.grand_total,
+            user_id=lambda: self.user_id,
+            address=lambda: self.address.json(),
+            items=lambda: list(detail.mini_json() for detail in self.items)
         )
 
+    @staticmethod
+    def column_options(fields: set = None):
+        """
+        load_only of the requested columns, nothing for all fields
+        """
+        if fields is None:
+            return []
+        return [load_only(*[name for name in fields if name in Order.__table__.c] or ['id'])]
+
+    @staticmethod
+    def listing_options(fields: set = None):
+        """
+        Load what json_many(fields) reads in 2 queries per page (orders + address, details)
+        instead of 1 + N + N x M lazy loads
+        """
+        options = Order.column_options(fields)
+        if fields is None or 'address' in fields:
+            options.append(joinedload(Order.address))
+        if fields is None or 'items' in fields:
+            options.append(selectinload(Order.items).load_only('order_id', 'price', 'quantity', 'discount',
+                                                               'product_title', 'thumbnail_url'))
+        return options
+
+    @staticmethod
+    def detail_options(fields: set = None):
+        """
+        Load what json(fields) reads: address, details and the full product of each detail
+        """
+        options = Order.column_options(fields)
+        if fields is None or 'address' in fields:
+            options.append(joinedload(Order.address))
+        if fields is None or 'items' in fields:
+            product = defaultload(Order.items).joinedload(OrderDetail.product)
+            options += [selectinload(Order.items),
+                        product.joinedload(Product.author),
+                        product.joinedload(Product.publisher),
+                        product.joinedload(Product.category),
+                        product.selectinload(Product.images)]
+        return options
+
     @classmethod
     def find_all(cls):
         return cls.query.all()
@@ -450,12 +703,20 @@ class Order(db.Model):
         return cls.query.filter_by(id=_id).first()
 
     @classmethod
-    def find_by_user_id(cls, user_id: str, page: int, limit: int):
-        return cls.query.filter_by(user_id=user_id).paginate(page=page, per_page=limit, error_out=False)
+    def find_detail_by_id(cls, _id: str, fields: set = None):
+        """
+        Same as find_by_id, with everything json(fields) needs loaded up front
+        """
+        return cls.query.options(*cls.detail_options(fields)).filter_by(id=_id).first()
 
     @classmethod
-    def search(cls, from_date: int, to_date: int, limit: int, page: int):
-        query = cls.query
+    def find_by_user_id(cls, user_id: str, page: int, limit: int, fields: set = None):
+        return cls.query.options(*cls.listing_options(fields)).filter_by(user_id=user_id) \
+            .paginate(page=page, per_page=limit, error_out=False)
+
+    @classmethod
+    def search(cls, from_date: int, to_date: int, limit: int, page: int, fields: set = None):
+        query = cls.query.options(*cls.listing_options(fields))
         if from_date:
             query = query.filter(Order.created_at >= from_date, Order.created_at <= to_date)
         return query.paginate(page=page, per_page=limit, error_out=False)
@@ -475,12 +736,18 @@ class OrderDetail(db.Model):
     id = db.Column(db.String(40), primary_key=True)
     created_at = db.Column(db.Integer, nullable=False, default=get_datetime_now_s())
     updated_at = db.Column(db.Integer, default=None)
-    product_id = db.Column(db.String(40), db.ForeignKey('products.id', ondelete='CASCADE'))
+    # order lines outlive the product, see the snapshot below
+    product_id = db.Column(db.String(40), db.ForeignKey('products.id', ondelete='SET NULL'))
     order_id = db.Column(db.String(40), db.ForeignKey('orders.id', ondelete='CASCADE'))
     price = db.Column(db.Float(precision=2), nullable=False, default=0.0)
     quantity = db.Column(db.SmallInteger, nullable=False, default=0)
     discount = db.Column(db.Float(precision=2), nullable=False, default=0.0)
     content = db.Column(db.Text, default=None)
+    # snapshot of the product at checkout, order history does not change with the catalog
+    product_title = db.Column(db.String(80), default=None)
+    thumbnail_url = db.Column(db.Text, default=None)
+    category_id = db.Column(db.String(40), default=None)
+    category_name = db.Column(db.String(80), default=None)
 
     product = db.relationship('Product')
 
@@ -491,9 +758,56 @@ class OrderDetail(db.Model):
             price=self.price,
             quantity=self.quantity,
             discount=self.discount,
-            product=self.product.json()
+            product_title=self.product_title,
+            thumbnail_url=self.thumbnail_url,
+            category=dict(id=self.category_id, name=self.category_name),
+            product=self.product.json() if self.product else None
         )
 
+    def mini_json(self):
+        return dict(
+            price=self.price,
+            quantity=self.quantity,
+            discount=self.discount,
+            product_name=self.product_title,
+            thumbnail_url=self.thumbnail_url
+        )
+
+    def snapshot(self, product):
+        """
+        Copy what order history shows of the product into the order line
+        :param product: Product
+        """
+        self.product_title = product.title
+        self.thumbnail_url = product.images[0].imageURL if len(product.images) > 0 else DEFAULT_BOOK_COVER
+        self.category_id = product.category_id
+        self.category_name = product.category.name
+
+    @classmethod
+    def backfill_snapshot(cls, connection=None):
+        """
+        Fill the product snapshot of the order lines written before it existed
+        :param connection: SQLAlchemy connection, default db.session which is committed
+        :return: number of updated order lines
+        """
+        bind = connection if connection is not None else db.session
+        product = Product.__table__
+        image = ProductImage.__table__
+        category = Category.__table__
+        table = cls.__table__
+        thumbnail = select([image.c.imageURL]).where(image.c.product_id == table.c.product_id) \
+            .order_by(image.c.id).limit(1).as_scalar()
+        update = table.update().where(and_(table.c.product_title.is_(None), table.c.product_id.isnot(None))).values(
+            product_title=select([product.c.title]).where(product.c.id == table.c.product_id).as_scalar(),
+            thumbnail_url=func.coalesce(thumbnail, DEFAULT_BOOK_COVER),
+            category_id=select([product.c.category_id]).where(product.c.id == table.c.product_id).as_scalar(),
+            category_name=select([category.c.name]).where(and_(product.c.id == table.c.product_id,
+                                                               category.c.id == product.c.category_id)).as_scalar())
+        count = bind.execute(update).rowcount
+        if connection is None:
+            db.session.commit()
+        return count
+
     @classmethod
     def find_all(cls):
         return cls.query.all()
@@ -511,6 +825,67 @@ class OrderDetail(db.Model):
         db.session.commit()
 
 
+class PurchasedProduct(db.Model):
+    """
+    One row per (user, product) the user has ordered, filled at checkout.
+    Answers "has this user bought this product" with a primary key lookup instead of scanning the orders.
+    """
+    __tablename__ = 'purchased_products'
+
+    user_id = db.Column(db.String(40), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    product_id = db.Column(db.String(40), db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    order_id = db.Column(db.String(40), default=None)
+    purchased_at = db.Column(db.Integer, default=None)
+
+    @classmethod
+    def add(cls, user_id: str, product_ids: list, order_id: str):
+        """
+        Record the products of a new order, the caller commits
+        """
+        known = {row[0] for row in db.session.query(cls.product_id).filter(cls.user_id == user_id,
+                                                                           cls.product_id.in_(product_ids))}
+        now = get_datetime_now_s()
+        for product_id in set(product_ids) - known:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(cls.__table__.insert().values(user_id=user_id, product_id=product_id,
+                                                                     order_id=order_id, purchased_at=now))
+            except IntegrityError:
+                # a concurrent checkout of the same user recorded it first
+                pass
+
+    @staticmethod
+    def review_eligibility(user_id: str, product_id: str):
+        """
+        Whether the user has bought the product and has already reviewed it, in one query
+        :return: (is_bought, is_review)
+        """
+        is_bought = exists().where(and_(PurchasedProduct.user_id == user_id,
+                                        PurchasedProduct.product_id == product_id))
+        is_review = exists().where(and_(ProductReview.user_id == user_id, ProductReview.product_id == product_id))
+        row = db.session.query(is_bought.label('is_bought'), is_review.label('is_review')).one()
+        return bool(row[0]), bool(row[1])
+
+    @classmethod
+    def rebuild(cls, connection=None):
+        """
+        Recompute the table from the orders (backfill, deleted orders)
+        :param connection: SQLAlchemy connection, default db.session which is committed
+        :return: number of rows
+        """
+        bind = connection if connection is not None else db.session
+        query = select([Order.user_id, OrderDetail.product_id, func.min(Order.id), func.min(Order.created_at)]) \
+            .select_from(Order.__table__.join(OrderDetail.__table__, OrderDetail.order_id == Order.id)) \
+            .where(OrderDetail.product_id.isnot(None)) \
+            .group_by(Order.user_id, OrderDetail.product_id)
+        bind.execute(cls.__table__.delete())
+        count = bind.execute(cls.__table__.insert().from_select(['user_id', 'product_id', 'order_id', 'purchased_at'],
+                                                                query)).rowcount
+        if connection is None:
+            db.session.commit()
+        return count
+
+
 class Address(db.Model):
     __tablename__ = 'address'
 
@@ -566,7 +941,7 @@ class Author(db.Model):
     __tablename__ = 'authors'
 
     id = db.Column(db.String(40), primary_key=True)
-    name = db.Column(db.String(80), nullable=False)
+    name = db.Column(db.String(80), nullable=False, index=True)
     picture = db.Column(db.Text, default=None)
     info = db.Column(db.Text, default=None)
     created_at = db.Column(db.Integer, nullable=False, default=get_datetime_now_s())
@@ -592,6 +967,16 @@ class Author(db.Model):
     def find_all():
         return Author.query.all()
 
+    @classmethod
+    def search(cls, name: str, page: int, limit: int):
+        """
+        Page of the authors ordered by name, name is a prefix matched on the index of the column
+        """
+        query = cls.query
+        if name:
+            query = query.filter(cls.name.startswith(name))
+        return query.order_by(cls.name).paginate(page=page, per_page=limit, error_out=False)
+
     def save_to_db(self):
         db.session.add(self)
         db.session.commit()
@@ -605,7 +990,7 @@ class Publisher(db.Model):
     __tablename__ = 'publishers'
 
     id = db.Column(db.String(40), primary_key=True)
-    name = db.Column(db.String(80), nullable=False)
+    name = db.Column(db.String(80), nullable=False, index=True)
     created_at = db.Column(db.Integer, nullable=False, default=get_datetime_now_s())
 
     def json(self):
@@ -627,6 +1012,16 @@ class Publisher(db.Model):
     def find_all():
         return Publisher.query.all()
 
+    @classmethod
+    def search(cls, name: str, page: int, limit: int):
+        """
+        Page of the publishers ordered by name, name is a prefix matched on the index of the column
+        """
+        query = cls.query
+        if name:
+            query = query.filter(cls.name.startswith(name))
+        return query.order_by(cls.name).paginate(page=page, per_page=limit, error_out=False)
+
     def save_to_db(self):
         db.session.add(self)
         db.session.commit()
@@ -718,6 +1113,8 @@ class Coupon(db.Model):
 
 class ProductReview(db.Model):
     __tablename__ = 'reviews'
+    __table_args__ = (db.Index('ix_reviews_user_product', 'user_id', 'product_id'),
+                      db.Index('ix_reviews_product_published_created', 'product_id', 'published', 'created_at'))
 
     id = db.Column(db.String(40), primary_key=True)
     created_at = db.Column(db.Integer, nullable=False, default=get_datetime_now_s())
@@ -749,6 +1146,14 @@ class ProductReview(db.Model):
     def find_all():
         return ProductReview.query.all()
 
+    @classmethod
+    def find_published(cls, product_id: str, limit: int):
+        """
+        Latest published reviews of a product, one range of ix_reviews_product_published_created
+        """
+        return cls.query.filter(cls.product_id == product_id, cls.published.is_(True)) \
+            .order_by(desc(cls.created_at)).limit(limit).all()
+
     @classmethod
     def search(cls, product_id: str, from_date: int, to_date: int, limit: int, page: int):
         query = cls.query
@@ -767,8 +1172,99 @@ class ProductReview(db.Model):
         db.session.commit()
 
 
+class ProductRating(db.Model):
+    """
+    Rating aggregates of the published reviews of a product, maintained by the review handlers
+    """
+    __tablename__ = 'product_ratings'
+
+    product_id = db.Column(db.String(40), db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    star_1 = db.Column(db.Integer, nullable=False, default=0)
+    star_2 = db.Column(db.Integer, nullable=False, default=0)
+    star_3 = db.Column(db.Integer, nullable=False, default=0)
+    star_4 = db.Column(db.Integer, nullable=False, default=0)
+    star_5 = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.Integer, default=None)
+
+    def json(self):
+        return ProductRating.summary(self)
+
+    @staticmethod
+    def summary(rating):
+        """
+        Average rating and share of each star, an empty summary if rating is None
+        """
+        count = rating.review_count if rating else 0
+        stars = {str(star): getattr(rating, 'star_{}'.format(star)) if rating else 0 for star in range(1, 6)}
+        return dict(
+            review_count=count,
+            average_rating=rating.rating_sum / count if count > 0 else 0,
+            list_rate={key: value / count if count > 0 else 0 for key, value in stars.items()},
+            stars=stars
+        )
+
+    @classmethod
+    def find_by_product_id(cls, product_id: str):
+        return cls.query.filter_by(product_id=product_id).first()
+
+    @classmethod
+    def apply(cls, product_id: str, rating: int, delta: int):
+        """
+        Add (delta=1) or remove (delta=-1) one review in the aggregates of the product.
+        Atomic increments, the caller commits.
+        """
+        table = cls.__table__
+        star = table.c['star_{}'.format(int(rating))]
+        values = {table.c.review_count: table.c.review_count + delta,
+                  table.c.rating_sum: table.c.rating_sum + int(rating) * delta,
+                  star: star + delta,
+                  table.c.updated_at: get_datetime_now_s()}
+        update = table.update().where(table.c.product_id == product_id).values(values)
+        if db.session.execute(update).rowcount > 0 or delta < 0:
+            return
+        row = dict(product_id=product_id, review_count=1, rating_sum=int(rating), star_1=0, star_2=0, star_3=0,
+                   star_4=0, star_5=0, updated_at=get_datetime_now_s())
+        row['star_{}'.format(int(rating))] = 1
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(row))
+        except IntegrityError:
+            # another request created the row first
+            db.session.execute(update)
+
+    @classmethod
+    def rebuild(cls, connection=None):
+        """
+        Recompute the aggregates of every product from the published reviews (backfill / drift repair)
+        :param connection: SQLAlchemy connection, default db.session which is committed
+        :return: number of products
+        """
+        bind = connection if connection is not None else db.session
+        columns = [ProductReview.product_id,
+                   func.count(ProductReview.id),
+                   func.sum(ProductReview.rating)]
+        columns += [func.sum(case([(ProductReview.rating == star, 1)], else_=0)) for star in range(1, 6)]
+        rows = bind.execute(select(columns).where(and_(ProductReview.published.is_(True),
+                                                       ProductReview.product_id.isnot(None)))
+                            .group_by(ProductReview.product_id)).fetchall()
+        now = get_datetime_now_s()
+        bind.execute(cls.__table__.delete())
+        if rows:
+            bind.execute(cls.__table__.insert(), [
+                dict(product_id=row[0], review_count=row[1], rating_sum=int(row[2] or 0), star_1=int(row[3] or 0),
+                     star_2=int(row[4] or 0), star_3=int(row[5] or 0), star_4=int(row[6] or 0),
+                     star_5=int(row[7] or 0), updated_at=now) for row in rows])
+        if connection is None:
+            db.session.commit()
+        return len(rows)
+
+
 class Cart(db.Model):
     __tablename__ = 'carts'
+    # idle carts are found by updated_at, see compact()
+    __table_args__ = (db.Index('ix_carts_updated_at', 'updated_at'),)
 
     id = db.Column(db.String(40), primary_key=True)
     created_at = db.Column(db.Integer, nullable=False, default=get_datetime_now_s())
@@ -787,28 +1283,51 @@ class Cart(db.Model):
     cart_items = db.relationship('CartItem', backref='Cart', lazy=True, cascade='all, delete-orphan',
                                  passive_deletes=True)
 
-    def json(self):
-        return dict(
-            id=self.id,
-            created_at=self.created_at,
-            subtotal=self.subtotal,
-            item_discount=self.item_discount,
-            tax=self.tax,
-            shipping=self.shipping,
-            total=self.total,
-            promo=self.promo,
-            discount=self.discount,
-            grand_total=self.grand_total,
-            items=list(detail.json() for detail in self.cart_items),
+    def json(self, fields: set = None):
+        """
+        :param fields: sparse fieldset, None for all fields
+        """
+        return sparse_json(
+            fields,
+            id=lambda: self.id,
+            created_at=lambda: self.created_at,
+            subtotal=lambda: self.subtotal,
+            item_discount=lambda: self.item_discount,
+            tax=lambda: self.tax,
+            shipping=lambda: self.shipping,
+            total=lambda: self.total,
+            promo=lambda: self.promo,
+            discount=lambda: self.discount,
+            grand_total=lambda: self.grand_total,
+            items=lambda: list(detail.json() for detail in self.cart_items),
         )
 
+    @staticmethod
+    def items_options(fields: set = None):
+        """
+        Load the items of a cart with what CartItem.json() reads, 3 queries instead of 1 + 2 per item
+        :param fields: sparse fieldset of json(fields), nothing is loaded when the items are not requested
+        """
+        if fields is not None and 'items' not in fields:
+            return []
+        return [selectinload(Cart.cart_items).joinedload(CartItem.product).selectinload(Product.images)]
+
+    def has_items(self):
+        """
+        Whether the cart has an item, one EXISTS query without loading the items
+        """
+        return bool(db.session.query(exists().where(CartItem.cart_id == self.id)).scalar())
+
     @classmethod
     def find_by_id(cls, _id: str):
         return cls.query.filter_by(id=_id).first()
 
     @classmethod
-    def find_by_user_id(cls, user_id: str):
-        return cls.query.filter_by(user_id=user_id).first()
+    def find_by_user_id(cls, user_id: str, options: list = ()):
+        """
+        :param options: loader options, ex: items_options()
+        """
+        return cls.query.options(*options).filter_by(user_id=user_id).first()
 
     @classmethod
     def find_all(cls):
@@ -854,6 +1373,51 @@ class Cart(db.Model):
         for key in cart_data.keys():
             self.__setattr__(key, cart_data[key])
 
+    @classmethod
+    def remove_orphan_items(cls, batch_size: int = 1000):
+        """
+        Delete the cart items of deleted products (cart_items.product_id is set to NULL) and recompute their carts,
+        one transaction per batch
+        :return: number of deleted cart items
+        """
+        deleted = 0
+        while True:
+            rows = db.session.execute(select([CartItem.id, CartItem.cart_id]).where(CartItem.product_id.is_(None))
+                                      .limit(batch_size)).fetchall()
+            if not rows:
+                return deleted
+            db.session.execute(CartItem.__table__.delete().where(CartItem.id.in_([row[0] for row in rows])))
+            for cart in cls.query.filter(cls.id.in_(set(row[1] for row in rows if row[1] is not None))):
+                cart.calculator_cart()
+            db.session.commit()
+            deleted += len(rows)
+            if len(rows) < batch_size:
+                return deleted
+
+    @classmethod
+    def delete_idle(cls, idle_seconds: int, batch_size: int = 1000):
+        """
+        Delete the carts (with their items and stock reservations) not used for idle_seconds,
+        one transaction per batch so the tables are never locked for long
+        :return: (number of deleted carts, number of deleted cart items)
+        """
+        carts, items = 0, 0
+        cutoff = get_datetime_now_s() - idle_seconds
+        # carts never touched again only have created_at
+        idle = or_(cls.updated_at < cutoff, and_(cls.updated_at.is_(None), cls.created_at < cutoff))
+        while True:
+            # locked until the commit, a request touching one of them waits and gets a new cart
+            ids = [row[0] for row in db.session.execute(select([cls.id]).where(idle).limit(batch_size)
+                                                        .with_for_update())]
+            if not ids:
+                return carts, items
+            db.session.execute(StockReservation.__table__.delete().where(StockReservation.cart_id.in_(ids)))
+            items += db.session.execute(CartItem.__table__.delete().where(CartItem.cart_id.in_(ids))).rowcount
+            carts += db.session.execute(cls.__table__.delete().where(cls.id.in_(ids))).rowcount
+            db.session.commit()
+            if len(ids) < batch_size:
+                return carts, items
+
     def save_to_db(self):
         db.session.add(self)
         db.session.commit()
@@ -916,6 +1480,24 @@ class CartItem(db.Model):
         db.session.commit()
 
 
+class StockReservation(db.Model):
+    """
+    Stock held for a cart until expires_at, see app.inventory.reserve
+    """
+    __tablename__ = 'stock_reservations'
+    __table_args__ = (db.UniqueConstraint('cart_id', 'product_id', name='uq_stock_reservations_cart_product'),
+                      db.Index('ix_stock_reservations_product_expires', 'product_id', 'expires_at'),
+                      db.Index('ix_stock_reservations_expires', 'expires_at'))
+
+    id = db.Column(db.String(40), primary_key=True)
+    created_at = db.Column(db.Integer, nullable=False, default=get_datetime_now_s())
+    expires_at = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+    cart_id = db.Column(db.String(40), db.ForeignKey('carts.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.String(40), db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+
+
 class ProductCost(db.Model):
     __tablename__ = 'product_cost'
 
@@ -959,3 +1541,33 @@ class ProductCost(db.Model):
     def delete_from_db(self):
         db.session.delete(self)
         db.session.commit()
+
+
+class StockMovement(db.Model):
+    """
+    Ledger of the stock changes, written by app.inventory with each change of products.quantity
+    """
+    __tablename__ = 'stock_movements'
+    __table_args__ = (db.Index('ix_stock_movements_product_created', 'product_id', 'created_at'),)
+
+    id = db.Column(db.String(40), primary_key=True)
+    created_at = db.Column(db.Integer, nullable=False, default=get_datetime_now_s())
+    product_id = db.Column(db.String(40), db.ForeignKey('products.id', ondelete='SET NULL'))
+    change = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)
+    ref_id = db.Column(db.String(40), default=None)
+
+    def json(self):
+        return dict(
+            id=self.id,
+            created_at=self.created_at,
+            product_id=self.product_id,
+            change=self.change,
+            reason=self.reason,
+            ref_id=self.ref_id
+        )
+
+    @classmethod
+    def find_by_product_id(cls, product_id: str, page: int, limit: int):
+        return cls.query.filter_by(product_id=product_id).order_by(desc(cls.created_at)) \
+            .paginate(page=page, per_page=limit, error_out=False)
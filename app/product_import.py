@@ -0,0 +1,218 @@
+# coding: utf-8
+"""
+Bulk import of products from a CSV, XLSX or JSONL file (POST /api/v1/products/import)
+
+Every row is a product: title, price, quantity, buy_price, author, publisher, category and optionally
+publish_year, page_number, quotes_about, discount, start_at, end_at. Author, publisher and category are
+names, the missing ones are created. Rows are read one by one and written by chunks, one transaction per
+chunk, a bad row is reported and skipped without failing the others.
+"""
+import codecs
+import csv
+import json
+from datetime import datetime
+
+from jsonschema import Draft7Validator
+
+from app import inventory
+from app.extensions import db, logger
+from app.ids import new_id
+from app.models import Product, ProductCost, Author, Publisher, Category
+from app.schema.schema_validator import product_import_validator
+from app.utils import get_datetime_now_s
+
+INTEGER_FIELDS = ('quantity', 'publish_year', 'page_number', 'start_at', 'end_at')
+NUMBER_FIELDS = ('price', 'buy_price', 'discount')
+# keep the response small when a whole file is wrong
+MAX_REPORTED_ERRORS = 1000
+
+
+def iter_rows(stream, extension):
+    """
+    Read an uploaded file row by row
+    :param stream: binary file object, ex: request.files['file'].stream
+    :param extension: .csv, .xlsx or .jsonl
+    :return: generator of (row number, dict), the number is the line of the file
+    """
+    if extension == '.csv':
+        reader = csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
+        for row in reader:
+            yield reader.line_num, row
+    elif extension == '.jsonl':
+        for number, line in enumerate(codecs.iterdecode(stream, 'utf-8-sig'), 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as ex:
+                    row = ex
+                yield number, row
+    elif extension == '.xlsx':
+        from openpyxl import load_workbook
+
+        sheet = load_workbook(stream, read_only=True, data_only=True).active
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, [])]
+        for number, values in enumerate(rows, 2):
+            if any(value is not None for value in values):
+                yield number, dict(zip(header, values))
+    else:
+        raise ValueError('Unsupported file type {}'.format(extension))
+
+
+def clean_row(row):
+    """
+    Strip the values, drop the empty ones and convert the numeric columns (CSV gives strings only)
+    :raise ValueError: a numeric column is not a number
+    """
+    if not isinstance(row, dict):
+        raise ValueError('Row must be an object')
+    data = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == '':
+            continue
+        key = key.strip()
+        try:
+            if key in INTEGER_FIELDS:
+                value = int(float(value))
+            elif key in NUMBER_FIELDS:
+                value = float(value)
+            elif not isinstance(value, str):
+                # spreadsheet cells may hold numbers, ex: a title like 1984
+                value = str(value)
+        except (TypeError, ValueError):
+            raise ValueError('{} is not a number: {}'.format(key, value))
+        data[key] = value
+    return data
+
+
+class NameMap(object):
+    """
+    name -> id of the authors, publishers or categories, loaded once, missing names are created
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.ids = {self.key(name): _id for _id, name in db.session.query(model.id, model.name)}
+        self.pending = []
+
+    @staticmethod
+    def key(name):
+        return ' '.join(name.split()).lower()
+
+    def resolve(self, name: str):
+        key = self.key(name)
+        _id = self.ids.get(key)
+        if _id is None:
+            _id = self.ids[key] = new_id()
+            self.pending.append(dict(id=_id, name=' '.join(name.split()), created_at=get_datetime_now_s()))
+        return _id
+
+    def flush(self):
+        """
+        Insert the names created since the last commit, the caller commits then calls clear()
+        """
+        if self.pending:
+            db.session.execute(self.model.__table__.insert().values(self.pending))
+
+    def clear(self):
+        self.pending = []
+
+    def rollback(self):
+        """
+        Forget the names of a rolled back chunk
+        """
+        for row in self.pending:
+            self.ids.pop(self.key(row['name']), None)
+        self.pending = []
+
+
+class ProductImporter(object):
+    """
+    Usage:
+        result = ProductImporter(chunk_size=500).run(iter_rows(file.stream, '.csv'))
+    """
+
+    def __init__(self, chunk_size=500):
+        self.chunk_size = max(1, chunk_size)
+        self.validator = Draft7Validator(product_import_validator)
+        self.authors = NameMap(Author)
+        self.publishers = NameMap(Publisher)
+        self.categories = NameMap(Category)
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(dict(row=number, message=message))
+
+    def run(self, rows):
+        """
+        :param rows: iterable of (row number, dict), see iter_rows
+        :return: dict(created, failed, errors=[{row, message}])
+        """
+        chunk = []
+        for number, row in rows:
+            if isinstance(row, Exception):
+                self.error(number, 'Invalid JSON: {}'.format(row))
+                continue
+            try:
+                data = clean_row(row)
+            except ValueError as ex:
+                self.error(number, str(ex))
+                continue
+            chunk.append((number, data))
+            if len(chunk) >= self.chunk_size:
+                self.write(chunk)
+                chunk = []
+        self.write(chunk)
+        return dict(created=self.created, failed=self.failed, errors=self.errors)
+
+    def write(self, chunk):
+        """
+        Validate a chunk and insert its valid rows in one transaction
+        """
+        now = get_datetime_now_s()
+        products, costs, movements, numbers = [], [], [], []
+        for number, data in chunk:
+            errors = sorted(self.validator.iter_errors(data), key=lambda error: list(error.path))
+            if errors:
+                self.error(number, '; '.join(error.message for error in errors))
+                continue
+            _id = new_id()
+            products.append(dict(id=_id, created_at=now, updated_at=now, title=data['title'], price=data['price'],
+                                 publish_year=data.get('publish_year'), page_number=data.get('page_number', 0),
+                                 quantity=data['quantity'], quotes_about=data.get('quotes_about'),
+                                 discount=data.get('discount', 0), start_at=data.get('start_at'),
+                                 end_at=data.get('end_at'), author_id=self.authors.resolve(data['author']),
+                                 publisher_id=self.publishers.resolve(data['publisher']),
+                                 category_id=self.categories.resolve(data['category'])))
+            costs.append(dict(id=new_id(), created_at=now, cost=data['buy_price'],
+                              quantity=data['quantity'], total=float(data['buy_price'] * data['quantity']),
+                              content='Nhap hang luc: {}'.format(now), product_id=_id))
+            movements.append(inventory.movement(_id, data['quantity'], inventory.REASON_IMPORT, costs[-1]['id'], now))
+            numbers.append(number)
+        if not products:
+            return
+        try:
+            for names in (self.authors, self.publishers, self.categories):
+                names.flush()
+            db.session.execute(Product.__table__.insert().values(products))
+            db.session.execute(ProductCost.__table__.insert().values(costs))
+            inventory.record(movements)
+            db.session.commit()
+            for names in (self.authors, self.publishers, self.categories):
+                names.clear()
+            self.created += len(products)
+        except Exception as ex:
+            db.session.rollback()
+            for names in (self.authors, self.publishers, self.categories):
+                names.rollback()
+            logger.error('{} Database error: '.format(datetime.now().strftime('%Y-%b-%d %H:%M:%S')) + str(ex))
+            for number in numbers:
+                self.error(number, 'An error occurred while create product')
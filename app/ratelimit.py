@@ -0,0 +1,206 @@
+# coding: utf-8
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask import request
+
+# period of a limit string -> seconds
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+
+def parse_limit(limit: str):
+    """
+    :param limit: ex: 10/minute, 100/hour
+    :return: (capacity, refill rate per second)
+    """
+    count, period = limit.split('/', 1)
+    count = int(count)
+    return count, count / float(PERIODS[period.strip().rstrip('s')])
+
+
+def refill(tokens, updated_at, capacity, rate, now):
+    """
+    Token bucket: refill since updated_at then take one token
+    :return: (allowed, tokens left, seconds until the next token)
+    """
+    tokens = min(capacity, tokens + (now - updated_at) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0
+    return False, tokens, (1 - tokens) / rate
+
+
+class MemoryStorage(object):
+    """
+    Buckets of the current process only, for a single worker or the tests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            allowed, tokens, retry_after = refill(tokens, updated_at, capacity, rate, now)
+            self._buckets[key] = (tokens, now)
+            return allowed, retry_after
+
+    def prune(self, before):
+        with self._lock:
+            for key in [key for key, value in self._buckets.items() if value[1] < before]:
+                del self._buckets[key]
+
+
+class SQLiteStorage(object):
+    """
+    Buckets in a local SQLite file shared by the uwsgi workers of the host, a take() is one short
+    write transaction on a file of the page cache, no network round trip and no access to the main database.
+    """
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        # one connection per thread, opened after uwsgi forked the workers
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                               'updated_at REAL NOT NULL)')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def take(self, key, capacity, rate, now):
+        connection = self._connection()
+        # BEGIN IMMEDIATE takes the write lock first, concurrent workers cannot read the same tokens
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated_at = row if row is not None else (capacity, now)
+            allowed, tokens, retry_after = refill(tokens, updated_at, capacity, rate, now)
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+    def prune(self, before):
+        self._connection().execute('DELETE FROM buckets WHERE updated_at < ?', (before,))
+
+
+class RateLimiter(object):
+    """
+    Flask extension limiting the requests per client IP and per username with token buckets.
+
+    Rules are looked up by endpoint (ex: auth.login) and by blueprint (ex: auth), both apply. A rule is
+    (scope, limit): scope `ip` or `username` (the username / user_name of the JSON body), limit like 10/minute.
+    Rejected requests get a 429 from before_request, before the view and any database access.
+
+    Buckets are kept in a SQLite file of RATELIMIT_DIR shared by the workers of the host. A storage error
+    lets the request through, the limiter never takes the API down.
+
+    Config:
+        RATELIMIT_ENABLED: default True
+        RATELIMIT_DIR: directory shared by the workers, default <tmp>/vlhb_ratelimit, '' keeps the buckets
+            in the memory of each worker
+        RATELIMIT_RULES: dict endpoint or blueprint -> list of (scope, limit)
+    """
+
+    def __init__(self, app=None):
+        self.storage = None
+        self.rules = {}
+        self.max_period = 0
+        self._last_prune = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('RATELIMIT_ENABLED', True):
+            return
+        self.rules = {}
+        for name, rules in (app.config.get('RATELIMIT_RULES') or {}).items():
+            self.rules[name] = [(name, scope, limit) + parse_limit(limit) for scope, limit in rules]
+            self.max_period = max([self.max_period] + [capacity / rate for *_, capacity, rate in self.rules[name]])
+        if not self.rules:
+            return
+
+        directory = app.config.get('RATELIMIT_DIR')
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), 'vlhb_ratelimit')
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.storage = SQLiteStorage(os.path.join(directory, 'ratelimit.db'))
+        else:
+            self.storage = MemoryStorage()
+
+        @app.before_request
+        def check_rate_limit():
+            retry_after = self.check()
+            if retry_after:
+                # app.utils imports the extensions
+                from app.utils import send_error
+
+                response, code = send_error(message='Too many requests, try again in {} seconds'.format(retry_after),
+                                            code=429)
+                response.headers['Retry-After'] = str(retry_after)
+                return response, code
+
+    @staticmethod
+    def client_key(scope):
+        """
+        Value the requests are counted by, None if the request has none (ex: no username in the body)
+        """
+        if scope == 'ip':
+            return request.remote_addr
+        if scope == 'username':
+            body = request.get_json(silent=True)
+            if isinstance(body, dict):
+                username = body.get('username') or body.get('user_name')
+                if isinstance(username, str) and username.strip():
+                    return username.strip().lower()
+        return None
+
+    def check(self):
+        """
+        Take a token of every rule of the request
+        :return: seconds to wait before retrying, 0 if allowed
+        """
+        endpoint = request.endpoint
+        if not endpoint or request.method == 'OPTIONS':
+            return 0
+        rules = self.rules.get(endpoint, []) + (self.rules.get(request.blueprint, []) if request.blueprint else [])
+        if not rules:
+            return 0
+        now = time.time()
+        retry_after = 0
+        try:
+            for name, scope, limit, capacity, rate in rules:
+                value = self.client_key(scope)
+                if value is None:
+                    continue
+                # a blueprint rule counts the requests of all its endpoints together
+                allowed, wait = self.storage.take('{}|{}|{}|{}'.format(name, scope, limit, value), capacity, rate,
+                                                  now)
+                if not allowed:
+                    retry_after = max(retry_after, int(wait) + 1)
+            if now - self._last_prune > self.max_period:
+                # a bucket untouched for a whole period is full again, same as a missing one
+                self._last_prune = now
+                self.storage.prune(now - self.max_period)
+        except Exception:
+            return 0
+        return retry_after
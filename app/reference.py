@@ -0,0 +1,65 @@
+# coding: utf-8
+import threading
+import time
+
+from app.database import primary
+
+
+class ReferenceCache(object):
+    """
+    Flask extension keeping small reference tables (categories, authors, publishers) serialized in the memory
+    of the worker, for the unpaginated GET of their endpoints.
+
+    The CRUD handlers of a table call invalidate(name) after their commit, the next read of this worker loads
+    the table again, from the primary: a replica may not have the write yet. Other workers do not see that
+    call: they reload once their copy is older than REFERENCE_CACHE_MAX_AGE.
+
+    Config:
+        REFERENCE_CACHE_MAX_AGE: seconds, default 300
+    """
+
+    def __init__(self, app=None):
+        self.max_age = 300
+        # name -> (loaded_at, data)
+        self._entries = {}
+        # name -> number of invalidate() calls, a load started before the last one is not kept
+        self._versions = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_age = app.config.get('REFERENCE_CACHE_MAX_AGE', 300)
+
+    def invalidate(self, name: str):
+        """
+        The table changed, load it again on the next read
+        """
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._entries.pop(name, None)
+
+    def _fresh(self, name):
+        entry = self._entries.get(name)
+        if entry is not None and time.time() - entry[0] < self.max_age:
+            return entry
+        return None
+
+    def get(self, name: str, load):
+        """
+        Cached data of a table. Needs an app context.
+        :param name: ex: categories
+        :param load: function returning the data, called when the copy is missing or too old
+        """
+        entry = self._fresh(name)
+        if entry is not None:
+            return entry[1]
+        with self._lock:
+            version = self._versions.get(name, 0)
+        loaded_at = time.time()
+        with primary():
+            data = load()
+        with self._lock:
+            if self._versions.get(name, 0) == version:
+                self._entries[name] = (loaded_at, data)
+        return data
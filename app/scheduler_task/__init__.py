@@ -1,2 +1,6 @@
 from .revoke_token import remove_token_expiry
-from .update_coupon import update_coupon_status
\ No newline at end of file
+from .update_coupon import update_coupon_status
+from .rebuild_rating import rebuild_product_ratings
+from .rebuild_purchase import rebuild_purchased_products
+from .expire_reservation import expire_stock_reservations
+from .compact_cart import compact_carts
@@ -0,0 +1,19 @@
+from datetime import datetime
+
+from flask import current_app
+
+from app.models import Cart
+from app.database import job_session
+from app.extensions import db, logger
+
+
+def compact_carts():
+    """
+    Delete the carts idle for CART_IDLE_DAYS and the cart items of deleted products, logs the reclaimed rows
+    """
+    with db.app.app_context(), job_session(db.app):
+        batch_size = current_app.config.get('CART_COMPACT_BATCH_SIZE', 1000)
+        orphans = Cart.remove_orphan_items(batch_size)
+        carts, items = Cart.delete_idle(current_app.config.get('CART_IDLE_DAYS', 30) * 24 * 3600, batch_size)
+        logger.info('{} Cart compaction: {} idle carts, {} of their items, {} items of deleted products'.format(
+            datetime.now().strftime('%Y-%b-%d %H:%M:%S'), carts, items, orphans))
@@ -0,0 +1,11 @@
+from app import inventory
+from app.database import job_session
+from app.extensions import db
+
+
+def expire_stock_reservations():
+    """
+    Give the stock of idle carts back to the others, one DELETE on stock_reservations.expires_at
+    """
+    with db.app.app_context(), job_session(db.app):
+        inventory.expire_reservations()
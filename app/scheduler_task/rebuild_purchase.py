@@ -0,0 +1,11 @@
+from app.models import PurchasedProduct
+from app.database import job_session
+from app.extensions import db
+
+
+def rebuild_purchased_products():
+    """
+    Recompute purchased_products from the orders, backfills the table and drops the products of deleted orders
+    """
+    with db.app.app_context(), job_session(db.app):
+        PurchasedProduct.rebuild()
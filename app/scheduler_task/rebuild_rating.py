@@ -0,0 +1,11 @@
+from app.models import ProductRating
+from app.database import job_session
+from app.extensions import db
+
+
+def rebuild_product_ratings():
+    """
+    Recompute product_ratings from the published reviews, backfills the table and repairs any drift
+    """
+    with db.app.app_context(), job_session(db.app):
+        ProductRating.rebuild()
@@ -1,4 +1,5 @@
-from app.models import TokenBlacklist
+from app.models import TokenBlacklist, RevokedToken
+from app.database import job_session
 from app.extensions import db
 
 
@@ -6,6 +7,7 @@ def remove_token_expiry():
     """
     Remove all token has expired
     """
-    with db.app.app_context():
+    with db.app.app_context(), job_session(db.app):
         # logger.debug('{} start check token expired'.format(get_datetime_now().strftime('%Y-%b-%d %H:%M:%S')))
         TokenBlacklist.prune_database()
+        RevokedToken.prune_database()
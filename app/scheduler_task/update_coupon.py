@@ -1,4 +1,5 @@
 from app.models import Coupon
+from app.database import job_session
 from app.extensions import db
 
 
@@ -6,6 +7,6 @@ def update_coupon_status():
     """
     Update status is_enable all coupon has expired and activate
     """
-    with db.app.app_context():
+    with db.app.app_context(), job_session(db.app):
         # logger.debug('{} start check token expired'.format(get_datetime_now().strftime('%Y-%b-%d %H:%M:%S')))
         Coupon.prune_database()
@@ -352,7 +352,7 @@ review_validator = {
             "maxLength": 80
         },
         "rating": {
-            "type": "number",
+            "type": "integer",
             "minimum": 1,
             "maximum": 5
         },
@@ -372,3 +372,100 @@ review_validator = {
     },
     "required": ["title", "rating", "content", "product_id"]
 }
+
+product_import_validator = {
+    "type": "object",
+    "properties": {
+        "title": {
+            "type": "string",
+            "minLength": 3,
+            "maxLength": 80
+        },
+        "price": {
+            "type": "number",
+            "minimum": 0
+        },
+        "quantity": {
+            "type": "integer",
+            "minimum": 0,
+            "maximum": 32767
+        },
+        "buy_price": {
+            "type": "number",
+            "minimum": 0
+        },
+        "publish_year": {
+            "type": "integer"
+        },
+        "page_number": {
+            "type": "integer",
+            "minimum": 0
+        },
+        "quotes_about": {
+            "type": "string",
+            "maxLength": 1024
+        },
+        "discount": {
+            "type": "number",
+            "minimum": 0
+        },
+        "start_at": {
+            "type": "integer"
+        },
+        "end_at": {
+            "type": "integer"
+        },
+        "author": {
+            "type": "string",
+            "minLength": 1,
+            "maxLength": 80
+        },
+        "publisher": {
+            "type": "string",
+            "minLength": 1,
+            "maxLength": 80
+        },
+        "category": {
+            "type": "string",
+            "minLength": 1,
+            "maxLength": 80
+        }
+    },
+    "required": ["title", "price", "quantity", "buy_price", "author", "publisher", "category"]
+}
+
+restock_validator = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": 10000,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "product_id": {
+                        "type": "string",
+                        "minLength": 1,
+                        "maxLength": 40
+                    },
+                    "quantity": {
+                        "type": "integer",
+                        "minimum": 1,
+                        "maximum": 32767
+                    },
+                    "buy_price": {
+                        "type": "number",
+                        "minimum": 0
+                    }
+                },
+                "required": ["product_id", "quantity", "buy_price"]
+            }
+        },
+        "content": {
+            "type": "string",
+            "maxLength": 1024
+        }
+    },
+    "required": ["items"]
+}
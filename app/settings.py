@@ -22,9 +22,65 @@ class ProdConfig(Config):
     JWT_SECRET_KEY = '1234567a@'
     JWT_BLACKLIST_ENABLED = True
     JWT_BLACKLIST_TOKEN_CHECKS = ['access', 'refresh']
+    # refresh tokens carry the token epoch too, see app.models.RevokedToken
+    JWT_CLAIMS_IN_REFRESH_TOKEN = True
     # SQL Alchemy config
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Read replicas (comma separated uris), used by the handlers decorated with @read_replica
+    SQLALCHEMY_BINDS = {'replica_{}'.format(i): uri for i, uri in
+                        enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')))} or None
+    # Pool of one uwsgi worker, keep workers * (pool_size + max_overflow) under MySQL max_connections.
+    # Hosted MySQL closes idle connections after a few minutes: recycle before that and ping on checkout.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': 10,
+        'pool_recycle': 280,
+        'pool_pre_ping': True,
+    }
+    # Background jobs (token pruning, coupon status) use their own small pool
+    SCHEDULER_ENGINE_OPTIONS = {
+        'pool_size': 1,
+        'max_overflow': 1,
+        'pool_timeout': 30,
+        'pool_recycle': 280,
+        'pool_pre_ping': True,
+    }
+    # Request metrics, shared by uwsgi workers through METRICS_DIR
+    METRICS_ENABLED = True
+    METRICS_ENDPOINT = '/metrics'
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5
+    # In-memory product search (app.catalog), each worker reloads its copy after at most MAX_AGE seconds
+    CATALOG_SNAPSHOT_ENABLED = os.environ.get('CATALOG_SNAPSHOT_ENABLED') == '1'
+    CATALOG_SNAPSHOT_MAX_AGE = 60
+    # gzip / brotli of the JSON responses (app.compression), levels from benchmarks/compression.py
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BR_LEVEL = 4
+    # Storefront home bundle (app.home), rebuilt in the background once older than MAX_AGE seconds
+    HOME_CACHE_MAX_AGE = 60
+    HOME_NEWEST_LIMIT = 20
+    HOME_BEST_SELLER_LIMIT = 10
+    # Unpaginated GET of categories / authors / publishers (app.reference), reloaded after MAX_AGE seconds
+    REFERENCE_CACHE_MAX_AGE = 300
+    # Cache-Control max-age of GET /products/<id>/detail
+    PRODUCT_DETAIL_MAX_AGE = 60
+    # Token buckets per client IP / username (app.ratelimit), keyed by endpoint or blueprint
+    RATELIMIT_ENABLED = True
+    RATELIMIT_DIR = os.environ.get('RATELIMIT_DIR')
+    RATELIMIT_RULES = {
+        'auth.login': [('ip', '20/minute'), ('username', '5/minute')],
+        'auth.refresh': [('ip', '60/minute')],
+        'user.post': [('ip', '5/minute')],
+    }
+    # Seconds the products of a cart stay reserved (app.inventory.reserve) after its last change
+    CART_RESERVATION_TTL = 15 * 60
+    # Carts not used for CART_IDLE_DAYS are deleted by the nightly compact_carts job, by batches
+    CART_IDLE_DAYS = 30
+    CART_COMPACT_BATCH_SIZE = 1000
     # Cloudinary
     cloudinary.config(
         cloud_name=os.environ.get('cloud_name'),
@@ -46,10 +102,61 @@ class DevConfig(Config):
     JWT_SECRET_KEY = '1234567a@@'
     JWT_BLACKLIST_ENABLED = True
     JWT_BLACKLIST_TOKEN_CHECKS = ['access', 'refresh']
+    # refresh tokens carry the token epoch too, see app.models.RevokedToken
+    JWT_CLAIMS_IN_REFRESH_TOKEN = True
     # SQL Alchemy config
     SQLALCHEMY_DATABASE_URI = 'mysql://{}:{}@{}:{}/{}?charset=utf8mb4'.format('root', 'admin1234?', 'localhost', '3306',
                                                                               'onlinebookstore')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_BINDS = {'replica_{}'.format(i): uri for i, uri in
+                        enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')))} or None
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': 3600,
+        'pool_pre_ping': True,
+    }
+    SCHEDULER_ENGINE_OPTIONS = {
+        'pool_size': 1,
+        'max_overflow': 1,
+        'pool_recycle': 3600,
+        'pool_pre_ping': True,
+    }
+    # Request metrics, shared by uwsgi workers through METRICS_DIR
+    METRICS_ENABLED = True
+    METRICS_ENDPOINT = '/metrics'
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5
+    # In-memory product search (app.catalog), each worker reloads its copy after at most MAX_AGE seconds
+    CATALOG_SNAPSHOT_ENABLED = os.environ.get('CATALOG_SNAPSHOT_ENABLED') == '1'
+    CATALOG_SNAPSHOT_MAX_AGE = 60
+    # gzip / brotli of the JSON responses (app.compression), levels from benchmarks/compression.py
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BR_LEVEL = 4
+    # Storefront home bundle (app.home), rebuilt in the background once older than MAX_AGE seconds
+    HOME_CACHE_MAX_AGE = 60
+    HOME_NEWEST_LIMIT = 20
+    HOME_BEST_SELLER_LIMIT = 10
+    # Unpaginated GET of categories / authors / publishers (app.reference), reloaded after MAX_AGE seconds
+    REFERENCE_CACHE_MAX_AGE = 300
+    # Cache-Control max-age of GET /products/<id>/detail
+    PRODUCT_DETAIL_MAX_AGE = 60
+    # Token buckets per client IP / username (app.ratelimit), keyed by endpoint or blueprint
+    RATELIMIT_ENABLED = True
+    RATELIMIT_DIR = os.environ.get('RATELIMIT_DIR')
+    RATELIMIT_RULES = {
+        'auth.login': [('ip', '20/minute'), ('username', '5/minute')],
+        'auth.refresh': [('ip', '60/minute')],
+        'user.post': [('ip', '5/minute')],
+    }
+    # Seconds the products of a cart stay reserved (app.inventory.reserve) after its last change
+    CART_RESERVATION_TTL = 15 * 60
+    # Carts not used for CART_IDLE_DAYS are deleted by the nightly compact_carts job, by batches
+    CART_IDLE_DAYS = 30
+    CART_COMPACT_BATCH_SIZE = 1000
     # Cloudinary
     cloudinary.config(
         cloud_name=os.environ.get('cloud_name'),
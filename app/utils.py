@@ -167,6 +167,25 @@ def get_datetime_today_s():
     return datetime.datetime.today().timestamp()
 
 
+def parse_fields(value):
+    """
+    Sparse fieldset of a request, ex: ?fields=id,title,price
+    :param value: comma separated field names
+    :return: set of names, None for all fields
+    """
+    if not value:
+        return None
+    return set(field.strip() for field in value.split(',') if field.strip()) or None
+
+
+def sparse_json(fields, **getters):
+    """
+    Response dict of the getters named in fields, the others are not called so what they read is not loaded
+    :param fields: set of names, None for all
+    """
+    return {name: getter() for name, getter in getters.items() if fields is None or name in fields}
+
+
 @jwt.expired_token_loader
 def expired_token_callback():
     """
@@ -0,0 +1,101 @@
+"""
+Benchmark of the product search (GET /api/v1/products): SQL Product.filter against the in-memory
+columnar snapshot of app.catalog (CATALOG_SNAPSHOT_ENABLED).
+
+Both paths return the same Pagination of Product, the snapshot only replaces the filter / sort / count
+queries by NumPy masks and argsorts, the products of the page are still loaded by id.
+
+Usage (from the project root):
+    python -m benchmarks.catalog_filter --products 50000 --searches 500
+    python -m benchmarks.catalog_filter --no-seed   # reuse benchmarks/bench.db or BENCH_DATABASE_URL
+
+Seeding drops every table first, never point BENCH_DATABASE_URL to a real database.
+"""
+import argparse
+import random
+import sys
+import time
+
+from app.app import create_app
+from app.extensions import db, catalog
+from app.models import Product
+from benchmarks.config import BenchConfig
+from benchmarks.load_test import percentile
+from benchmarks.seed import seed, WORDS
+
+SORTS = [None, 'price,desc', 'price,asc', 'newest', 'oldest']
+
+
+def random_search(rng, category_ids):
+    """
+    Arguments of Product.filter, mixing the filters like the storefront does
+    """
+    min_price = rng.choice([0, 0, 50000, 100000])
+    return dict(name=rng.choice(['', '', rng.choice(WORDS)]),
+                category_id=rng.choice([None, rng.choice(category_ids)]),
+                sort=rng.choice(SORTS),
+                min_price=min_price,
+                max_price=min_price + rng.choice([50000, 200000, 9999999999]),
+                limit=20,
+                page=rng.choice([1, 1, 1, 2, 5]),
+                from_date=0,
+                to_date=9999999999)
+
+
+def timed(searches):
+    durations, pages = [], []
+    for search in searches:
+        start = time.perf_counter()
+        result = Product.filter(**search)
+        durations.append(time.perf_counter() - start)
+        pages.append((result.total, [product.id for product in result.items]))
+        db.session.remove()
+    return sorted(durations), pages
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--products', type=int, default=20000, help='seeded products')
+    arg_parser.add_argument('--searches', type=int, default=500, help='random searches per path')
+    arg_parser.add_argument('--seed', type=int, default=42, help='random seed of data and searches')
+    arg_parser.add_argument('--no-seed', action='store_true', help='reuse the data already in the database')
+    args = arg_parser.parse_args(argv)
+
+    app = create_app(config_object=BenchConfig)
+    with app.app_context():
+        if not args.no_seed:
+            print('Seeding {} ...'.format(BenchConfig.SQLALCHEMY_DATABASE_URI))
+            seed(products=args.products, users=10, orders=100, seed_value=args.seed)
+        category_ids = [row[0] for row in db.session.execute('SELECT id FROM categories')]
+        if not category_ids:
+            print('Database has no products, run without --no-seed')
+            return 1
+        rng = random.Random(args.seed)
+        searches = [random_search(rng, category_ids) for _ in range(args.searches)]
+
+        catalog.enabled = False
+        sql = timed(searches)
+
+        catalog.enabled = True
+        catalog.invalidate()
+        start = time.perf_counter()
+        size = len(catalog.get())
+        load = time.perf_counter() - start
+        snapshot = timed(searches)
+
+    print('Snapshot of {} products loaded in {:.1f} ms'.format(size, load * 1000))
+    # SQL without ORDER BY (sort=None) and ties of the sort key may page in another order
+    same = sum(1 for a, b in zip(sql[1], snapshot[1]) if a[0] == b[0] and sorted(a[1]) == sorted(b[1]))
+    print('Same total and page for {}/{} searches'.format(same, len(searches)))
+    header = '{:<10} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('path', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms')
+    print(header)
+    print('-' * len(header))
+    for name, (durations, _) in (('sql', sql), ('snapshot', snapshot)):
+        print('{:<10} {:>7} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+            name, len(durations), sum(durations) / len(durations) * 1000, percentile(durations, 50) * 1000,
+            percentile(durations, 95) * 1000, percentile(durations, 99) * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Benchmark of the response compression (app.compression) on real payloads of the API.
+
+The endpoints are called once through the flask test client without compression, then every body is
+compressed with each codec and level: the report gives the bytes saved and the CPU time per response, so
+COMPRESS_GZIP_LEVEL / COMPRESS_BR_LEVEL can be chosen for the trade-off of the servers.
+
+Usage (from the project root):
+    python -m benchmarks.compression --products 2000 --repeat 20
+    python -m benchmarks.compression --no-seed   # reuse benchmarks/bench.db or BENCH_DATABASE_URL
+
+Brotli levels are skipped when the `brotli` package is not installed.
+Seeding drops every table first, never point BENCH_DATABASE_URL to a real database.
+"""
+import argparse
+import sys
+import time
+
+from app.app import create_app
+from app.compression import CODECS
+from app.extensions import db
+from benchmarks.config import BenchConfig
+from benchmarks.seed import seed, BENCH_PASSWORD, ADMIN_USER_NAME
+
+# (name, path, needs the admin token)
+PAYLOADS = [
+    ('GET /products/all limit=100', '/api/v1/products/all?page=1&limit=100', False),
+    ('GET /products limit=20', '/api/v1/products?page=1&limit=20', False),
+    ('GET /products/<id>', None, False),
+    ('GET /category', '/api/v1/category', False),
+    ('GET /orders limit=50', '/api/v1/orders?page=1&limit=50', True),
+    ('GET /dashboard/best-seller', '/api/v1/dashboard/best-seller', True),
+]
+LEVELS = {
+    'gzip': (1, 6, 9),
+    'br': (1, 4, 6, 11),
+}
+
+
+class BenchCompressionConfig(BenchConfig):
+    # the raw bodies are compressed by the benchmark itself
+    COMPRESS_ENABLED = False
+
+
+def fetch_payloads(app):
+    client = app.test_client()
+    response = client.post('/api/v1/auth/login', json=dict(username=ADMIN_USER_NAME, password=BENCH_PASSWORD))
+    token = (response.get_json(silent=True) or {}).get('data', {}).get('access_token')
+    with app.app_context():
+        product_id = db.session.execute('SELECT id FROM products LIMIT 1').scalar()
+        db.session.remove()
+    payloads = []
+    for name, path, admin in PAYLOADS:
+        if path is None:
+            if product_id is None:
+                continue
+            path = '/api/v1/products/' + product_id
+        headers = {'Authorization': 'Bearer ' + token} if admin and token else {}
+        response = client.get(path, headers=headers)
+        if response.status_code == 200:
+            payloads.append((name, response.get_data()))
+    return payloads
+
+
+def measure(data, codec, level, repeat):
+    """
+    :return: (compressed size, best time of repeat runs in seconds)
+    """
+    best, size = None, 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(CODECS[codec](data, level))
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return size, best
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--products', type=int, default=2000, help='seeded products')
+    arg_parser.add_argument('--orders', type=int, default=500, help='seeded orders')
+    arg_parser.add_argument('--repeat', type=int, default=20, help='compressions per payload and level')
+    arg_parser.add_argument('--seed', type=int, default=42, help='random seed')
+    arg_parser.add_argument('--no-seed', action='store_true', help='reuse the data already in the database')
+    args = arg_parser.parse_args(argv)
+
+    app = create_app(config_object=BenchCompressionConfig)
+    if not args.no_seed:
+        with app.app_context():
+            print('Seeding {} ...'.format(BenchConfig.SQLALCHEMY_DATABASE_URI))
+            seed(products=args.products, users=5, orders=args.orders, seed_value=args.seed)
+            db.session.remove()
+    payloads = fetch_payloads(app)
+    if not payloads:
+        print('No payload, run without --no-seed')
+        return 1
+
+    header = '{:<30} {:>9} {:<7} {:>10} {:>7} {:>9} {:>9}'.format('payload', 'bytes', 'codec', 'compressed', 'saved',
+                                                                   'cpu ms', 'MB/s')
+    print(header)
+    print('-' * len(header))
+    totals = {}
+    for name, data in payloads:
+        for codec in [codec for codec in LEVELS if codec in CODECS]:
+            for level in LEVELS[codec]:
+                size, duration = measure(data, codec, level, args.repeat)
+                total = totals.setdefault((codec, level), [0, 0, 0.0])
+                total[0] += len(data)
+                total[1] += size
+                total[2] += duration
+                print('{:<30} {:>9} {:<7} {:>10} {:>6.1f}% {:>9.3f} {:>9.1f}'.format(
+                    name[:30], len(data), '{}-{}'.format(codec, level), size, (1 - size / len(data)) * 100,
+                    duration * 1000, len(data) / duration / 1e6 if duration else 0))
+    print('-' * len(header))
+    for (codec, level), (raw, size, duration) in sorted(totals.items()):
+        print('{:<30} {:>9} {:<7} {:>10} {:>6.1f}% {:>9.3f}'.format(
+            'all payloads', raw, '{}-{}'.format(codec, level), size, (1 - size / raw) * 100, duration * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import os
+import random
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.settings import Config
+
+BENCH_DIR = os.path.abspath(os.path.dirname(__file__))
+
+
+class BenchConfig(Config):
+    """Benchmark configuration, local SQLite database unless BENCH_DATABASE_URL is set."""
+    # app config
+    ENV = 'bench'
+    DEBUG = False
+    TESTING = False
+    # JWT Config
+    JWT_SECRET_KEY = 'benchmark-secret'
+    JWT_BLACKLIST_ENABLED = True
+    JWT_BLACKLIST_TOKEN_CHECKS = ['access', 'refresh']
+    # SQL Alchemy config
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCH_DATABASE_URL',
+                                             'sqlite:///' + os.path.join(BENCH_DIR, 'bench.db'))
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}} \
+        if SQLALCHEMY_DATABASE_URI.startswith('sqlite') else {}
+    # Metrics
+    METRICS_ENABLED = False
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_compat(dbapi_connection, connection_record):
+    """
+    SQLite has no RAND() (used by Product.find_random) and locks the whole file on write,
+    register the function and switch to WAL so concurrent readers are not blocked
+    """
+    if type(dbapi_connection).__module__ != 'sqlite3':
+        return
+    dbapi_connection.create_function('rand', 0, random.random)
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
@@ -0,0 +1,134 @@
+"""
+Concurrency check of app.inventory: threads restock and sell the same products at the same time, then the
+final stock is compared with the changes that were committed.
+
+With the atomic statements of app.inventory no update is lost, the stock never goes negative and the
+stock_movements ledger adds up to the change of products.quantity. --naive runs the former
+read-modify-write (`product.quantity + n` in Python) for comparison, it loses updates under load.
+
+Usage (from the project root):
+    python -m benchmarks.inventory_stress --threads 16 --operations 200
+    python -m benchmarks.inventory_stress --threads 16 --operations 200 --naive
+
+The database is benchmarks/bench.db (SQLite) or BENCH_DATABASE_URL, prefer MySQL to see real row locking.
+Seeding drops every table first, never point it to a real database. Exit code 1 when a check fails.
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+
+from app import inventory
+from app.app import create_app
+from app.extensions import db
+from app.models import Product, StockMovement
+from benchmarks.config import BenchConfig
+from benchmarks.seed import seed
+
+
+def naive_change(product_id, change):
+    """
+    The former way: read the quantity, compute in Python, write it back
+    """
+    product = Product.find_by_id(product_id)
+    if product.quantity + change < 0:
+        raise inventory.OutOfStockError(product_id, -change)
+    product.quantity = product.quantity + change
+    db.session.add(product)
+
+
+def atomic_change(product_id, change):
+    if change > 0:
+        inventory.add(product_id, change, inventory.REASON_RESTOCK)
+    else:
+        inventory.remove(product_id, -change, inventory.REASON_CHECKOUT)
+
+
+def worker(app, change_stock, product_ids, operations, rng, totals, lock):
+    applied = dict((product_id, 0) for product_id in product_ids)
+    counts = dict(committed=0, out_of_stock=0, errors=0)
+    with app.app_context():
+        for _ in range(operations):
+            product_id = rng.choice(product_ids)
+            change = rng.choice([1, 2, 5]) * rng.choice([1, -1])
+            try:
+                change_stock(product_id, change)
+                db.session.commit()
+                applied[product_id] += change
+                counts['committed'] += 1
+            except inventory.OutOfStockError:
+                db.session.rollback()
+                counts['out_of_stock'] += 1
+            except Exception:
+                # lock wait timeout, database is locked (SQLite) ...
+                db.session.rollback()
+                counts['errors'] += 1
+        db.session.remove()
+    with lock:
+        for product_id, change in applied.items():
+            totals['applied'][product_id] += change
+        for key, value in counts.items():
+            totals[key] += value
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--threads', type=int, default=16, help='concurrent workers')
+    arg_parser.add_argument('--operations', type=int, default=200, help='stock changes per worker')
+    arg_parser.add_argument('--products', type=int, default=3, help='products shared by the workers')
+    arg_parser.add_argument('--stock', type=int, default=50, help='initial stock of each product')
+    arg_parser.add_argument('--naive', action='store_true', help='read-modify-write instead of app.inventory')
+    arg_parser.add_argument('--seed', type=int, default=42, help='random seed')
+    arg_parser.add_argument('--no-seed', action='store_true', help='reuse the products already in the database')
+    args = arg_parser.parse_args(argv)
+
+    app = create_app(config_object=BenchConfig)
+    with app.app_context():
+        if not args.no_seed:
+            print('Seeding {} ...'.format(BenchConfig.SQLALCHEMY_DATABASE_URI))
+            seed(products=max(args.products, 10), users=1, orders=0, seed_value=args.seed)
+        product_ids = [row[0] for row in db.session.query(Product.id).order_by(Product.id).limit(args.products)]
+        if not product_ids:
+            print('Database has no products, run without --no-seed')
+            return 1
+        Product.query.filter(Product.id.in_(product_ids)).update({Product.quantity: args.stock},
+                                                                 synchronize_session=False)
+        StockMovement.query.filter(StockMovement.product_id.in_(product_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+
+    totals = dict(applied=dict((product_id, 0) for product_id in product_ids), committed=0, out_of_stock=0,
+                  errors=0)
+    lock = threading.Lock()
+    rng = random.Random(args.seed)
+    change_stock = naive_change if args.naive else atomic_change
+    threads = [threading.Thread(target=worker, args=(app, change_stock, product_ids, args.operations,
+                                                     random.Random(rng.random()), totals, lock))
+               for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print('{} changes committed, {} refused (out of stock), {} errors in {:.2f}s'.format(
+        totals['committed'], totals['out_of_stock'], totals['errors'], elapsed))
+    failed = False
+    with app.app_context():
+        for product_id in product_ids:
+            quantity = Product.find_by_id(product_id).quantity
+            expected = args.stock + totals['applied'][product_id]
+            ledger = db.session.query(db.func.coalesce(db.func.sum(StockMovement.change), 0)) \
+                .filter(StockMovement.product_id == product_id).scalar()
+            ok = quantity == expected and quantity >= 0 and (args.naive or args.stock + int(ledger) == quantity)
+            failed = failed or not ok
+            print('{} stock {:>6} expected {:>6} ledger {:>+6}  {}'.format(
+                product_id, quantity, expected, int(ledger), 'OK' if ok else 'LOST UPDATES'))
+        db.session.remove()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
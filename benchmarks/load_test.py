@@ -0,0 +1,276 @@
+"""
+Load test of the storefront and admin API.
+
+Build the app on a seeded local database and replay the usual scenarios from concurrent
+virtual users, then report throughput and p50/p95/p99 latency per endpoint.
+
+Usage (from the project root):
+    python -m benchmarks.load_test --users 16 --duration 30
+    python -m benchmarks.load_test --url http://localhost:5000 --no-seed   # against a running server
+    python -m benchmarks.load_test --output bench.json --baseline old.json  # regression check
+
+The database is benchmarks/bench.db (SQLite) or BENCH_DATABASE_URL, e.g. a MySQL loaded with
+onlinebookstore_finallllll.sql. Seeding drops every table first, never point it to a real database.
+With --url, BENCH_DATABASE_URL must be the database of the server so users and products can be read.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib import request as urllib_request
+from urllib.error import HTTPError
+
+from app.app import create_app
+from app.extensions import db
+from benchmarks.config import BenchConfig
+from benchmarks.seed import seed, BENCH_PASSWORD, ADMIN_USER_NAME, WORDS
+
+
+class AppClient(object):
+    """
+    Call the app in process through the flask test client, one client per virtual user
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Authorization': 'Bearer ' + token} if token else {}
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient(object):
+    """
+    Call a running server over HTTP
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, token=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib_request.Request(self.base_url + path, data=data, method=method)
+        req.add_header('Content-Type', 'application/json')
+        if token:
+            req.add_header('Authorization', 'Bearer ' + token)
+        try:
+            with urllib_request.urlopen(req, timeout=60) as response:
+                return response.status, json.loads(response.read().decode('utf-8') or 'null')
+        except HTTPError as ex:
+            return ex.code, None
+
+
+class Recorder(object):
+    """
+    Thread safe store of (endpoint, latency, ok) samples
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, name, latency, ok):
+        with self.lock:
+            self.samples[name].append(latency)
+            if not ok:
+                self.errors[name] += 1
+
+
+class VirtualUser(object):
+    def __init__(self, client, recorder, rng, user_name, product_ids, category_ids):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.product_ids = product_ids
+        self.category_ids = category_ids
+        self.token = None
+        self.address_id = None
+        self.user_name = user_name
+
+    def call(self, name, method, path, body=None, token=None):
+        start = time.perf_counter()
+        status, data = self.client.request(method, path, body, token)
+        latency = time.perf_counter() - start
+        # business errors are answered with HTTP 200 and status=false
+        ok = status < 400 and (not isinstance(data, dict) or data.get('status', True) is not False)
+        self.recorder.add(name, latency, ok)
+        return data if ok and isinstance(data, dict) else None
+
+    def login(self):
+        data = self.call('POST /auth/login', 'POST', '/api/v1/auth/login',
+                         dict(username=self.user_name, password=BENCH_PASSWORD))
+        if data is None:
+            raise RuntimeError('Cannot login as {}'.format(self.user_name))
+        self.token = data['data']['access_token']
+        addresses = self.call('GET /addresses', 'GET', '/api/v1/addresses', token=self.token)
+        if addresses and addresses['data']:
+            self.address_id = addresses['data'][0]['id']
+
+    def browse_catalog(self):
+        self.call('GET /category', 'GET', '/api/v1/category')
+        query = '/api/v1/products?page={}&limit=20'.format(self.rng.randint(1, 20))
+        if self.category_ids and self.rng.random() < 0.5:
+            query += '&category=' + self.rng.choice(self.category_ids)
+        self.call('GET /products', 'GET', query)
+        self.call('GET /products/<id>', 'GET', '/api/v1/products/' + self.rng.choice(self.product_ids))
+
+    def search(self):
+        sort = self.rng.choice(['price,asc', 'price,desc', 'newest', 'oldest'])
+        self.call('GET /products?q', 'GET', '/api/v1/products?q={}&sort={}'.format(
+            self.rng.choice(WORDS).split(' ')[0], sort))
+
+    def add_to_cart(self):
+        self.call('POST /cart/add_to_cart', 'POST', '/api/v1/cart/add_to_cart',
+                  dict(product_id=self.rng.choice(self.product_ids), quantity=1), token=self.token)
+        self.call('GET /cart/get', 'GET', '/api/v1/cart/get', token=self.token)
+
+    def checkout(self):
+        self.add_to_cart()
+        self.call('POST /checkout', 'POST', '/api/v1/checkout/', dict(address_id=self.address_id),
+                  token=self.token)
+        self.call('GET /user/purchase', 'GET', '/api/v1/user/purchase?page=1', token=self.token)
+
+    def admin_dashboard(self):
+        self.call('GET /dashboard/best-seller', 'GET', '/api/v1/dashboard/best-seller', token=self.token)
+        self.call('GET /dashboard/best-revenue', 'GET', '/api/v1/dashboard/best-revenue', token=self.token)
+        self.call('GET /orders', 'GET', '/api/v1/orders?page=1&limit=20', token=self.token)
+        self.call('GET /products/all', 'GET', '/api/v1/products/all?page=1&limit=20')
+
+
+# (scenario, weight) of a customer session
+CUSTOMER_SCENARIOS = [
+    (VirtualUser.browse_catalog, 50),
+    (VirtualUser.search, 25),
+    (VirtualUser.add_to_cart, 15),
+    (VirtualUser.checkout, 10),
+]
+
+
+def run_user(user, is_admin, deadline, iterations):
+    user.login()
+    scenarios, weights = zip(*CUSTOMER_SCENARIOS)
+    done = 0
+    while time.perf_counter() < deadline and (not iterations or done < iterations):
+        if is_admin:
+            user.admin_dashboard()
+        else:
+            user.rng.choices(scenarios, weights)[0](user)
+        done += 1
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    if not sorted_values:
+        return 0
+    rank = max(int(math.ceil(percent / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[rank]
+
+
+def build_report(recorder, elapsed):
+    report = dict(elapsed=elapsed, endpoints={})
+    total = 0
+    for name in sorted(recorder.samples):
+        values = sorted(recorder.samples[name])
+        total += len(values)
+        report['endpoints'][name] = dict(
+            count=len(values),
+            errors=recorder.errors[name],
+            rps=len(values) / elapsed if elapsed else 0,
+            mean_ms=sum(values) / len(values) * 1000,
+            p50_ms=percentile(values, 50) * 1000,
+            p95_ms=percentile(values, 95) * 1000,
+            p99_ms=percentile(values, 99) * 1000,
+        )
+    report['total_requests'] = total
+    report['throughput_rps'] = total / elapsed if elapsed else 0
+    return report
+
+
+def print_report(report, baseline=None):
+    header = '{:<32} {:>7} {:>6} {:>8} {:>9} {:>9} {:>9}'.format(
+        'endpoint', 'count', 'errors', 'rps', 'p50 ms', 'p95 ms', 'p99 ms')
+    if baseline:
+        header += ' {:>10}'.format('p95 delta')
+    print(header)
+    print('-' * len(header))
+    for name, row in report['endpoints'].items():
+        line = '{:<32} {:>7} {:>6} {:>8.1f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            name, row['count'], row['errors'], row['rps'], row['p50_ms'], row['p95_ms'], row['p99_ms'])
+        old = (baseline or {}).get('endpoints', {}).get(name)
+        if old and old['p95_ms']:
+            line += ' {:>+9.1f}%'.format((row['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100)
+        print(line)
+    print('-' * len(header))
+    print('{} requests in {:.1f}s, {:.1f} req/s'.format(
+        report['total_requests'], report['elapsed'], report['throughput_rps']))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--url', help='base url of a running server, default: in process test client')
+    arg_parser.add_argument('--users', type=int, default=8, help='concurrent customers')
+    arg_parser.add_argument('--admins', type=int, default=1, help='concurrent admins on the dashboard')
+    arg_parser.add_argument('--duration', type=float, default=20, help='seconds to run')
+    arg_parser.add_argument('--iterations', type=int, default=0, help='scenarios per user, 0 = until duration')
+    arg_parser.add_argument('--products', type=int, default=1000, help='seeded products')
+    arg_parser.add_argument('--orders', type=int, default=500, help='seeded orders')
+    arg_parser.add_argument('--seed', type=int, default=42, help='random seed of data and scenarios')
+    arg_parser.add_argument('--no-seed', action='store_true', help='reuse the data already in the database')
+    arg_parser.add_argument('--output', help='write the report as json')
+    arg_parser.add_argument('--baseline', help='json report to compare p95 with')
+    args = arg_parser.parse_args(argv)
+
+    app = create_app(config_object=BenchConfig)
+    with app.app_context():
+        if not args.no_seed:
+            print('Seeding {} ...'.format(BenchConfig.SQLALCHEMY_DATABASE_URI))
+            seed(products=args.products, users=max(args.users, 1), orders=args.orders, seed_value=args.seed)
+        user_names = [row[0] for row in db.session.execute(
+            'SELECT user_name FROM users WHERE is_admin = :admin ORDER BY user_name', {'admin': False})]
+        admin_name = ADMIN_USER_NAME
+        product_ids = [row[0] for row in db.session.execute('SELECT id FROM products')]
+        category_ids = [row[0] for row in db.session.execute('SELECT id FROM categories')]
+        db.session.remove()
+    if not user_names or not product_ids:
+        print('Database has no users or products, run without --no-seed')
+        return 1
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    threads = []
+    start = time.perf_counter()
+    deadline = start + args.duration
+    for i in range(args.users + args.admins):
+        is_admin = i >= args.users
+        client = HttpClient(args.url) if args.url else AppClient(app)
+        user = VirtualUser(client, recorder, random.Random(rng.random()),
+                           admin_name if is_admin else user_names[i % len(user_names)], product_ids, category_ids)
+        thread = threading.Thread(target=run_user, args=(user, is_admin, deadline, args.iterations), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    report = build_report(recorder, elapsed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Micro benchmark of the "only buyers can review, once" check of POST /api/v1/reviews.
+
+Seeds a few customers with thousands of orders each, then times, for random (user, product) pairs,
+the former nested-subquery check (two statements) against PurchasedProduct.review_eligibility.
+
+Usage (from the project root):
+    python -m benchmarks.review_eligibility --users 3 --orders 10000 --checks 2000
+    python -m benchmarks.review_eligibility --no-seed   # reuse benchmarks/bench.db or BENCH_DATABASE_URL
+
+Seeding drops every table first, never point BENCH_DATABASE_URL to a real database.
+"""
+import argparse
+import random
+import sys
+import time
+
+from app.app import create_app
+from app.extensions import db
+from app.models import PurchasedProduct
+from benchmarks.config import BenchConfig
+from benchmarks.load_test import percentile
+from benchmarks.seed import seed
+
+LEGACY_BOUGHT = 'SELECT :product_id IN (SELECT product_id FROM order_details WHERE order_id IN ' \
+                '(SELECT id FROM orders WHERE user_id = :user_id))'
+LEGACY_REVIEWED = 'SELECT COUNT(*) FROM reviews WHERE product_id = :product_id AND user_id = :user_id ' \
+                  'GROUP BY product_id'
+
+
+def legacy_eligibility(user_id, product_id):
+    params = dict(user_id=user_id, product_id=product_id)
+    is_bought = bool(db.session.execute(LEGACY_BOUGHT, params).scalar())
+    is_review = bool(db.session.execute(LEGACY_REVIEWED, params).scalar())
+    return is_bought, is_review
+
+
+def timed(check, pairs):
+    """
+    :return: (sorted durations in seconds, answers)
+    """
+    durations, answers = [], []
+    for user_id, product_id in pairs:
+        start = time.perf_counter()
+        answers.append(check(user_id, product_id))
+        durations.append(time.perf_counter() - start)
+    return sorted(durations), answers
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--users', type=int, default=3, help='seeded customers, the orders are spread over them')
+    arg_parser.add_argument('--orders', type=int, default=10000, help='seeded orders')
+    arg_parser.add_argument('--products', type=int, default=2000, help='seeded products')
+    arg_parser.add_argument('--checks', type=int, default=2000, help='(user, product) pairs checked')
+    arg_parser.add_argument('--seed', type=int, default=42, help='random seed of data and pairs')
+    arg_parser.add_argument('--no-seed', action='store_true', help='reuse the data already in the database')
+    args = arg_parser.parse_args(argv)
+
+    app = create_app(config_object=BenchConfig)
+    with app.app_context():
+        if not args.no_seed:
+            print('Seeding {} ...'.format(BenchConfig.SQLALCHEMY_DATABASE_URI))
+            seed(products=args.products, users=args.users, orders=args.orders, seed_value=args.seed)
+        buyers = list(db.session.execute('SELECT user_id, COUNT(*) FROM orders GROUP BY user_id '
+                                         'ORDER BY COUNT(*) DESC LIMIT 10'))
+        product_ids = [row[0] for row in db.session.execute('SELECT id FROM products')]
+        if not buyers or not product_ids:
+            print('Database has no orders or products, run without --no-seed')
+            return 1
+        print('Buyers: {}'.format(', '.join('{} orders'.format(row[1]) for row in buyers)))
+
+        rng = random.Random(args.seed)
+        pairs = [(rng.choice(buyers)[0], rng.choice(product_ids)) for _ in range(args.checks)]
+        results = {}
+        for name, check in (('legacy', legacy_eligibility), ('eligibility', PurchasedProduct.review_eligibility)):
+            check(*pairs[0])  # warm up
+            results[name] = timed(check, pairs)
+        db.session.remove()
+
+    if results['legacy'][1] != results['eligibility'][1]:
+        print('Warning: the two checks disagree, is purchased_products up to date?')
+    header = '{:<12} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('check', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms')
+    print(header)
+    print('-' * len(header))
+    for name, (durations, _) in results.items():
+        print('{:<12} {:>7} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+            name, len(durations), sum(durations) / len(durations) * 1000, percentile(durations, 50) * 1000,
+            percentile(durations, 95) * 1000, percentile(durations, 99) * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,21 @@
+from app.extensions import db
+from migrate.seed_data import generate
+
+BENCH_PASSWORD = 'bench1234'
+# migrate.seed_data names users user0, user1, ... and the first `admins` of them are admins
+ADMIN_USER_NAME = 'user0'
+WORDS = ['sách', 'lịch', 'khoa', 'kinh', 'tâm', 'truyện', 'văn', 'python', 'thế', 'con']
+
+
+def seed(products=1000, users=50, orders=500, seed_value=42):
+    """
+    Drop and create the schema of the app database, then fill it with migrate.seed_data
+    :param products: number of products
+    :param users: number of customers, the admin is added on top
+    :param orders: number of orders spread over the customers
+    :param seed_value: random seed
+    """
+    db.session.remove()
+    generate(str(db.engine.url), counts=dict(categories=20, authors=200, publishers=20, products=products,
+                                             users=users + 1, orders=orders, admins=1),
+             seed=seed_value, workers=1, password=BENCH_PASSWORD, reset=True)
@@ -0,0 +1,167 @@
+"""
+Helpers shared by the migrate scripts to write many rows quickly
+"""
+import re
+import time
+
+# Multi-row statements are capped by bound parameters (SQLite) and max_allowed_packet (MySQL)
+MAX_PARAMS_PER_STATEMENT = 30000
+MAX_STATEMENT_BYTES = 1024 * 1024
+
+INSERT_RE = re.compile(r'^INSERT INTO\s+(`?\w+`?)\s*(\([^)]*\)\s*)?VALUES\s*(.*);$', re.IGNORECASE | re.DOTALL)
+CREATE_TABLE_RE = re.compile(r'^CREATE TABLE\s+(?:IF NOT EXISTS\s+)?(`?\w+`?)\s*\((.*)\)[^)]*;$',
+                             re.IGNORECASE | re.DOTALL)
+COLUMN_RE = re.compile(r'^\s*`(\w+)`', re.MULTILINE)
+SCHEMA_RE = re.compile(r'^(CREATE|DROP|ALTER|RENAME|TRUNCATE)\s', re.IGNORECASE)
+
+
+class Progress(object):
+    """
+    Print a single updating line: <label> <rows> rows <rate> rows/s
+    """
+
+    def __init__(self, label, verbose=True):
+        self.label = label
+        self.verbose = verbose
+        self.rows = 0
+        self.started = time.time()
+
+    def add(self, rows):
+        self.rows += rows
+        if self.verbose:
+            print('\r{:<16} {:>10} rows  {:>8.0f} rows/s'.format(
+                self.label, self.rows, self.rows / max(time.time() - self.started, 1e-6)), end='', flush=True)
+
+    def done(self):
+        if self.verbose:
+            print()
+        return self.rows
+
+
+def insert_rows(connection, table, rows, chunk_size=1000):
+    """
+    Insert rows with multi-row INSERT statements
+    :param connection: SQLAlchemy connection or session
+    :param table: sqlalchemy Table
+    :param rows: list of dict, all with the same keys
+    :param chunk_size: rows per statement
+    :return: number of inserted rows
+    """
+    if not rows:
+        return 0
+    chunk_size = max(1, min(chunk_size, MAX_PARAMS_PER_STATEMENT // len(rows[0])))
+    for start in range(0, len(rows), chunk_size):
+        connection.execute(table.insert().values(rows[start:start + chunk_size]))
+    return len(rows)
+
+
+def iter_sql_statements(lines):
+    """
+    Split a SQL script into statements without loading it in memory.
+    Quotes, backslash escapes, -- and /* */ comments are honored, so a ';' inside a value does not end a statement.
+    `delimiter ;;` lines of the mysql client (trigger bodies of a dump) change the end of statement.
+    :param lines: iterable of str, ex: an open file
+    :return: generator of statements, trailing ';' included
+    """
+    buffer = []
+    quote = None
+    escaped = False
+    block_comment = False
+    delimiter = ';'
+    for line in lines:
+        i, length = 0, len(line)
+        if quote is None and not block_comment and not ''.join(buffer).strip():
+            if line.lstrip().startswith('--'):
+                continue
+            if line.strip().lower().startswith('delimiter '):
+                delimiter = line.split(None, 1)[1].strip()
+                buffer = []
+                continue
+        while i < length:
+            char = line[i]
+            if block_comment:
+                if line.startswith('*/', i):
+                    block_comment = False
+                    i += 2
+                    continue
+                i += 1
+                continue
+            if quote is not None:
+                buffer.append(char)
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == quote:
+                    quote = None
+                i += 1
+                continue
+            if line.startswith('/*', i):
+                block_comment = True
+                i += 2
+                continue
+            if line.startswith('--', i) or char == '#':
+                break
+            if line.startswith(delimiter, i):
+                statement = ''.join(buffer).strip()
+                buffer = []
+                if statement:
+                    yield statement + ';'
+                i += len(delimiter)
+                continue
+            buffer.append(char)
+            if char in ('\'', '"', '`'):
+                quote = char
+            i += 1
+    statement = ''.join(buffer).strip()
+    if statement:
+        yield statement
+
+
+def iter_data_statements(statements):
+    """
+    Keep the rows of a dump, not its schema: CREATE / DROP / ALTER statements (tables, triggers) are skipped so
+    the tables stay as db.create_all made them. An INSERT without column list gets the columns of the CREATE TABLE
+    of the dump, the rows land in the right columns when the models have more columns than the dump.
+    :param statements: generator of iter_sql_statements
+    :return: generator of statements
+    """
+    columns = {}
+    for statement in statements:
+        match = CREATE_TABLE_RE.match(statement)
+        if match:
+            columns[match.group(1).strip('`')] = COLUMN_RE.findall(match.group(2))
+            continue
+        if SCHEMA_RE.match(statement):
+            continue
+        match = INSERT_RE.match(statement)
+        if match and match.group(2) is None and match.group(1).strip('`') in columns:
+            statement = 'INSERT INTO {} ({}) VALUES {};'.format(
+                match.group(1), ', '.join('`{}`'.format(name) for name in columns[match.group(1).strip('`')]),
+                match.group(3))
+        yield statement
+
+
+def iter_merged_inserts(statements, chunk_size=1000):
+    """
+    Merge consecutive single-row `INSERT INTO t [(columns)] VALUES (...)` of a dump into multi-row statements
+    :param statements: generator of iter_sql_statements
+    :param chunk_size: rows per merged statement
+    :return: generator of (statement, inserted rows)
+    """
+    target, values, size = None, [], 0
+    for statement in statements:
+        match = INSERT_RE.match(statement)
+        if match and match.group(1, 2) == target and len(values) < chunk_size and size < MAX_STATEMENT_BYTES:
+            values.append(match.group(3))
+            size += len(match.group(3))
+            continue
+        if values:
+            yield 'INSERT INTO {} {}VALUES {};'.format(target[0], target[1] or '', ','.join(values)), len(values)
+            target, values, size = None, [], 0
+        if match:
+            target, values, size = match.group(1, 2), [match.group(3)], len(match.group(3))
+        else:
+            yield statement, 0
+    if values:
+        yield 'INSERT INTO {} {}VALUES {};'.format(target[0], target[1] or '', ','.join(values)), len(values)
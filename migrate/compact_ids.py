@@ -0,0 +1,160 @@
+"""
+Rewrite the uuid1 ids of an existing database into the time-ordered ids of app.ids.
+
+The new id of a row is built from its created_at and a hash of its former id, so the rows keep their
+creation order in the primary key index and running the script again gives the same ids: an interrupted
+run can simply be started again, rows already migrated are skipped. For each table the columns
+referencing it are rewritten first, then its primary key, foreign key checks are disabled meanwhile.
+
+Stop the API first. Tokens carry the former user ids, users have to log in again after the migration.
+The mapping of one table is kept in memory (about 150 bytes per row).
+
+Usage (from the project root):
+    python -m migrate.compact_ids --dry-run
+    python -m migrate.compact_ids --commit-every 10000
+"""
+import argparse
+import hashlib
+import os
+import time
+
+from flask import Flask
+from sqlalchemy import bindparam, select
+
+from app import ids, models  # noqa: F401, models fill db.metadata
+from app.extensions import db
+from app.settings import ProdConfig, DevConfig
+from migrate.bulk import Progress
+
+# columns holding ids without a foreign key: (table, column) -> tables the ids belong to
+SOFT_REFERENCES = {
+    ('order_details', 'category_id'): ('categories',),
+    ('purchased_products', 'order_id'): ('orders',),
+    ('stock_movements', 'ref_id'): ('orders', 'product_cost'),
+    ('tokens', 'user_identity'): ('users',),
+    ('revoked_tokens', 'user_identity'): ('users',),
+}
+
+
+def is_new_id(value):
+    try:
+        ids.decode(value)
+        return True
+    except ValueError:
+        return False
+
+
+def migrated_id(old_id, created_at):
+    """
+    Time-ordered id of a row, always the same for the same row
+    :param created_at: seconds
+    """
+    randomness = int.from_bytes(hashlib.sha1(old_id.encode('utf-8')).digest()[:10], 'big')
+    return ids.id_from_time(int(created_at) * 1000, randomness)
+
+
+def id_tables():
+    """
+    Tables with a single string primary key `id`, in foreign key order
+    """
+    tables = []
+    for table in db.metadata.sorted_tables:
+        primary_key = list(table.primary_key.columns)
+        if len(primary_key) == 1 and primary_key[0].name == 'id' \
+                and isinstance(primary_key[0].type, db.String):
+            tables.append(table)
+    return tables
+
+
+def referencing_columns(table):
+    """
+    Columns of the other tables holding ids of `table`
+    """
+    columns = []
+    for other in db.metadata.sorted_tables:
+        for foreign_key in other.foreign_keys:
+            if foreign_key.column is table.c.id:
+                columns.append(foreign_key.parent)
+    for (table_name, column_name), targets in SOFT_REFERENCES.items():
+        if table.name in targets and table_name in db.metadata.tables:
+            columns.append(db.metadata.tables[table_name].c[column_name])
+    return columns
+
+
+class Migration(object):
+
+    def __init__(self, connection, commit_every=10000, dry_run=False):
+        self.connection = connection
+        self.commit_every = commit_every
+        self.dry_run = dry_run
+        self.started_at = int(time.time())
+
+    def mapping(self, table):
+        """
+        :return: dict former id -> new id of the rows not migrated yet
+        """
+        created_at = table.c.created_at if 'created_at' in table.c else None
+        query = select([table.c.id] + ([created_at] if created_at is not None else []))
+        mapping = {}
+        for row in self.connection.execute(query):
+            if not is_new_id(row[0]):
+                # rows without creation time get the time of the migration
+                mapping[row[0]] = migrated_id(row[0], (row[1] if created_at is not None else None) or self.started_at)
+        return mapping
+
+    def rewrite(self, column, mapping):
+        """
+        Replace the former ids of one column
+        :return: number of distinct ids replaced
+        """
+        values = [row[0] for row in self.connection.execute(select([column]).where(column.isnot(None)).distinct())]
+        params = [dict(old_value=value, new_value=mapping[value]) for value in values if value in mapping]
+        progress = Progress('{}.{}'.format(column.table.name, column.name)[:16])
+        if self.dry_run:
+            progress.add(len(params))
+            return progress.done()
+        statement = column.table.update().where(column == bindparam('old_value')) \
+            .values({column.name: bindparam('new_value')})
+        for start in range(0, len(params), self.commit_every):
+            with self.connection.begin():
+                self.connection.execute(statement, params[start:start + self.commit_every])
+            progress.add(len(params[start:start + self.commit_every]))
+        return progress.done()
+
+    def run(self):
+        is_mysql = self.connection.dialect.name == 'mysql'
+        if is_mysql:
+            self.connection.execute('SET FOREIGN_KEY_CHECKS = 0')
+        elif self.connection.dialect.name == 'sqlite':
+            self.connection.execute('PRAGMA foreign_keys = OFF')
+        try:
+            for table in id_tables():
+                mapping = self.mapping(table)
+                print('{}: {} ids to migrate'.format(table.name, len(mapping)))
+                if not mapping:
+                    continue
+                # referencing rows first, a rerun still finds the former id of the table to rebuild the mapping
+                for column in referencing_columns(table):
+                    self.rewrite(column, mapping)
+                self.rewrite(table.c.id, mapping)
+        finally:
+            if is_mysql:
+                self.connection.execute('SET FOREIGN_KEY_CHECKS = 1')
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Rewrite the uuid1 ids into time-ordered ids (app.ids)')
+    arg_parser.add_argument('--commit-every', type=int, default=10000, help='updated ids per transaction')
+    arg_parser.add_argument('--dry-run', action='store_true', help='only count the ids to migrate')
+    args = arg_parser.parse_args()
+
+    config = DevConfig if os.environ.get('FLASK_DEBUG') == '1' else ProdConfig
+    app = Flask(__name__)
+    app.config.from_object(config)
+    db.app = app
+    db.init_app(app)
+    with app.app_context():
+        print(f"Migrating ids on the uri: {config.SQLALCHEMY_DATABASE_URI}")
+        with db.engine.connect() as connection:
+            Migration(connection, commit_every=args.commit_every, dry_run=args.dry_run).run()
+    print("=" * 50, "Ids Migrate Completed", "=" * 50)
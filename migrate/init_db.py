@@ -1,12 +1,15 @@
+import argparse
 import os
 import json
-import uuid
 
 from flask import Flask
 
 from app.extensions import db
-from app.models import User
+from app.models import User, OrderDetail, ProductRating, PurchasedProduct
 from app.settings import ProdConfig, DevConfig
+from migrate.bulk import Progress, insert_rows, iter_sql_statements, iter_data_statements, iter_merged_inserts
+
+MIGRATE_DIR = os.path.abspath(os.path.dirname(__file__))
 
 
 class Worker:
@@ -14,9 +17,11 @@ class Worker:
     Drop all tables. Load default data from default.json and insert into new database
     """
 
-    def __init__(self):
+    def __init__(self, chunk_size=1000, commit_every=10000):
         print("=" * 50, "Starting migrate database", "=" * 50)
         config = DevConfig if os.environ.get('FLASK_DEBUG') == '1' else ProdConfig
+        self.chunk_size = chunk_size
+        self.commit_every = commit_every
 
         app = Flask(__name__)
         app.config.from_object(config)
@@ -29,21 +34,108 @@ class Worker:
         db.drop_all()  # drop all tables
         db.create_all()  # create a new schema
 
-        with open('default.json') as file:
+        with open(os.path.join(MIGRATE_DIR, 'default.json')) as file:
             self.default_users = json.load(file)
 
+    def bulk_insert(self, table, rows, label=None):
+        """
+        Insert rows with multi-row statements, commit every `commit_every` rows
+        :param table: sqlalchemy Table
+        :param rows: iterable of dict
+        :param label: progress label, default table name
+        :return: number of inserted rows
+        """
+        progress = Progress(label or table.name)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.commit_every:
+                progress.add(insert_rows(db.session, table, batch, self.chunk_size))
+                db.session.commit()
+                batch = []
+        progress.add(insert_rows(db.session, table, batch, self.chunk_size))
+        db.session.commit()
+        return progress.done()
+
     def create_default_users(self):
-        users = self.default_users
-        for item in users:
-            instance = User()
-            for key in item.keys():
-                instance.__setattr__(key, item[key])
-            db.session.add(instance)
+        return self.bulk_insert(User.__table__, self.default_users, label='users')
 
-        db.session.commit()
+    def load_seed_file(self, path):
+        """
+        Load a JSON file {"<table name>": [row, ...], ...}, tables are loaded in foreign key order
+        :param path: ex: catalog.json with categories, authors, publishers, products, product_images
+        """
+        with open(path) as file:
+            data = json.load(file)
+        unknown = set(data) - set(db.metadata.tables)
+        if unknown:
+            raise ValueError('Unknown tables in {}: {}'.format(path, ', '.join(sorted(unknown))))
+        total = 0
+        for table in db.metadata.sorted_tables:
+            if table.name in data:
+                total += self.bulk_insert(table, data[table.name])
+        return total
+
+    def load_sql_dump(self, path):
+        """
+        Stream the rows of a MySQL dump (ex: onlinebookstore_finallllll.sql) into the tables of create_all.
+        The schema of the dump is skipped: its tables lack the columns and indexes added since, and its
+        stock triggers would count every order line twice now that app.inventory updates the stock.
+        Consecutive single-row INSERTs are merged into multi-row statements and committed by chunks,
+        the dump is never loaded in memory.
+        """
+        connection = db.engine.raw_connection()
+        is_mysql = db.engine.dialect.name == 'mysql'
+        progress = Progress('dump')
+        pending = 0
+        try:
+            cursor = connection.cursor()
+            if is_mysql:
+                cursor.execute('SET autocommit = 0')
+                cursor.execute('SET unique_checks = 0')
+            with open(path, encoding='utf-8') as file:
+                statements = iter_data_statements(iter_sql_statements(file))
+                for statement, rows in iter_merged_inserts(statements, self.chunk_size):
+                    cursor.execute(statement)
+                    pending += rows
+                    if pending >= self.commit_every:
+                        connection.commit()
+                        pending = 0
+                    progress.add(rows)
+            connection.commit()
+            if is_mysql:
+                cursor.execute('SET unique_checks = 1')
+            cursor.close()
+        finally:
+            connection.close()
+        return progress.done()
+
+    def rebuild_derived_tables(self):
+        """
+        Fill the tables the app maintains at checkout / review time from the loaded orders and reviews
+        """
+        for label, rebuild in (('order snapshot', OrderDetail.backfill_snapshot),
+                               ('purchased', PurchasedProduct.rebuild), ('ratings', ProductRating.rebuild)):
+            progress = Progress(label)
+            progress.add(rebuild())
+            progress.done()
 
 
 if __name__ == '__main__':
-    worker = Worker()
-    worker.create_default_users()
+    arg_parser = argparse.ArgumentParser(description='Drop all tables, create the schema and load seed data')
+    arg_parser.add_argument('--dump', help='MySQL dump to load, ex: onlinebookstore_finallllll.sql')
+    arg_parser.add_argument('--seed-file', help='JSON file {"<table name>": [row, ...]} to load')
+    arg_parser.add_argument('--chunk-size', type=int, default=1000, help='rows per INSERT statement')
+    arg_parser.add_argument('--commit-every', type=int, default=10000, help='rows per transaction')
+    args = arg_parser.parse_args()
+
+    worker = Worker(chunk_size=args.chunk_size, commit_every=args.commit_every)
+    if args.dump:
+        # the dump already contains the default users
+        worker.load_sql_dump(args.dump)
+    else:
+        worker.create_default_users()
+    if args.seed_file:
+        worker.load_seed_file(args.seed_file)
+    worker.rebuild_derived_tables()
     print("=" * 50, "Database Migrate Completed", "=" * 50)
@@ -0,0 +1,293 @@
+"""
+Generate synthetic data for scale testing.
+
+Every row is derived from (--seed, table, row index), so the same arguments always produce the same
+database, and workers can reference rows of other tables (user, product, address...) by index
+without reading them back. Rows are written with multi-row INSERT statements, one chunk per
+statement, each worker process has its own connection.
+
+Usage (from the project root):
+    python -m migrate.seed_data --reset --users 100000 --products 50000 --orders 1000000 --workers 8
+    python -m migrate.seed_data --database-url sqlite:///scale.db --reset --orders 10000 --workers 1
+"""
+import argparse
+import os
+import random
+import time
+import uuid
+from multiprocessing import Pool
+
+from sqlalchemy import create_engine
+from werkzeug.security import generate_password_hash
+
+from app.extensions import db
+from app.models import User, TokenBlacklist, Category, Author, Publisher, Product, ProductImage, ProductCost, \
+    Address, Cart, CartItem, Order, OrderDetail, ProductReview, ProductRating, PurchasedProduct
+from app.settings import ProdConfig, DevConfig
+from migrate.bulk import Progress, insert_rows
+
+DEFAULT_COUNTS = dict(categories=50, authors=2000, publishers=200, products=50000, users=10000, orders=100000)
+DEFAULT_END_TIME = 1617235200  # 2021-04-01
+WORDS = ['sách', 'tiểu thuyết', 'lịch sử', 'khoa học', 'kinh tế', 'tâm lý', 'thiếu nhi', 'truyện', 'văn học',
+         'ngôn ngữ', 'python', 'flask', 'dữ liệu', 'tình yêu', 'hành trình', 'thế giới', 'con người', 'ký ức']
+CITIES = ['Hà Nội', 'Hồ Chí Minh', 'Đà Nẵng', 'Hải Phòng', 'Cần Thơ', 'Huế']
+
+_engine = None
+
+
+def row_id(seed, kind, index):
+    """
+    Deterministic id of the row `index` of table `kind`
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, '{}:{}:{}'.format(seed, kind, index)))
+
+
+class Generator(object):
+    """
+    Build the rows of one table slice [start, stop)
+    """
+
+    def __init__(self, seed, counts, end_time, password, days=365):
+        self.seed = seed
+        self.counts = counts
+        self.end_time = end_time
+        self.start_time = end_time - days * 24 * 3600
+        self.password = password
+
+    def rng(self, kind, start):
+        return random.Random('{}:{}:{}'.format(self.seed, kind, start))
+
+    def id(self, kind, index):
+        return row_id(self.seed, kind, index)
+
+    def timestamp(self, rng):
+        return rng.randint(self.start_time, self.end_time)
+
+    def categories(self, start, stop):
+        return {Category: [dict(id=self.id('category', i), name='Thể loại {}'.format(i), created_at=self.start_time)
+                           for i in range(start, stop)]}
+
+    def authors(self, start, stop):
+        return {Author: [dict(id=self.id('author', i), name='Tác giả {}'.format(i), info=None, picture=None,
+                              created_at=self.start_time) for i in range(start, stop)]}
+
+    def publishers(self, start, stop):
+        return {Publisher: [dict(id=self.id('publisher', i), name='Nhà xuất bản {}'.format(i),
+                                 created_at=self.start_time) for i in range(start, stop)]}
+
+    def products(self, start, stop):
+        rng = self.rng('product', start)
+        products, images, costs = [], [], []
+        for i in range(start, stop):
+            product_id = self.id('product', i)
+            created_at = self.timestamp(rng)
+            price = float(rng.randint(20, 500) * 1000)
+            quantity = rng.randint(0, 500)
+            products.append(dict(
+                id=product_id, created_at=created_at, updated_at=rng.randint(created_at, self.end_time),
+                title='{} {} {}'.format(rng.choice(WORDS), rng.choice(WORDS), i)[:80],
+                price=price, publish_year=rng.randint(1990, 2021), page_number=rng.randint(50, 900),
+                quantity=quantity, quotes_about=None, discount=float(rng.choice([0, 0, 0, 5000, 10000])),
+                start_at=None, end_at=None,
+                author_id=self.id('author', rng.randrange(self.counts['authors'])),
+                publisher_id=self.id('publisher', rng.randrange(self.counts['publishers'])),
+                category_id=self.id('category', rng.randrange(self.counts['categories']))))
+            images.append(dict(id=self.id('product_image', i), imageURL='https://example.com/books/{}.jpg'.format(i),
+                               filename='VLHB_shop/{}'.format(i), product_id=product_id))
+            cost = price * 0.7
+            costs.append(dict(id=self.id('product_cost', i), created_at=created_at, cost=cost, quantity=quantity,
+                              total=cost * quantity, content=None, product_id=product_id))
+        return {Product: products, ProductImage: images, ProductCost: costs}
+
+    def users(self, start, stop):
+        rng = self.rng('user', start)
+        users, addresses, carts, items, tokens = [], [], [], [], []
+        for i in range(start, stop):
+            user_id = self.id('user', i)
+            created_at = self.timestamp(rng)
+            users.append(dict(id=user_id, created_at=created_at, updated_at=None, avatar_url=None,
+                              nickname='Khách hàng {}'.format(i), user_name='user{}'.format(i),
+                              password=self.password, email='user{}@example.com'.format(i),
+                              phone='09{:08d}'.format(i % 100000000), status=True,
+                              is_admin=i < self.counts.get('admins', 1)))
+            addresses.append(dict(id=self.id('address', i), created_at=created_at, user_id=user_id, default=True,
+                                  name='Khách hàng {}'.format(i), phone='09{:08d}'.format(i % 100000000),
+                                  email=None, address='Số {}'.format(rng.randint(1, 200)), city=rng.choice(CITIES),
+                                  state='Phường {}'.format(rng.randint(1, 20)),
+                                  district='Quận {}'.format(rng.randint(1, 12))))
+            cart_id = self.id('cart', i)
+            updated_at = self.timestamp(rng)
+            carts.append(dict(id=cart_id, created_at=created_at, updated_at=updated_at, user_id=user_id, promo=None,
+                              content=None))
+            for j in range(rng.choice([0, 0, 1, 2, 3])):
+                product_index = rng.randrange(self.counts['products'])
+                items.append(dict(id=self.id('cart_item', '{}-{}'.format(i, j)), created_at=updated_at,
+                                  updated_at=updated_at, price=float(rng.randint(20, 500) * 1000), discount=0,
+                                  quantity=rng.randint(1, 3), content=None,
+                                  product_id=self.id('product', product_index), cart_id=cart_id))
+            for j in range(self.counts.get('tokens_per_user', 2)):
+                tokens.append(dict(jti=self.id('token', '{}-{}'.format(i, j)),
+                                   token_type=('access', 'refresh')[j % 2], user_identity=user_id,
+                                   revoked=rng.random() < 0.3, expires=self.timestamp(rng) + 30 * 24 * 3600))
+        return {User: users, Address: addresses, Cart: carts, CartItem: items, TokenBlacklist: tokens}
+
+    def orders(self, start, stop):
+        rng = self.rng('order', start)
+        orders, details, reviews = [], [], []
+        review_rate = self.counts.get('review_rate', 0.2)
+        for i in range(start, stop):
+            order_id = self.id('order', i)
+            user_index = rng.randrange(self.counts['users'])
+            created_at = self.timestamp(rng)
+            subtotal = item_discount = 0
+            for j in range(rng.choice([1, 1, 2, 2, 3, 4, 5])):
+                product_index = rng.randrange(self.counts['products'])
+                price = float(rng.randint(20, 500) * 1000)
+                discount = float(rng.choice([0, 0, 0, 5000]))
+                quantity = rng.randint(1, 3)
+                subtotal += price * quantity
+                item_discount += discount * quantity
+                details.append(dict(id=self.id('order_detail', '{}-{}'.format(i, j)), created_at=created_at,
+                                    updated_at=None, product_id=self.id('product', product_index),
+                                    order_id=order_id, price=price, quantity=quantity, discount=discount,
+                                    content=None))
+                if rng.random() < review_rate:
+                    rating = rng.choice([1, 2, 3, 4, 4, 5, 5, 5])
+                    reviews.append(dict(id=self.id('review', '{}-{}'.format(i, j)), created_at=created_at + 3600,
+                                        user_name='Khách hàng {}'.format(user_index),
+                                        title='Đánh giá {} sao'.format(rating), rating=rating, published=True,
+                                        published_at=created_at + 3600, content=None,
+                                        product_id=self.id('product', product_index),
+                                        user_id=self.id('user', user_index)))
+            total = subtotal + 20000 - item_discount
+            orders.append(dict(id=order_id, created_at=created_at, updated_at=created_at,
+                               status=rng.choice([0, 1, 1, 2, 3, 4, 4, 4]), subtotal=subtotal,
+                               item_discount=item_discount, tax=0, shipping=20000, total=total, promo=None,
+                               discount=0, grand_total=total, content=None, user_id=self.id('user', user_index),
+                               address_id=self.id('address', user_index)))
+        # parents first, the slice is inserted in dict order
+        return {Order: orders, OrderDetail: details, ProductReview: reviews}
+
+
+# Phases run one after another so foreign keys always point to existing rows
+PHASES = ['categories', 'authors', 'publishers', 'products', 'users', 'orders']
+
+
+def _init_worker(database_url):
+    global _engine
+    _engine = create_engine(database_url, **_engine_options(database_url))
+
+
+def _engine_options(database_url):
+    if database_url.startswith('sqlite'):
+        return dict(connect_args={'timeout': 60})
+    return dict(pool_pre_ping=True)
+
+
+def _run_job(job):
+    """
+    Generate and insert one slice inside its own transaction
+    :param job: (generator, phase, start, stop, chunk_size)
+    :return: number of inserted rows
+    """
+    generator, phase, start, stop, chunk_size = job
+    tables = getattr(generator, phase)(start, stop)
+    inserted = 0
+    with _engine.begin() as connection:
+        for model, rows in tables.items():
+            inserted += insert_rows(connection, model.__table__, rows, chunk_size)
+    return inserted
+
+
+def generate(database_url, counts=None, seed=42, workers=None, chunk_size=1000, slice_size=5000,
+             password='123456', end_time=DEFAULT_END_TIME, reset=False, verbose=True):
+    """
+    Fill the database with synthetic rows
+    :param database_url: SQLAlchemy database uri
+    :param counts: rows per entity, see DEFAULT_COUNTS, plus admins, tokens_per_user, review_rate
+    :param seed: random seed, same seed and counts give the same data
+    :param workers: worker processes, default cpu count (1 for SQLite, which has a single writer)
+    :param chunk_size: rows per INSERT statement
+    :param slice_size: rows generated and committed by one job
+    :param password: plain password of every generated user, user names are user0, user1, ...
+    :param end_time: most recent timestamp of the generated history
+    :param reset: drop and create every table first
+    :param verbose: print progress
+    :return: dict phase -> inserted rows
+    """
+    counts = dict(DEFAULT_COUNTS, **(counts or {}))
+    if workers is None:
+        workers = 1 if database_url.startswith('sqlite') else os.cpu_count() or 1
+
+    if reset:
+        engine = create_engine(database_url, **_engine_options(database_url))
+        db.Model.metadata.drop_all(engine)
+        db.Model.metadata.create_all(engine)
+        engine.dispose()
+
+    # hashing is slow on purpose, every generated user shares the same hash
+    generator = Generator(seed, counts, end_time, generate_password_hash(password))
+    summary = {}
+    if workers > 1:
+        pool = Pool(workers, initializer=_init_worker, initargs=(database_url,))
+        run = pool.imap_unordered
+    else:
+        _init_worker(database_url)
+        pool, run = None, map
+    try:
+        for phase in PHASES:
+            total = counts[phase]
+            jobs = [(generator, phase, start, min(start + slice_size, total), chunk_size)
+                    for start in range(0, total, slice_size)]
+            progress = Progress(phase, verbose)
+            for rows in run(_run_job, jobs):
+                progress.add(rows)
+            summary[phase] = progress.done()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # columns and tables derived from the generated rows, filled at checkout / review time by the app
+    engine = create_engine(database_url, **_engine_options(database_url))
+    with engine.begin() as connection:
+        for name, rebuild in (('order snapshot', OrderDetail.backfill_snapshot),
+                              ('purchased', PurchasedProduct.rebuild), ('ratings', ProductRating.rebuild)):
+            progress = Progress(name, verbose)
+            progress.add(rebuild(connection))
+            summary[name] = progress.done()
+    engine.dispose()
+    return summary
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    config = DevConfig if os.environ.get('FLASK_DEBUG') == '1' else ProdConfig
+    arg_parser.add_argument('--database-url', default=config.SQLALCHEMY_DATABASE_URI)
+    for name, value in DEFAULT_COUNTS.items():
+        arg_parser.add_argument('--' + name, type=int, default=value)
+    arg_parser.add_argument('--admins', type=int, default=1, help='first users are admins')
+    arg_parser.add_argument('--tokens-per-user', type=int, default=2)
+    arg_parser.add_argument('--review-rate', type=float, default=0.2, help='share of order lines reviewed')
+    arg_parser.add_argument('--seed', type=int, default=42)
+    arg_parser.add_argument('--workers', type=int, default=None)
+    arg_parser.add_argument('--chunk-size', type=int, default=1000, help='rows per INSERT statement')
+    arg_parser.add_argument('--slice-size', type=int, default=5000, help='rows per transaction')
+    arg_parser.add_argument('--password', default='123456')
+    arg_parser.add_argument('--end-time', type=int, default=DEFAULT_END_TIME)
+    arg_parser.add_argument('--reset', action='store_true', help='drop and create all tables first')
+    args = arg_parser.parse_args(argv)
+
+    counts = {name: getattr(args, name) for name in DEFAULT_COUNTS}
+    counts.update(admins=args.admins, tokens_per_user=args.tokens_per_user, review_rate=args.review_rate)
+    print("=" * 50, "Starting seed database", "=" * 50)
+    started = time.time()
+    summary = generate(args.database_url, counts, seed=args.seed, workers=args.workers, chunk_size=args.chunk_size,
+                       slice_size=args.slice_size, password=args.password, end_time=args.end_time,
+                       reset=args.reset)
+    rows = sum(summary[phase] for phase in PHASES)
+    print("=" * 50, "Seeded {} rows in {:.1f}s".format(rows, time.time() - started), "=" * 50)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Upgrade a database created by an older version of the app to the current models, keeping its rows.
+
+db.create_all() creates the missing tables but never changes an existing one: the columns, indexes and
+ON DELETE of foreign keys changed in the models since are applied here, then the order lines get their
+product snapshot. Every step looks at the schema first, running the script again does nothing.
+Stop the API first, the models expect the new columns.
+
+Usage (from the project root):
+    python -m migrate.upgrade --dry-run
+    python -m migrate.upgrade
+"""
+import argparse
+import os
+
+from flask import Flask
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn, CreateTable, CreateIndex
+
+from app.extensions import db
+from app.models import PurchasedProduct, ProductRating, OrderDetail
+from app.settings import ProdConfig, DevConfig
+
+# tables the app fills from other tables, rebuilt when this run creates them
+DERIVED_TABLES = {
+    'purchased_products': PurchasedProduct.rebuild,
+    'product_ratings': ProductRating.rebuild,
+}
+# foreign keys whose ON DELETE changed in the models: (table, column)
+FOREIGN_KEYS = [
+    # order lines keep their snapshot when the product is deleted, it was CASCADE
+    ('order_details', 'product_id'),
+]
+
+
+class Upgrade(object):
+
+    def __init__(self, connection, dry_run=False):
+        self.connection = connection
+        self.dry_run = dry_run
+
+    def inspector(self):
+        # a new one each time, the inspector caches the schema it has read
+        return inspect(self.connection)
+
+    def execute(self, label, statement):
+        print(('(dry run) ' if self.dry_run else '') + label)
+        if not self.dry_run:
+            self.connection.execute(statement)
+
+    def create_tables(self):
+        """
+        Create the tables missing from the database, ex: revoked_tokens
+        :return: names of the created tables
+        """
+        existing = set(self.inspector().get_table_names())
+        created = []
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing:
+                # CreateTable leaves out the indexes, create_indexes adds them
+                self.execute('create table ' + table.name, CreateTable(table))
+                created.append(table.name)
+        return created
+
+    def add_columns(self):
+        """
+        Add the columns of the models missing from their table, ex: users.token_epoch.
+        New columns are nullable or have a server default, the existing rows get NULL or the default.
+        """
+        inspector = self.inspector()
+        existing_tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = set(column['name'] for column in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name not in existing:
+                    definition = CreateColumn(column).compile(dialect=self.connection.dialect)
+                    self.execute('add column {}.{}'.format(table.name, column.name),
+                                 'ALTER TABLE {} ADD COLUMN {}'.format(table.name, definition))
+
+    def create_indexes(self):
+        """
+        Create the indexes of the models missing from their table, ex: ix_categories_name
+        """
+        inspector = self.inspector()
+        existing_tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            existing = set(index['name'] for index in inspector.get_indexes(table.name)) \
+                if table.name in existing_tables else set()
+            for index in table.indexes:
+                if index.name not in existing:
+                    self.execute('create index ' + index.name, CreateIndex(index))
+
+    def update_foreign_keys(self):
+        """
+        Recreate the foreign keys of FOREIGN_KEYS whose ON DELETE differs from the model, MySQL only
+        """
+        inspector = self.inspector()
+        for table_name, column_name in FOREIGN_KEYS:
+            column = db.metadata.tables[table_name].c[column_name]
+            model_key = list(column.foreign_keys)[0]
+            ondelete = (model_key.ondelete or 'RESTRICT').upper()
+            for foreign_key in inspector.get_foreign_keys(table_name):
+                current = (foreign_key['options'].get('ondelete') or 'RESTRICT').upper()
+                if foreign_key['constrained_columns'] != [column_name] or current == ondelete:
+                    continue
+                if self.connection.dialect.name != 'mysql':
+                    print('{}.{} keeps ON DELETE {}: {} cannot alter a foreign key'.format(
+                        table_name, column_name, current, self.connection.dialect.name))
+                    continue
+                name = foreign_key['name']
+                self.execute('drop foreign key {}.{}'.format(table_name, name),
+                             'ALTER TABLE {} DROP FOREIGN KEY {}'.format(table_name, name))
+                self.execute('add foreign key {}.{} ON DELETE {}'.format(table_name, name, ondelete),
+                             'ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY ({}) REFERENCES {} ({}) ON DELETE {}'.format(
+                                 table_name, name, column_name, model_key.column.table.name, model_key.column.name,
+                                 ondelete))
+
+    def run(self):
+        created = self.create_tables()
+        self.add_columns()
+        self.create_indexes()
+        self.update_foreign_keys()
+        if not self.dry_run:
+            # order lines written before the snapshot columns existed
+            print('order snapshot: {} order lines'.format(OrderDetail.backfill_snapshot(self.connection)))
+        for name, rebuild in DERIVED_TABLES.items():
+            if name in created and not self.dry_run:
+                print('rebuild {}: {} rows'.format(name, rebuild(self.connection)))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Upgrade an existing database to the current models')
+    arg_parser.add_argument('--dry-run', action='store_true', help='only print the changes')
+    args = arg_parser.parse_args()
+
+    config = DevConfig if os.environ.get('FLASK_DEBUG') == '1' else ProdConfig
+    app = Flask(__name__)
+    app.config.from_object(config)
+    db.app = app
+    db.init_app(app)
+    with app.app_context():
+        print(f"Upgrading the database on the uri: {config.SQLALCHEMY_DATABASE_URI}")
+        with db.engine.connect() as connection:
+            Upgrade(connection, dry_run=args.dry_run).run()
+    print("=" * 50, "Database Upgrade Completed", "=" * 50)
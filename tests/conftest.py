@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from app.app import create_app
+from app.extensions import db
+from app.settings import Config
+
+
+class TestConfig(Config):
+    """Test configuration, SQLite file of the test unless TEST_DATABASE_URL is set (prefer MySQL for row locks)."""
+    ENV = 'test'
+    DEBUG = False
+    TESTING = True
+    JWT_SECRET_KEY = 'test-secret'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    METRICS_ENABLED = False
+    RATELIMIT_ENABLED = False
+    COMPRESS_ENABLED = False
+
+
+@pytest.fixture
+def app(tmp_path):
+    uri = os.environ.get('TEST_DATABASE_URL', 'sqlite:///' + str(tmp_path / 'test.db'))
+    config = type('TestConfig', (TestConfig,), dict(
+        SQLALCHEMY_DATABASE_URI=uri,
+        # threads of a test wait for the write lock of the SQLite file instead of failing
+        SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}} if uri.startswith('sqlite') else {}))
+    app = create_app(config_object=config)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.remove()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
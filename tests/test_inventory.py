@@ -0,0 +1,132 @@
+"""
+Concurrency test of app.inventory: threads restock and sell the same products at the same time.
+"""
+import random
+import threading
+
+import pytest
+from sqlalchemy import select, func
+
+from app import inventory
+from app.extensions import db
+from app.ids import new_id
+from app.models import Product, Category, Author, Publisher, StockMovement
+from app.utils import get_datetime_now_s
+
+THREADS = 8
+OPERATIONS = 100
+PRODUCTS = 3
+STOCK = 10
+
+
+def create_products(count, stock):
+    now = get_datetime_now_s()
+    category, author, publisher = new_id(), new_id(), new_id()
+    db.session.execute(Category.__table__.insert().values(id=category, name='Category', created_at=now))
+    db.session.execute(Author.__table__.insert().values(id=author, name='Author', created_at=now))
+    db.session.execute(Publisher.__table__.insert().values(id=publisher, name='Publisher', created_at=now))
+    product_ids = [new_id() for _ in range(count)]
+    db.session.execute(Product.__table__.insert(), [
+        dict(id=_id, created_at=now, updated_at=now, title='Product {}'.format(i), price=100000, quantity=0,
+             discount=0, category_id=category, author_id=author, publisher_id=publisher)
+        for i, _id in enumerate(product_ids)])
+    # the initial stock goes through the ledger too, the sum of the movements is the quantity
+    inventory.add_many(dict((_id, stock) for _id in product_ids), inventory.REASON_CREATE)
+    db.session.commit()
+    return product_ids
+
+
+def quantities(product_ids):
+    table = Product.__table__
+    # a 1.3 ResultProxy has keys(), dict() would take it for a mapping
+    rows = db.session.execute(select([table.c.id, table.c.quantity]).where(table.c.id.in_(product_ids)))
+    return {row[0]: row[1] for row in rows}
+
+
+def change_stock(app, product_ids, seed, applied, counts, lock):
+    rng = random.Random(seed)
+    mine = dict((_id, 0) for _id in product_ids)
+    out_of_stock = 0
+    with app.app_context():
+        for _ in range(OPERATIONS):
+            product_id = rng.choice(product_ids)
+            quantity = rng.choice([1, 2, 5])
+            try:
+                # more sales than restocks, the stock runs out often
+                if rng.random() < 0.4:
+                    inventory.add(product_id, quantity, inventory.REASON_RESTOCK)
+                    change = quantity
+                else:
+                    inventory.remove(product_id, quantity, inventory.REASON_CHECKOUT)
+                    change = -quantity
+                db.session.commit()
+                mine[product_id] += change
+            except inventory.OutOfStockError:
+                db.session.rollback()
+                out_of_stock += 1
+        db.session.remove()
+    with lock:
+        for _id, change in mine.items():
+            applied[_id] += change
+        counts['out_of_stock'] += out_of_stock
+
+
+def watch_stock(app, product_ids, stop, lowest):
+    with app.app_context():
+        while not stop.is_set():
+            for quantity in quantities(product_ids).values():
+                lowest[0] = min(lowest[0], quantity)
+            db.session.rollback()
+        db.session.remove()
+
+
+def test_concurrent_restock_and_checkout(app):
+    with app.app_context():
+        product_ids = create_products(PRODUCTS, STOCK)
+        db.session.remove()
+
+    applied = dict((_id, 0) for _id in product_ids)
+    counts = dict(out_of_stock=0)
+    lock = threading.Lock()
+    stop = threading.Event()
+    lowest = [STOCK]
+    watcher = threading.Thread(target=watch_stock, args=(app, product_ids, stop, lowest))
+    threads = [threading.Thread(target=change_stock, args=(app, product_ids, seed, applied, counts, lock))
+               for seed in range(THREADS)]
+    watcher.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    watcher.join()
+
+    with app.app_context():
+        final = quantities(product_ids)
+        rows = db.session.execute(select([StockMovement.product_id, func.sum(StockMovement.change)])
+                                  .where(StockMovement.product_id.in_(product_ids))
+                                  .group_by(StockMovement.product_id))
+        ledger = {row[0]: row[1] for row in rows}
+        db.session.remove()
+
+    # the stock ran out at least once, the conditional decrements were exercised
+    assert counts['out_of_stock'] > 0
+    assert lowest[0] >= 0
+    for _id in product_ids:
+        # no lost update: every committed change is in the final quantity
+        assert final[_id] == STOCK + applied[_id]
+        assert final[_id] >= 0
+        assert int(ledger[_id]) == final[_id]
+
+
+def test_remove_refuses_more_than_the_stock(app):
+    with app.app_context():
+        product_id = create_products(1, 3)[0]
+        with pytest.raises(inventory.OutOfStockError):
+            inventory.remove(product_id, 4, inventory.REASON_CHECKOUT)
+        db.session.rollback()
+        inventory.remove(product_id, 3, inventory.REASON_CHECKOUT)
+        db.session.commit()
+        assert quantities([product_id])[product_id] == 0
+        assert db.session.query(func.count(StockMovement.id)) \
+            .filter(StockMovement.product_id == product_id).scalar() == 2